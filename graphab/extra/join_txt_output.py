@@ -2,7 +2,6 @@ from osgeo import gdal, ogr, gdal_array
 import pandas as pd
 import numpy as np
 import os
-import csv
 
 # specify path to input tiff and txt files
 path = r'c:\Users\kriukovv\Documents\Graphab\outputs'
@@ -17,21 +16,23 @@ if tif_dataset is None:
     exit()
 
 # read the values from txt file
-csv_values = {}
-with open(txt_path, 'r') as csv_file:
-    csv_reader = csv.reader(csv_file, delimiter='\t')
-    next(csv_reader)  # skip the header row
-    next(csv_reader)  # skip the second line because it shows the initial value of delta index
-    for row in csv_reader:
-        id_value = int(row[0])
-        csv_values[id_value] = float(row[1]) 
+# skip the header row and the second line because it shows the initial value of delta index
+txt_values = np.loadtxt(txt_path, delimiter='\t', skiprows=2, usecols=(0, 1), ndmin=2)
+# sort patch ids to look them up with np.searchsorted
+order = np.argsort(txt_values[:, 0], kind='stable')
+patch_ids = txt_values[order, 0].astype(np.int64)
+patch_values = txt_values[order, 1]
 
 # get the raster band from the TIFF file
 tif_band = tif_dataset.GetRasterBand(1)
 tif_data = tif_band.ReadAsArray()
 
-# create a new band with values from the txt file
-new_band_data = np.array([[csv_values.get(int(value), 0) for value in row] for row in tif_data])
+# create a new band with values from the txt file (0 where patch id is not in the txt file)
+tif_ids = tif_data.astype(np.int64)
+index = np.searchsorted(patch_ids, tif_ids)
+index[index == len(patch_ids)] = 0
+in_txt = patch_ids[index] == tif_ids
+new_band_data = np.where(in_txt, patch_values[index], 0)
 
 # create a new TIFF file with the original band and the new band
 driver = gdal.GetDriverByName('GTiff')
@@ -2,18 +2,19 @@ import numpy as np
 
 # auxiliary libraries
 import subprocess
-from subprocess import Popen, PIPE
 import yaml
 import os
-from osgeo import ogr, gdal
+from osgeo import gdal
 import multiprocessing
 from typer import prompt
 
 # local modules
-from utils import load_yaml,extract_attribute_values_from_gpkg,get_lulc_template,read_years_from_config
+from utils import load_yaml,extract_attribute_values_from_gpkg,get_lulc_template,read_years_from_config,block_windows,create_tiled_raster
 from raster_metadata import RasterMetadata
 from .lulc_data_processor import LULCDataPreprocessor
 from .vector_data_processor import VectorDataPreprocessor
+from .rasterization_engine import RasterizationEngine, init_rasterization_worker, rasterize_task
+from scheduler import estimate_raster_memory
 
 
 class LULCEnrichmentWrapper():
@@ -51,6 +52,10 @@ class LULCEnrichmentWrapper():
 
         self.osm_api_type = osm_api_type
         self.max_threads = threads
+        # vector files of roads and railways to rasterize, with the half widths of centerlines burnt without buffering (None for buffered layers)
+        self.line_layers = {}
+        # road types of user vector files, selected once for all years (see select_road_types)
+        self.selected_road_types = None
 
 
     def initialise_data_processors(self, year:int):
@@ -66,18 +71,43 @@ class LULCEnrichmentWrapper():
         ## OSM PREPROCESSING
         self.vp = VectorDataPreprocessor(self.config, self.working_dir, self.vector_dir, year, self.lp.raster_metadata.crs_info["epsg"], self.lp.raster_metadata.is_cartesian)
 
-    def buffer_vector_roads_and_railways(self):
+    def buffer_vector_roads_and_railways(self, in_memory:bool=False):
         """
         Buffer vector railway and road features to be used for rasterization.
-        """
-        self.vp.buffer_features('railways', self.vp.vector_railways_buffered, self.vp.lulc_crs)
-        self.vp.buffer_features('roads', self.vp.vector_roads_buffered, self.vp.lulc_crs)
+        Buffered geometries are valid by construction (shapely.buffer), so they are not validated again.
 
-        # check the buffered vector files
-        files_to_validate = [self.vp.vector_roads_buffered, self.vp.vector_railways_buffered]
-        self.vp.check_vector_geometry_validity(files_to_validate)
+        Args:
+            in_memory (bool): keep the buffered layers in memory instead of writing *_buffered.gpkg files (only if they are rasterized in the current process)
+        """
+        if in_memory:
+            self.vp.vector_railways_buffered = f"/vsimem/railways_{self.vp.year}_buffered.gpkg"
+            self.vp.vector_roads_buffered = f"/vsimem/roads_{self.vp.year}_buffered.gpkg"
+        self.vp.buffer_features('railways', self.vp.vector_railways_buffered, self.vp.lulc_crs, self.max_threads)
+        self.vp.buffer_features('roads', self.vp.vector_roads_buffered, self.vp.lulc_crs, self.max_threads)
+        self.line_layers = {'railways': (self.vp.vector_railways_buffered, None), 'roads': (self.vp.vector_roads_buffered, None)}
+
+    def prepare_centerlines_of_roads_and_railways(self, in_memory:bool=False):
+        """
+        Prepare railway and road centerlines with their buffer widths, so that their footprint is rasterized directly on the LULC grid
+        from the distance to the centerlines instead of rasterizing buffered polygons (see RasterizationEngine.burn_centerlines).
+        Buffer widths are in meters, so features are buffered instead if the LULC data is not in cartesian coordinates.
 
-    def merge_lulc_osm_data(self, year:int, save_osm_stressors:bool, cog_compress:bool):
+        Args:
+            in_memory (bool): keep the centerlines in memory instead of writing *_centerlines.gpkg files (only if they are rasterized in the current process)
+        """
+        if self.vp.lulc_is_cartesian == False:
+            print("LULC data is not in cartesian coordinates, so roads and railways are buffered instead.")
+            self.buffer_vector_roads_and_railways(in_memory)
+            return
+
+        if in_memory:
+            self.vp.vector_railways_centerlines = f"/vsimem/railways_{self.vp.year}_centerlines.gpkg"
+            self.vp.vector_roads_centerlines = f"/vsimem/roads_{self.vp.year}_centerlines.gpkg"
+        railways_half_widths = self.vp.centerline_features('railways', self.vp.vector_railways_centerlines)
+        roads_half_widths = self.vp.centerline_features('roads', self.vp.vector_roads_centerlines)
+        self.line_layers = {'railways': (self.vp.vector_railways_centerlines, railways_half_widths), 'roads': (self.vp.vector_roads_centerlines, roads_half_widths)}
+
+    def merge_lulc_osm_data(self, year:int, save_osm_stressors:bool, cog_compress:bool, single_pass:bool=False):
         """
         Merges the LULC and OSM data into a single raster dataset.
 
@@ -85,7 +115,12 @@ class LULCEnrichmentWrapper():
             year (int): year of the data to process
             save_osm_stressors (bool): flag to save the OSM stressors to a file for impedance recalculation
             cog_compress (bool): flag to compress the output raster as a Cloud Optimised Geotiff
+            single_pass (bool): flag to burn all OSM layers directly into the LULC dataset instead of merging rasterized layers
         """
+        # stressor rasters saved for impedance recalculation are reused as layers to merge, so they are only rasterized once
+        if single_pass and not save_osm_stressors:
+            self.burn_lulc_osm_data(year, cog_compress)
+            return
         
         ## rasterize vector layers
         self.rasters_temp = self.rasterize_vector_layers(year, save_osm_stressors)
@@ -102,11 +137,46 @@ class LULCEnrichmentWrapper():
 
         # overwrite rasters over input dataset in the following order: waterbodies, waterways, roads, railways
         # NOTE: HARDCODED NODATA VALUE as output LULC contains only positive integer values, so 0 is the best choice
-        output_data, output_ds, nodata_value = self.overwrite_raster(self.lulc_filepaths[year], *self.rasters_temp, nodata_value=0)
-        print(f"FOR WRITING UPDATED LULC RASTER: {output_data, output_ds, nodata_value}")
-        self.write_raster(output_data, output_ds, lulc_upd, nodata_value, cog_compress)
+        self.overwrite_raster(self.lulc_filepaths[year], *self.rasters_temp, nodata_value=0, output_raster=lulc_upd, cog_compress=cog_compress)
         # TODO - output dataset is not being assigned correctly nodatavalue - it is byte, but inherits 0 as nodatavalue from OSM stressors and -9999 from LULC stressors
 
+    def burn_lulc_osm_data(self, year:int, cog_compress:bool):
+        """
+        Burns all OSM layers into an in-memory copy of the LULC dataset in priority order (vineyards, waterbodies, waterways, roads, railways), 
+        so that later layers overwrite earlier ones as in overwrite_raster, and writes the enriched LULC directly without writing rasterized stressors.
+
+        Args:
+            year (int): year of the data to process
+            cog_compress (bool): flag to compress the output raster as a Cloud Optimised Geotiff
+        """
+        road_types = self.get_road_types(self.line_layers['roads'][0], 'roads', groupby_roads=True)
+
+        layers = [
+            (self.vp.vector_refine, 'vineyards', self.lp.lulc_codes["lulc_vineyard"], None, None),
+            (self.vp.vector_refine, 'waterbodies', self.lp.lulc_codes["lulc_water"], None, None),
+            (self.vp.vector_refine, 'waterways', self.lp.lulc_codes["lulc_water"], None, None)
+        ]
+        # all road types are burnt at once with a single attribute filter (no roads are burnt if no road type is selected)
+        if road_types:
+            roads_filter = " OR ".join(f"highway LIKE '%{road_type}%'" for road_type in road_types)
+            layers.append((self.line_layers['roads'][0], 'roads', self.lp.lulc_codes["lulc_road"], roads_filter, self.line_layers['roads'][1]))
+        layers.append((self.line_layers['railways'][0], 'railways', self.lp.lulc_codes["lulc_railway"], None, self.line_layers['railways'][1]))
+        # Order is important (the last layer has the highest priority)
+
+        lulc_upd = os.path.normpath(os.path.join(self.working_dir,self.output_dir,f'lulc_{year}_upd.tif'))
+        if self.verbose:
+            print(f"Enriched land-use/land-cover dataset(s) will be fetched to {lulc_upd}")
+
+        engine = RasterizationEngine(self.lp.raster_metadata, list(self.lulc_filepaths.values()), nodata_value=0)
+        output_ds = engine.burn_into_raster(self.lulc_filepaths[year], layers)
+        engine.close()
+        # release the buffered layers (or centerlines) kept in memory
+        for line_path, _ in self.line_layers.values():
+            if line_path.startswith("/vsimem/"):
+                gdal.Unlink(line_path)
+        # NOTE: HARDCODED NODATA VALUE as output LULC contains only positive integer values, so 0 is the best choice
+        self.write_raster(output_ds.GetRasterBand(1).ReadAsArray(), output_ds, lulc_upd, 0, cog_compress)
+
     def merge_tiffs_into_vrt(self, tiffs:list, output_path:str):
         """
         Merge multiple raster datasets into a single VRT file.
@@ -186,110 +256,103 @@ class LULCEnrichmentWrapper():
         output_ds = None  # close the input file
 
         if cog_compress:
-            print("Saving enriched LULC as a compressed Cloud Optimised Geotiff...")
+            self.convert_to_cog(temp_output_raster, output_raster)
 
-            # open temp_raster as a GDAL dataset before passing it
-            temp_ds = gdal.Open(temp_output_raster, gdal.GA_ReadOnly) 
+        print(f"Output raster saved to {output_raster}")
 
-            cog_driver = gdal.GetDriverByName("COG")
-            cog_driver.CreateCopy(
-                output_raster, temp_ds,
-                options=['COMPRESS=LZW', 'BIGTIFF=IF_SAFER', 'OVERVIEWS=AUTO']
-            )
-            
-            temp_ds = None
-            os.remove(temp_output_raster)
+    def convert_to_cog(self, temp_output_raster:str, output_raster:str):
+        """
+        Convert a raster dataset to a compressed Cloud Optimised Geotiff and remove the temporary raster.
 
-        print(f"Output raster saved to {output_raster}")
+        Args:
+            temp_output_raster (str): path to the temporary raster dataset
+            output_raster (str): path to the output Cloud Optimised Geotiff
+        """
+        print("Saving enriched LULC as a compressed Cloud Optimised Geotiff...")
+
+        # open temp_raster as a GDAL dataset before passing it
+        temp_ds = gdal.Open(temp_output_raster, gdal.GA_ReadOnly) 
+
+        cog_driver = gdal.GetDriverByName("COG")
+        cog_driver.CreateCopy(
+            output_raster, temp_ds,
+            options=['COMPRESS=LZW', 'BIGTIFF=IF_SAFER', 'OVERVIEWS=AUTO']
+        )
+        
+        temp_ds = None
+        os.remove(temp_output_raster)
 
-    def filter_gpkg_by_attributes(self, vector_gpkg:str, layer_name:str, attribute:str, value:str, output_gpkg:str):
+    def select_road_types(self, years:list, interactive:bool=True) -> list:
         """
-        Create a new layer from the input layer based on the attribute value.
+        Selects the road types (OSM highway types) of the user vector files once for all years, in the main process before years are dispatched 
+        to worker processes, so that the user is not prompted by each year. Road types of OSM data are read from the configuration file (see get_road_types).
 
         Args:
-            vector_gpkg (str): path to the input vector GeoPackage file
-            layer_name (str): name of the layer to extract features from
-            attribute (str): attribute name to filter by
-            value (str): value to filter by
-            output_gpkg (str): path to the output GeoPackage file
+            years (list): years of the user vector files
+            interactive (bool): prompt the user to confirm or select the road types (all detected road types are selected otherwise)
 
         Returns:
-            str: path to the output GeoPackage file
+            list: list of selected road types (None if no user vector file is configured)
         """
-        print("Layer to access:", layer_name)
-        ogr_command = f"""
-            ogr2ogr -f GPKG {output_gpkg} {vector_gpkg} -sql "SELECT * FROM {layer_name} WHERE {attribute} LIKE '%{value}%'"
+        if self.config.get('user_vector', None) is None:
+            return None
+        road_types = []
+        for year in years:
+            user_vector = os.path.normpath(os.path.join(self.vector_dir, self.config.get('user_vector').format(year=year)))
+            road_types += [road_type for road_type in extract_attribute_values_from_gpkg(user_vector, 'roads', attribute='highway') if road_type not in road_types]
+        if interactive:
+            road_types = self.confirm_road_types(road_types)
+        else:
+            print(f"Road types found in the input vector files: {road_types}")
+        self.selected_road_types = road_types
+        return road_types
+
+    def confirm_road_types(self, road_types:list) -> list:
         """
-        # DEBUG: print the command to extract the subtypes of stressors from the vector dataset
-        if self.verbose:
-            print(f"The following command to extract features:\n{ogr_command}")
-        proc = Popen(ogr_command, shell=True, stdout=PIPE, stderr=PIPE)
-        stdout, stderr = proc.communicate()
-        if proc.returncode != 0:
-            raise RuntimeError(stderr)
-        
-        print(f"New layer saved to {output_gpkg}")
-
-        # TODO - probably to move from PIPE to subprocess.run as takes more time
-
-        # # define ogr2ogr command
-        # ogr2ogr_cmd = [
-        #     'ogr2ogr',
-        #     '-f', 'GPKG',
-        #     output_gpkg,
-        #     vector_gpkg,
-        #     '-dialect', 'SQLite',
-        #     '-sql', sql_statement
-        # ]
-
-        # # execute ogr2ogr command through subprocess
-        # subprocess.run(ogr2ogr_cmd, check=True)
-        
-        return output_gpkg
-   
-    def rasterize_vector_roads(self, year:int, output_dir:str, raster_metadata:str ,roads_gpkg:str, burn_value:int, groupby_roads:bool):
+        Prompts the user to confirm the detected road types or to enter a list of road types from them.
+
+        Args:
+            road_types (list): road types detected in the input vector files
+
+        Returns:
+            list: list of confirmed road types
         """
-        Rasterize roads vector layer to be used for enriching the LULC dataset.
+        confirm = str(prompt(
+            "Type 'yes' to confirm stressor types, or enter the list of stressor (OSM highway) types from the following list of detected road types:\n ", 
+            road_types,
+            type=str
+        )).lower()
+        if confirm == "yes" or confirm == "y":
+            print(f"Road types found in the input vector file: {road_types}")
+            return road_types
+        while True:
+            valid = True
+            user_input = confirm.split(",")
+            for road_type in user_input:
+                if road_type not in road_types:
+                    valid = False
+                    print(f"Invalid input: {road_type}")
+            if valid:
+                return user_input
+            confirm = str(prompt("Enter the list of stressor (OSM highway) types from the following list: ", road_types,type=str)).lower()
+
+    def get_road_types(self, roads_gpkg:str, road_layer_name:str, groupby_roads:bool) -> list:
+        """
+        Get the road types (OSM highway types) to rasterize from the input vector file or the configuration file.
 
         Args:
-            year (int): year of the data to process
-            output_dir (str): path to the output directory
-            raster_metadata (RasterMetadata): object containing raster metadata (extent, cell size, etc.)
             roads_gpkg (str): path to the roads GeoPackage file
-            burn_val (int): value to burn into the output raster 
+            road_layer_name (str): name of the roads layer
             groupby_roads (bool): flag to group road types by suffix (e.g. primary, secondary, tertiary)
-            
+
         Returns:
-            dict: dictionary containing road type stressors.
+            list: list of road types
         """
-
-        #extract road types from roads geopackage
-
-        #NOTE we can hard code the layer name since we know it is roads, but we can also extract it from the geopackage assuming there is only one layer
-        # road_layer_name = [layer for layer in self.vp.vector_layer_names if 'road' in layer.lower()][0]
-        road_layer_name = 'roads'
+        #extract road types from roads geopackage (the user is only prompted if road types were not selected for all years beforehand)
         if self.config.get('user_vector', None) is not None:
-            road_types = extract_attribute_values_from_gpkg(roads_gpkg, road_layer_name, attribute='highway')
-            confirm = str(prompt(
-                "Type 'yes' to confirm stressor types, or enter the list of stressor (OSM highway) types from the following list of detected road types:\n ", 
-                road_types,
-                type=str
-            )).lower()
-            if confirm == "yes" or confirm == "y":
-                print(f"Road types found in the input vector file: {road_types}")
-            else:
-                while True:
-                    valid = True
-                    user_input = confirm.split(",")
-                    for road_type in user_input:
-                        if road_type not in road_types:
-                            valid = False
-                            print(f"Invalid input: {road_type}")
-                    if valid:
-                        road_types = user_input
-                        break
-                    else:
-                        confirm = str(prompt("Enter the list of stressor (OSM highway) types from the following list: ", road_types,type=str)).lower()
+            if self.selected_road_types is None:
+                self.selected_road_types = self.confirm_road_types(extract_attribute_values_from_gpkg(roads_gpkg, road_layer_name, attribute='highway'))
+            road_types = self.selected_road_types
         else:
             if self.osm_api_type == "overpass":
                 # extract the road types from the config file that match the road types
@@ -304,14 +367,36 @@ class LULCEnrichmentWrapper():
         if groupby_roads:
             road_types = list(set([road_type.split('_')[0] for road_type in road_types if road_type is not None]))
             print(f"Road types to be rasterized: {road_types}")
-        
-        # for each road type, rasterize the roads
+
+        return road_types
+
+    def rasterize_vector_roads(self, year:int, output_dir:str, raster_metadata:str ,roads_gpkg:str, burn_value:int, groupby_roads:bool, half_widths:list=None):
+        """
+        Rasterize roads vector layer to be used for enriching the LULC dataset.
+
+        Args:
+            year (int): year of the data to process
+            output_dir (str): path to the output directory
+            raster_metadata (RasterMetadata): object containing raster metadata (extent, cell size, etc.)
+            roads_gpkg (str): path to the roads GeoPackage file
+            burn_val (int): value to burn into the output raster 
+            groupby_roads (bool): flag to group road types by suffix (e.g. primary, secondary, tertiary)
+            half_widths (list): distinct half widths if roads are centerlines burnt without buffering (optional)
+            
+        Returns:
+            dict: dictionary containing road type stressors.
+        """
+        #NOTE we can hard code the layer name since we know it is roads, but we can also extract it from the geopackage assuming there is only one layer
+        # road_layer_name = [layer for layer in self.vp.vector_layer_names if 'road' in layer.lower()][0]
+        road_layer_name = 'roads'
+        road_types = self.get_road_types(roads_gpkg, road_layer_name, groupby_roads)
+        self.road_types = road_types
+
+        # for each road type, rasterize the roads (filtered by attribute on the fly instead of extracting a GeoPackage per road type)
         road_tiffs = []
 
-        with multiprocessing.Pool(self.max_threads) as pool:
-            road_gpkgs = pool.starmap(self.filter_gpkg_by_attributes, [(roads_gpkg, road_layer_name, 'highway', road_type, os.path.join(output_dir,f'roads_{road_type}.gpkg')) for road_type in road_types])
-            road_tiffs = pool.starmap(self.rasterize_vector_layer, [(raster_metadata, road_gpkg, road_gpkg.replace('.gpkg', f'_{year}.tif'), 0, burn_value, f'roads_{road_gpkg.split("_")[1].split(".")[0]}') for road_gpkg in road_gpkgs])
-            pool.map(os.remove, road_gpkgs)
+        with self.rasterization_pool(raster_metadata) as pool:
+            road_tiffs = pool.starmap(rasterize_task, [(roads_gpkg, road_layer_name, burn_value, os.path.join(output_dir,f'roads_{road_type}_{year}.tif'), f"highway LIKE '%{road_type}%'", half_widths) for road_type in road_types])
         
         # build a roads.vrt file to merge all road types
         self.merge_tiffs_into_vrt(road_tiffs, os.path.join(output_dir,f'roads_{year}.vrt')) 
@@ -335,194 +420,161 @@ class LULCEnrichmentWrapper():
         vineyards = os.path.join(self.stressors_dir,f'vineyards_{year}.tif')
         rasters_temp = [vineyards, waterbodies, waterways, roads, railways] # Order is important for next steps
         
-        # rasterize roads and railways from buffered geometries
-        osm_impedance_stressor_types = self.rasterize_vector_roads(year, os.path.dirname(roads), self.lp.raster_metadata, self.vp.vector_roads_buffered, burn_value=self.lp.lulc_codes["lulc_road"], groupby_roads=True)
-        self.rasterize_vector_layer(self.lp.raster_metadata,self.vp.vector_railways_buffered, railways, nodata_value=0, burn_value=self.lp.lulc_codes["lulc_railway"])
+        # rasterize roads and railways from buffered geometries (or from centerlines and their widths)
+        roads_vector, roads_half_widths = self.line_layers['roads']
+        osm_impedance_stressor_types = self.rasterize_vector_roads(year, os.path.dirname(roads), self.lp.raster_metadata, roads_vector, burn_value=self.lp.lulc_codes["lulc_road"], groupby_roads=True, half_widths=roads_half_widths)
         # add railway to stressors (NOTE because there is no railway type processing we use None)
         osm_impedance_stressor_types['railways'] = None
         
-        # we can group the other unbuffered layers with multiprocessing techniques
+        # we can group railways and the other unbuffered layers with multiprocessing techniques
         process_layers = {
-            'waterbodies': (waterbodies, self.lp.lulc_codes["lulc_water"]),
-            'waterways': (waterways, self.lp.lulc_codes["lulc_water"]),
-            'vineyards': (vineyards, self.lp.lulc_codes["lulc_vineyard"])
+            'waterbodies': (self.vp.vector_refine, waterbodies, self.lp.lulc_codes["lulc_water"], None),
+            'waterways': (self.vp.vector_refine, waterways, self.lp.lulc_codes["lulc_water"], None),
+            'vineyards': (self.vp.vector_refine, vineyards, self.lp.lulc_codes["lulc_vineyard"], None),
+            'railways': (self.line_layers['railways'][0], railways, self.lp.lulc_codes["lulc_railway"], self.line_layers['railways'][1])
         }
-        with multiprocessing.Pool(self.max_threads) as pool:
-            rasters_temp = pool.starmap(self.rasterize_vector_layer, [(self.lp.raster_metadata, self.vp.vector_refine, output_path ,0, lulc_code, layer_name) for layer_name,(output_path,lulc_code) in process_layers.items()])
+        with self.rasterization_pool(self.lp.raster_metadata) as pool:
+            pool.starmap(rasterize_task, [(vector_path, layer_name, lulc_code, output_path, None, half_widths) for layer_name,(vector_path,output_path,lulc_code,half_widths) in process_layers.items()])
 
         # write osm_stressors to file
         if save_osm_stressors == True:
-            # Path is hardcoded since it is a temporary file
-            with open(os.path.join(self.working_dir,"config","stressors.yaml") , 'w') as file:
-                yaml.dump(osm_impedance_stressor_types, file, default_flow_style=True)
-            print("OSM stressors saved to stressors.yaml for impedance recalculation.")
+            self.save_osm_stressors(osm_impedance_stressor_types)
 
         return rasters_temp
-    
-    def rasterize_vector_layer(self, lulc:RasterMetadata, vector_path:str, output_path:str, nodata_value:str, burn_value:str, layer_name:str=None):
+
+    def save_osm_stressors(self, osm_impedance_stressor_types:dict) -> str:
         """
-        Rasterize a vector layer to a raster dataset.
+        Save the OSM stressors to stressors.yaml for impedance recalculation.
+        Stressors don't depend on the year, so the file is written once if years are enriched concurrently (e.g. by run-all).
 
         Args:
-            lulc (Raster_Properties): object containing raster properties
-            vector_path (str): path to the vector dataset
-            output_path (str): path to the output raster dataset
-            nodata_value (str): no data value for the output raster
-            burn_value (str): value to burn into the output raster
-            layer_name (str): name of the layer to rasterize (optional if there is more than one layer in the input file)
+            osm_impedance_stressor_types (dict): dictionary of OSM stressors, mapping stressor to its types (e.g. road types)
 
         Returns:
-            str: path to the output raster dataset
+            str: path to the stressors file
         """
-        # open the vector data source
-        data_source = ogr.Open(vector_path)
-        if data_source is None:
-            raise RuntimeError(f"Failed to open the vector file: {vector_path}")
-
-        # check the number of layers and write it to the variable
-        layer_count = data_source.GetLayerCount()
-        
-        # define gdal_rasterize command
-        #TODO get extent from lulc raster
-        gdal_rasterize_cmd = [
-            'gdal_rasterize',
-            '-tr', str(lulc.cell_size), str(lulc.cell_size),  # output raster pixel size
-            '-te', str(lulc.x_min), str(lulc.y_min), str(lulc.x_max), str(lulc.y_max),  # output extent 
-            '-a_nodata', str(nodata_value),  # no_data value
-            '-ot', 'Int16',   # output raster data type,
-            '-burn', str(burn_value),  # burn-in value
-            '-at',  # all touched pixels are burned in
-            vector_path,  # input vector file
-            output_path  # output raster file
-        ]
-
-         # add the layer name if there are multiple layers 
-        if layer_count > 1: # specify layer name if using merged geopackage as an input file
-            gdal_rasterize_cmd.insert(1, '-l')
-            gdal_rasterize_cmd.insert(2, str(layer_name))
-
-        # execute gdal_rasterize command through subprocess
-        subprocess.run(gdal_rasterize_cmd, check=True, capture_output=True, text=True)
-
-        # mask out data outside the extent of the input raster
-        for year in self.years:
-            # DEBUG
-            print(f"FOR MASKING: {output_path, self.lulc_filepaths[year], nodata_value}")
-            self.mask_raster_with_raster(output_path, self.lulc_filepaths[year], nodata_value)
-        
-        # compress output 
-        output_compressed = output_path.replace('.tif', '_compr.tif')
-        gdal_translate_cmd = [
-            'gdal_translate',
-            output_path,
-            output_compressed,
-            '-co', 'COMPRESS=LZW',
-            '-ot', 'Byte'
-        ]
-        # execute gdal_translate command through subprocess
-        subprocess.run(gdal_translate_cmd, check=True)
-
-        # rename compressed output to original
-        os.remove(output_path)
-        os.rename(output_compressed, output_path)
-
-        print("Rasterized output saved to:", output_path)
-        print("-" * 40)
-        return output_path
-
-    def mask_raster_with_raster(self, input_raster, mask_raster, nodata_value, output_raster:str = None):
-        """Masks an input raster with a mask raster.
-
-        Args:
-            input_raster: Path to the input raster.
-            mask_raster: Path to the mask raster.
-            output_raster: Output raster path. If None, the input raster will be overwritten.
-            nodata_value: NoData value for the output raster.
+        # Path is hardcoded since it is a temporary file
+        stressors_path = os.path.join(self.working_dir,"config","stressors.yaml")
+        with open(stressors_path, 'w') as file:
+            yaml.dump(osm_impedance_stressor_types, file, default_flow_style=True)
+        print("OSM stressors saved to stressors.yaml for impedance recalculation.")
+        return stressors_path
+    
+    def rasterization_pool(self, raster_metadata:RasterMetadata) -> multiprocessing.Pool:
         """
+        Create a process pool whose workers rasterize vector layers in-process on the LULC grid (see RasterizationEngine).
+        Each worker keeps the vector sources and the LULC mask open for all the layers it rasterizes.
 
-        # open input and mask rasters
-        in_ds = gdal.Open(input_raster)
-        mask_ds = gdal.Open(mask_raster)
-
-        # get raster properties
-        in_band = in_ds.GetRasterBand(1)
-        mask_band = mask_ds.GetRasterBand(1)
-        mask_nodata_val = mask_band.GetNoDataValue()
-        print(f"Nodata value of the masking raster dataset: {mask_nodata_val}")
-
-        out_driver = gdal.GetDriverByName('GTiff')
-        if output_raster is None:
-            out_ds = gdal.Open(input_raster, gdal.GA_Update)
-        else:
-            out_ds = out_driver.Create(output_raster, in_ds.RasterXSize, in_ds.RasterYSize, 1, in_band.DataType)
-            out_ds.SetProjection(in_ds.GetProjection())
-            out_ds.SetGeoTransform(in_ds.GetGeoTransform())
-        out_band = out_ds.GetRasterBand(1)
+        Args:
+            raster_metadata (RasterMetadata): object containing raster metadata (extent, cell size, etc.)
 
-        # create a mask array from the mask raster
-        mask_data = mask_band.ReadAsArray()
-        mask_data[mask_data == mask_nodata_val] = nodata_value
+        Returns:
+            multiprocessing.Pool: process pool to run rasterize_task
+        """
+        return multiprocessing.Pool(self.max_threads, initializer=init_rasterization_worker, initargs=(raster_metadata, list(self.lulc_filepaths.values()), 0))
 
-        # apply the mask to the input raster
-        in_data = in_band.ReadAsArray()
-        # mask out the input data where the mask is nodata, otherwise keep the input data
-        out_data = np.where(mask_data == nodata_value, nodata_value, in_data) # TODO - to rewrite to avoid multiplying mask (LULC) by rasterised vector features
+    def estimate_year_memory(self, year:int) -> int:
+        """
+        Estimate the peak memory used to enrich the LULC dataset of a year, including the workers of the rasterization pool (one per thread).
 
-        # write the masked data to the output raster
-        out_band.WriteArray(out_data)
-        out_band.SetNoDataValue(nodata_value)
-        out_ds.FlushCache()
+        Args:
+            year (int): year of the data to process
 
-        # close datasets
-        in_ds = None
-        mask_ds = None
-        out_ds = None
+        Returns:
+            int: The estimated peak memory in bytes.
+        """
+        return estimate_raster_memory(self.lulc_filepaths[year], ENRICHMENT_BYTES_PER_PIXEL + self.max_threads * RASTERIZATION_BYTES_PER_PIXEL)
 
     # function to overwrite values from input raster by multiple rasters
-    def overwrite_raster(self, base_raster:str, *rasters:str, nodata_value: int):
+    def overwrite_raster(self, base_raster:str, *rasters:str, nodata_value: int, output_raster:str, cog_compress:bool=False) -> str:
         """
         Merge multiple rasters by overwriting values from the base raster with valid data from other rasters.
+        Rasters are streamed block by block in the native data type of the base raster and the result is written as a Byte raster.
 
         Args:
             base_raster (str): path to the base raster dataset
             *rasters (str): paths to other raster datasets to be merged
             nodata_value (int): no data value to be applied for the output raster
+            output_raster (str): path to the output raster dataset
+            cog_compress (bool): flag to compress the output raster as a Cloud Optimised Geotiff
         
         Returns:
-            np.array: merged raster dataset
-            gdal.Dataset: dataset of the base raster
-            int: nodata value of the output raster
+            str: path to the output raster dataset
         """
-        # open the input raster and read it
+        # open the input raster
         base_ds = gdal.Open(base_raster)
         base_band = base_ds.GetRasterBand(1)
-        base_data = base_band.ReadAsArray().astype(np.float32)
         
         # get nodata value for the input raster
         if nodata_value is None:  # if nodata value is not defined, set 0 as a default
             nodata_value = 0
-        base_data[base_data == nodata_value] = np.nan  # replace nodata value with nan for processing
         print(f"Nodata value of the input raster dataset: {nodata_value}")
-        
-        # iterate over other rasters
+
+        # open other rasters once
+        overlays = []
         for raster in rasters:
             ds = gdal.Open(raster)
             band = ds.GetRasterBand(1)
-            data = band.ReadAsArray().astype(np.float32)
             current_nodata = band.GetNoDataValue()
             if current_nodata is None:  # handle missing nodata value
                 current_nodata = 0
-            data[data == current_nodata] = np.nan  # replace nodata with nan for processing
-            
+            overlays.append((ds, band, current_nodata))
+
+        temp_output_raster = output_raster if not cog_compress else output_raster + "_tmp.tif"
+        out_ds = create_tiled_raster(temp_output_raster, base_ds, gdal.GDT_Byte, nodata_value)
+        out_band = out_ds.GetRasterBand(1)
+
+        for xoff, yoff, xsize, ysize in block_windows(base_band):
+            base_data = base_band.ReadAsArray(xoff, yoff, xsize, ysize)
             # overwrite values in base_data where current raster has valid data
-            mask = ~np.isnan(data)
-            base_data[mask] = data[mask]
-        
-        # after processing, replace NaNs with the nodata value before saving
-        base_data[np.isnan(base_data)] = nodata_value
-        
-        return base_data, base_ds, nodata_value
-    
+            for ds, band, current_nodata in overlays:
+                data = band.ReadAsArray(xoff, yoff, xsize, ysize)
+                np.copyto(base_data, data, where=data != current_nodata, casting='unsafe')
+            out_band.WriteArray(base_data, xoff, yoff)
+
+        # flush the data and close files
+        out_band.FlushCache()
+        out_ds = None
+        overlays = None
+        base_ds = None
+
+        if cog_compress:
+            self.convert_to_cog(temp_output_raster, output_raster)
+
+        print(f"Output raster saved to {output_raster}")
+        return output_raster
+
+# approximate bytes held in memory per pixel of the LULC dataset while a year is enriched (in-memory copy of LULC and rasterized layers, masks are read by blocks)
+ENRICHMENT_BYTES_PER_PIXEL = 10
+# approximate bytes held in memory per pixel by each worker of the rasterization pool (rasterized layer and proximity to centerlines, masks are read by blocks)
+RASTERIZATION_BYTES_PER_PIXEL = 12
+
+def enrich_lulc_year(year:int, lew:LULCEnrichmentWrapper, save_osm_stressors:bool, cog_compress:bool, single_pass:bool=False, skip_buffer:bool=False) -> int:
+    """
+    Runs the whole enrichment of one year (to be dispatched to a worker process by the year scheduler).
+
+    Args:
+        year (int): year of the data to process
+        lew (LULCEnrichmentWrapper): enrichment wrapper (data processors are initialised for the year)
+        save_osm_stressors (bool): flag to save the OSM stressors to a file for impedance recalculation
+        cog_compress (bool): flag to compress the output raster as a Cloud Optimised Geotiff
+        single_pass (bool): flag to burn all OSM layers directly into the LULC dataset
+        skip_buffer (bool): flag to rasterize roads and railways from their centerlines and widths instead of buffering them
+
+    Returns:
+        int: the processed year
+    """
+    # 1. prepare and merge LULC and OSM data
+    lew.initialise_data_processors(year)
+    # 1.2 buffer vector data, or prepare centerlines (kept in memory if all layers are burnt in this process and stressors are not saved)
+    if skip_buffer:
+        lew.prepare_centerlines_of_roads_and_railways(in_memory=single_pass and not save_osm_stressors)
+    else:
+        lew.buffer_vector_roads_and_railways(in_memory=single_pass and not save_osm_stressors)
+    # 2. rasterize vector data
+    lew.merge_lulc_osm_data(year, save_osm_stressors, cog_compress, single_pass)
+    return year
+
 if __name__ == "__main__":
     config_path = os.path.join(os.getcwd(),"config", "config.yaml")
     lew = LULCEnrichmentWrapper(os.getcwd(),config_path, osm_api_type="overpass", threads=4, verbose=True)
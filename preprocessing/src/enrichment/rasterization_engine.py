@@ -0,0 +1,280 @@
+import numpy as np
+from osgeo import gdal
+
+# local modules
+from utils import create_tiled_raster, block_windows
+from raster_metadata import RasterMetadata
+
+class RasterizationEngine():
+    """
+    Rasterizes vector layers in-process with gdal.Rasterize onto in-memory bands sharing the grid of the LULC dataset.
+    Vector sources are opened once and kept open for all the layers burnt by the engine (e.g. by one worker of a process pool),
+    and outputs are only compressed when they are written to disk.
+    """
+
+    def __init__(self, raster_metadata:RasterMetadata, mask_rasters:list, nodata_value:int=0) -> None:
+        """
+        Initializes the rasterization engine with the LULC grid.
+
+        Args:
+            raster_metadata (RasterMetadata): object containing raster metadata (extent, cell size, etc.) of the LULC dataset
+            mask_rasters (list): paths to the LULC rasters, whose no data pixels are masked out of the rasterized layers (the first one is used as the template of the grid)
+            nodata_value (int): no data value of the rasterized layers (default is 0)
+        """
+        self.raster_metadata = raster_metadata
+        self.mask_rasters = mask_rasters
+        self.nodata_value = nodata_value
+
+        # define the grid in the same way as gdal_rasterize -te -tr
+        cell_size = float(raster_metadata.cell_size)
+        self.x_size = int((float(raster_metadata.x_max) - float(raster_metadata.x_min)) / cell_size + 0.5)
+        self.y_size = int((float(raster_metadata.y_max) - float(raster_metadata.y_min)) / cell_size + 0.5)
+        self.geotransform = (float(raster_metadata.x_min), cell_size, 0, float(raster_metadata.y_max), 0, -cell_size)
+        template_ds = gdal.Open(mask_rasters[0])
+        self.projection = template_ds.GetProjection()
+        template_ds = None
+
+        self.data_sources = {} # cache of opened vector sources
+        self.mask_bands = None # cache of opened mask rasters and their no data values
+
+    def open_vector(self, vector_path:str) -> gdal.Dataset:
+        """
+        Opens a vector source or returns it from the cache if it was already opened.
+
+        Args:
+            vector_path (str): path to the vector dataset
+
+        Returns:
+            gdal.Dataset: opened vector source (gdal.Rasterize requires a GDAL dataset rather than an OGR data source)
+        """
+        if vector_path not in self.data_sources:
+            data_source = gdal.OpenEx(vector_path, gdal.OF_VECTOR)
+            if data_source is None:
+                raise RuntimeError(f"Failed to open the vector file: {vector_path}")
+            self.data_sources[vector_path] = data_source
+        return self.data_sources[vector_path]
+
+    def create_mem_raster(self, data_type:int=gdal.GDT_Int16, band_count:int=1) -> gdal.Dataset:
+        """
+        Creates an in-memory raster on the LULC grid initialised with the no data value.
+
+        Args:
+            data_type (int): GDAL data type of the raster (default is Int16, as gdal_rasterize -ot Int16)
+            band_count (int): number of bands (default is 1)
+
+        Returns:
+            gdal.Dataset: in-memory raster dataset
+        """
+        mem_ds = gdal.GetDriverByName('MEM').Create('', self.x_size, self.y_size, band_count, data_type)
+        mem_ds.SetGeoTransform(self.geotransform)
+        mem_ds.SetProjection(self.projection)
+        for i in range(1, band_count + 1):
+            band = mem_ds.GetRasterBand(i)
+            band.SetNoDataValue(self.nodata_value)
+            band.Fill(self.nodata_value)
+        return mem_ds
+
+    def get_outside_mask(self, xoff:int, yoff:int, xsize:int, ysize:int) -> np.ndarray:
+        """
+        Reads a window of the mask rasters and combines their no data pixels into a boolean mask (mask rasters are opened once and read block by block).
+
+        Args:
+            xoff (int): x offset of the window
+            yoff (int): y offset of the window
+            xsize (int): number of columns of the window
+            ysize (int): number of rows of the window
+
+        Returns:
+            np.ndarray: boolean array of the window, True where any of the mask rasters has no data
+        """
+        if self.mask_bands is None:
+            self.mask_bands = []
+            for mask_raster in self.mask_rasters:
+                mask_ds = gdal.Open(mask_raster)
+                mask_nodata_val = mask_ds.GetRasterBand(1).GetNoDataValue()
+                print(f"Nodata value of the masking raster dataset: {mask_nodata_val}")
+                self.mask_bands.append((mask_ds, mask_nodata_val))
+
+        outside_mask = np.zeros((ysize, xsize), dtype=bool)
+        for mask_ds, mask_nodata_val in self.mask_bands:
+            mask_data = mask_ds.GetRasterBand(1).ReadAsArray(xoff, yoff, xsize, ysize)
+            outside_mask |= (mask_data == mask_nodata_val) | (mask_data == self.nodata_value)
+        return outside_mask
+
+    def burn_layer(self, target_ds:gdal.Dataset, vector_path:str, layer_name:str, burn_value:int, where:str=None, band:int=1, half_widths:list=None) -> None:
+        """
+        Burns a vector layer into a band of an in-memory raster (all touched pixels are burnt in).
+        If half widths are given, the features are centerlines with a 'half_width' field and their footprint is burnt without buffering them (see burn_centerlines).
+
+        Args:
+            target_ds (gdal.Dataset): in-memory raster to burn the layer into
+            vector_path (str): path to the vector dataset
+            layer_name (str): name of the layer to rasterize (optional if there is only one layer in the input file)
+            burn_value (int): value to burn into the raster
+            where (str): attribute filter for the features to burn (optional)
+            band (int): band to burn the layer into (default is 1)
+            half_widths (list): distinct values of the 'half_width' field of centerlines (optional)
+        """
+        if half_widths:
+            self.burn_centerlines(target_ds, vector_path, layer_name, burn_value, half_widths, where, band)
+            return
+
+        data_source = self.open_vector(vector_path)
+        # use the only layer if layer name is not specified or the file has a single layer (as gdal_rasterize does)
+        if layer_name is None or data_source.GetLayerCount() == 1:
+            layer_name = data_source.GetLayer(0).GetName()
+
+        options = gdal.RasterizeOptions(bands=[band], burnValues=[burn_value], layers=[layer_name], where=where, allTouched=True)
+        gdal.Rasterize(target_ds, data_source, options=options)
+
+    def burn_centerlines(self, target_ds:gdal.Dataset, vector_path:str, layer_name:str, burn_value:int, half_widths:list, where:str=None, band:int=1) -> None:
+        """
+        Burns the footprint of centerlines (e.g. roads and railways) without buffering them into polygons. Half widths are rounded to whole pixels,
+        and for each rounded half width the centerlines are rasterized once, the distance of each pixel to them is computed with gdal.ComputeProximity,
+        and pixels closer than the rounded half width (plus half a pixel, to match all touched pixels of buffers) are burnt in.
+        Centerlines whose half width rounds to zero pixels are burnt as they are rasterized, without computing distances.
+
+        Args:
+            target_ds (gdal.Dataset): in-memory raster on the grid of the engine to burn the footprint into
+            vector_path (str): path to the vector dataset of centerlines with a 'half_width' field
+            layer_name (str): name of the layer to rasterize
+            burn_value (int): value to burn into the raster
+            half_widths (list): distinct values of the 'half_width' field (in the units of the LULC grid)
+            where (str): attribute filter for the features to burn (optional)
+            band (int): band to burn the footprint into (default is 1)
+        """
+        cell_size = abs(self.geotransform[1])
+        # group the half widths by their number of pixels, so that many distinct widths (e.g. from the OSM width tag) don't multiply the passes
+        pixel_half_widths = {}
+        for half_width in half_widths:
+            pixel_half_widths.setdefault(round(float(half_width) / cell_size), []).append(float(half_width))
+
+        footprint = np.zeros((self.y_size, self.x_size), dtype=bool)
+        for pixels, bucket in sorted(pixel_half_widths.items()):
+            max_distance = pixels * cell_size + cell_size / 2
+            class_where = f"half_width IN ({', '.join(repr(str(half_width)) for half_width in bucket)})" + (f" AND ({where})" if where else "")
+            lines_ds = self.create_mem_raster(gdal.GDT_Byte)
+            self.burn_layer(lines_ds, vector_path, layer_name, 1, class_where)
+            if pixels == 0:
+                footprint |= lines_ds.GetRasterBand(1).ReadAsArray() == 1
+                lines_ds = None
+                continue
+            proximity_ds = self.create_mem_raster(gdal.GDT_Float32)
+            # distances are computed in georeferenced units up to the half width, farther pixels are set to -1
+            gdal.ComputeProximity(lines_ds.GetRasterBand(1), proximity_ds.GetRasterBand(1),
+                                  ["VALUES=1", "DISTUNITS=GEO", f"MAXDIST={max_distance}", "NODATA=-1"])
+            distance = proximity_ds.GetRasterBand(1).ReadAsArray()
+            footprint |= (distance >= 0) & (distance <= max_distance)
+            lines_ds = None
+            proximity_ds = None
+
+        target_band = target_ds.GetRasterBand(band)
+        data = target_band.ReadAsArray()
+        data[footprint] = burn_value
+        target_band.WriteArray(data)
+
+    def rasterize_to_file(self, vector_path:str, layer_name:str, burn_value:int, output_path:str, where:str=None, half_widths:list=None) -> str:
+        """
+        Rasterizes a vector layer in memory, masks out the pixels outside of the LULC datasets and writes it as a compressed Byte raster.
+
+        Args:
+            vector_path (str): path to the vector dataset
+            layer_name (str): name of the layer to rasterize (optional if there is only one layer in the input file)
+            burn_value (int): value to burn into the output raster
+            output_path (str): path to the output raster dataset
+            where (str): attribute filter for the features to burn (optional)
+            half_widths (list): distinct half widths of centerlines, to burn their footprint without buffering (optional, see burn_centerlines)
+
+        Returns:
+            str: path to the output raster dataset
+        """
+        mem_ds = self.create_mem_raster()
+        self.burn_layer(mem_ds, vector_path, layer_name, burn_value, where, half_widths=half_widths)
+
+        # compress output, masking out data outside the extent of the input raster block by block
+        out_ds = create_tiled_raster(output_path, self.as_template(), gdal.GDT_Byte, self.nodata_value)
+        mem_band = mem_ds.GetRasterBand(1)
+        out_band = out_ds.GetRasterBand(1)
+        for xoff, yoff, xsize, ysize in block_windows(out_band):
+            data = mem_band.ReadAsArray(xoff, yoff, xsize, ysize)
+            np.copyto(data, self.nodata_value, where=self.get_outside_mask(xoff, yoff, xsize, ysize), casting='unsafe')
+            out_band.WriteArray(data, xoff, yoff)
+        mem_ds = None
+        out_ds.FlushCache()
+        out_ds = None
+
+        print("Rasterized output saved to:", output_path)
+        print("-" * 40)
+        return output_path
+
+    def burn_into_raster(self, base_raster:str, layers:list) -> gdal.Dataset:
+        """
+        Burns vector layers into an in-memory copy of a raster in a single traversal of the layers.
+        Layers are burnt in the given order, so later layers overwrite earlier ones. 
+        Pixels outside of the LULC datasets (no data in any mask raster) keep the values of the base raster.
+
+        Args:
+            base_raster (str): path to the raster to burn the layers into (e.g. LULC dataset)
+            layers (list): list of tuples (vector_path, layer_name, burn_value, where, half_widths) in priority order (the last one has the highest priority),
+                where half_widths are the distinct half widths of centerlines burnt without buffering (None for other layers)
+
+        Returns:
+            gdal.Dataset: in-memory raster with the burnt layers
+        """
+        base_ds = gdal.Open(base_raster)
+        mem_ds = gdal.GetDriverByName('MEM').CreateCopy('', base_ds)
+        band = mem_ds.GetRasterBand(1)
+
+        for vector_path, layer_name, burn_value, where, half_widths in layers:
+            print(f"Burning {layer_name} into {base_raster}...")
+            self.burn_layer(mem_ds, vector_path, layer_name, burn_value, where, half_widths=half_widths)
+
+        # restore the pixels outside of the LULC datasets from the base raster, block by block
+        base_band = base_ds.GetRasterBand(1)
+        for xoff, yoff, xsize, ysize in block_windows(base_band):
+            outside_mask = self.get_outside_mask(xoff, yoff, xsize, ysize)
+            if not outside_mask.any():
+                continue
+            data = band.ReadAsArray(xoff, yoff, xsize, ysize)
+            np.copyto(data, base_band.ReadAsArray(xoff, yoff, xsize, ysize), where=outside_mask)
+            band.WriteArray(data, xoff, yoff)
+        base_ds = None
+        return mem_ds
+
+    def as_template(self) -> gdal.Dataset:
+        """
+        Returns an empty in-memory dataset with the grid of the engine, to be used as a template for outputs.
+        """
+        template_ds = gdal.GetDriverByName('MEM').Create('', self.x_size, self.y_size, 0)
+        template_ds.SetGeoTransform(self.geotransform)
+        template_ds.SetProjection(self.projection)
+        return template_ds
+
+    def close(self) -> None:
+        """
+        Closes the cached vector sources and mask rasters.
+        """
+        self.data_sources = {}
+        self.mask_bands = None
+
+# engine of the current worker process (initialised once per worker)
+_worker_engine = None
+
+def init_rasterization_worker(raster_metadata:RasterMetadata, mask_rasters:list, nodata_value:int=0) -> None:
+    """
+    Initializes the rasterization engine of a worker process of a process pool.
+
+    Args:
+        raster_metadata (RasterMetadata): object containing raster metadata of the LULC dataset
+        mask_rasters (list): paths to the LULC rasters used to mask out rasterized layers
+        nodata_value (int): no data value of the rasterized layers (default is 0)
+    """
+    global _worker_engine
+    gdal.UseExceptions()
+    _worker_engine = RasterizationEngine(raster_metadata, mask_rasters, nodata_value)
+
+def rasterize_task(vector_path:str, layer_name:str, burn_value:int, output_path:str, where:str=None, half_widths:list=None) -> str:
+    """
+    Rasterizes a vector layer with the engine of the current worker process (see RasterizationEngine.rasterize_to_file).
+    """
+    return _worker_engine.rasterize_to_file(vector_path, layer_name, burn_value, output_path, where, half_widths)
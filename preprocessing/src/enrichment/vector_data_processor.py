@@ -1,16 +1,42 @@
 import os
-import subprocess
 import warnings
+import numpy as np
+import pandas as pd
+import pyproj
+import shapely
+from concurrent.futures import ProcessPoolExecutor
+from osgeo import ogr
 
 # local imports
 from vector_proc import VectorTransform
 from utils import extract_layer_names
+from gpkg_stream import GPKGStreamWriter
+
+# OSM highway types of each level of buffer width (other roads and other layers use width_other)
+ROAD_TYPES_LEV1 = ('motorway', 'motorway_link', 'trunk', 'trunk_link')
+ROAD_TYPES_LEV2 = ('primary', 'primary_link', 'secondary', 'secondary_link')
+
+def buffer_chunk(wkbs:np.ndarray, distances:np.ndarray) -> np.ndarray:
+    """
+    Buffers a chunk of WKB geometries (module-level, so that chunks can be sent to worker processes).
+
+    Args:
+        wkbs (np.ndarray): WKB geometries
+        distances (np.ndarray): buffer distance of each geometry
+
+    Returns:
+        np.ndarray: WKB of the buffered geometries
+    """
+    return shapely.to_wkb(shapely.buffer(shapely.from_wkb(wkbs), distances))
 
 class VectorDataPreprocessor():
     """
     Preprocesses OSM vector data for rasterization, which includes reprojecting, fixing geometries 
     and buffering features in biodiversity stressor layers (roads and railways).
     """
+    # number of features buffered per chunk
+    BUFFER_CHUNK_SIZE = 50000
+
     def __init__(self, config: dict, current_dir:str, vector_dir:str, year:int, lulc_crs:int, lulc_is_cartesian:bool) -> None:
         """
         Initializes the vector data preprocessor. Extracts vector layer names and checks if the CRS of the vector data matches the LULC data.
@@ -35,6 +61,9 @@ class VectorDataPreprocessor():
         # specify the output directory
         self.vector_railways_buffered = os.path.join(self.current_dir,self.vector_dir , f"railways_{self.year}_buffered.gpkg")
         self.vector_roads_buffered = os.path.join(self.current_dir,self.vector_dir , f"roads_{self.year}_buffered.gpkg")
+        # centerlines with their buffer distances, rasterized without buffering (see centerline_features)
+        self.vector_railways_centerlines = os.path.join(self.current_dir,self.vector_dir , f"railways_{self.year}_centerlines.gpkg")
+        self.vector_roads_centerlines = os.path.join(self.current_dir,self.vector_dir , f"roads_{self.year}_centerlines.gpkg")
     
     def load_auxillary_data(self,current_dir:str, vector_dir:str, year:int) -> str:
         """
@@ -116,127 +145,190 @@ class VectorDataPreprocessor():
 
       
     
-    def buffer_features(self, layer:str, output_filepath:str, epsg:int=27700):
+    def read_layer(self, layer:str, columns:list[str]) -> tuple[np.ndarray, dict]:
         """
-        Buffer the features in the input vector layer based either on config file or 'width' column.
-        If the instance is not in cartesian coordinates, a temporary transformation is used to apply the buffer in meters and then transform back to the original CRS.
-        
+        Reads the geometries and some attributes of a layer of the input vector file at once (through the Arrow stream of the layer).
+
         Args:
             layer (str): layer name
-            output_filepath (str): output file path
-            epsg (int, optional): EPSG code. Defaults to 27700.
-        
+            columns (list): names of the attributes to read (attributes missing from the layer are skipped)
+
         Returns:
-            None
+            tuple: array of WKB geometries and dictionary of attribute arrays (strings or None)
         """
-        if os.path.exists(output_filepath):
-            os.remove(output_filepath)
+        data_source = ogr.Open(self.vector_refine)
+        if data_source is None:
+            raise RuntimeError(f"Failed to open the vector file: {self.vector_refine}")
+        ogr_layer = data_source.GetLayerByName(layer)
+        if ogr_layer is None:
+            raise RuntimeError(f"Layer {layer} not found in {self.vector_refine}")
+        layer_defn = ogr_layer.GetLayerDefn()
+        field_names = [layer_defn.GetFieldDefn(i).GetName() for i in range(layer_defn.GetFieldCount())]
+        columns = [column for column in columns if column in field_names]
+        ogr_layer.SetIgnoredFields([name for name in field_names if name not in columns])
+        geom_column = ogr_layer.GetGeometryColumn()
+
+        wkbs, attributes = [], {column: [] for column in columns}
+        stream = ogr_layer.GetArrowStreamAsNumPy(options=["USE_MASKED_ARRAYS=NO", "INCLUDE_FID=NO", f"MAX_FEATURES_IN_BATCH={self.BUFFER_CHUNK_SIZE}"])
+        for batch in stream:
+            wkbs.append(batch[geom_column])
+            for column in columns:
+                attributes[column].append(batch[column])
+        stream = None
+        data_source = None
 
+        decode = lambda value: value.decode('utf-8') if isinstance(value, bytes) else value
+        wkbs = np.concatenate(wkbs) if wkbs else np.empty(0, dtype=object)
+        attributes = {column: np.array([decode(value) for value in np.concatenate(arrays)], dtype=object) if arrays else np.empty(0, dtype=object)
+                      for column, arrays in attributes.items()}
+        return wkbs, attributes
+
+    def buffer_distances(self, feature_count:int, attributes:dict) -> np.ndarray:
+        """
+        Computes the buffer distance (half width) of all features at once. If the layer has a 'width' column, it is taken from the 'width' tag 
+        if it is a valid positive number not larger than width_lev1, or else from the width of the road level in the configuration file 
+        (width_other for other roads). Features of layers without a 'width' column are buffered by width_other.
+
+        Args:
+            feature_count (int): number of features
+            attributes (dict): arrays of the 'highway' and 'width' attributes (if they exist in the layer)
+
+        Returns:
+            np.ndarray: buffer distance of each feature
+        """
         # bring custom values of buffer width from the configuration file
         self.width_lev1 = self.config.get('width_lev1')
         self.width_lev2 = self.config.get('width_lev2')
         self.width_other = self.config.get('width_other')
 
-        # check if the "width" column exists
-        check_column_query = f"""
-            SELECT COUNT(*) 
-            FROM pragma_table_info('{layer}')
-            WHERE name = 'width';
-        """
-        ogr_check_command = [
-            'ogrinfo',
-            self.vector_refine,
-            '-dialect', 'SQLite',
-            '-sql', check_column_query
-        ]
-
-        #TODO refactor this process 06/03/2025
-        try:
-            result = subprocess.run(ogr_check_command, check=True, capture_output=True, text=True)
-            # extract the COUNT(*) value from the output
-            column_exists = False
-            for line in result.stdout.splitlines():
-                 if "COUNT(*)" in line and "=" in line:  # Ensure the line contains COUNT(*) and an equals sign
-                    count_value = int(line.split('=')[-1].strip())  # extract the number after '='
-                    column_exists = count_value > 0  # set to true if count is greater than 0
-                    break
-
-        except Exception as e:
-            column_exists = False
-            return
-            
-        # build an SQL query to apply buffer based on "width" column and parameters from the config file
-        if column_exists:
+        widths = np.full(feature_count, float(self.width_other))
+        if 'width' in attributes:
             print("Width column exists in subset.")
-            subquery = f"""
-                CASE 
-                    WHEN "width" IS NULL 
-                    OR CAST("width" AS REAL) IS NULL 
-                    OR CAST("width" AS REAL) > {self.width_lev1} THEN 
-                        CASE 
-                            WHEN highway IN ('motorway', 'motorway_link', 'trunk', 'trunk_link') THEN {self.width_lev1}/2
-                            WHEN highway IN ('primary', 'primary_link', 'secondary', 'secondary_link') THEN {self.width_lev2}/2
-                            ELSE {self.width_other}/2 
-                        END 
-                    ELSE CAST("width" AS REAL)/2 
-                END
-            """
+            # widths of road levels are used where the 'width' tag is missing, not a positive number or too large
+            if 'highway' in attributes:
+                highway = attributes['highway']
+                widths[np.isin(highway, ROAD_TYPES_LEV1)] = float(self.width_lev1)
+                widths[np.isin(highway, ROAD_TYPES_LEV2)] = float(self.width_lev2)
+            # leading number of tag values (e.g. '7', '7.5 m')
+            width_tag = pd.to_numeric(pd.Series(attributes['width'], dtype=object).astype(str).str.extract(r'^\s*(\d+(?:\.\d+)?)')[0], errors='coerce').to_numpy()
+            valid = (width_tag > 0) & (width_tag <= float(self.width_lev1))
+            widths[valid] = width_tag[valid]
         else: # if 'width' is not specified
             print("Width column does not exist in subset. Using the custom value of width from the configuration file...")
-            subquery = f"""{self.width_other}/2"""
+        return widths / 2
 
-        # DEBUG: print(subquery)
-            
-        # if it is not in cartesian coordinates, transform the geometry to a temporary cartesian CRS for buffering and then back to the original CRS
-        # print(self.lulc_is_cartesian)
+    def buffer_geometries(self, wkbs:np.ndarray, distances:np.ndarray, epsg:int, jobs:int=1) -> np.ndarray:
+        """
+        Buffers geometries in chunks, on a pool of processes if more than one job is used.
+        If the LULC data is not in cartesian coordinates, geometries are transformed to a temporary cartesian CRS for buffering and then back to the original CRS.
+
+        Args:
+            wkbs (np.ndarray): WKB geometries in the CRS of the LULC data
+            distances (np.ndarray): buffer distance of each geometry
+            epsg (int): EPSG code of the temporary cartesian CRS
+            jobs (int): number of processes buffering chunks of geometries (default is 1, in the current process)
+
+        Returns:
+            np.ndarray: WKB of the buffered geometries
+        """
         if self.lulc_is_cartesian == False:
-            query = f"""
-                ST_Transform(
-                    ST_Buffer(
-                        ST_Transform(geom, {epsg}),
-                        {subquery}
-                    ),
-                    {self.lulc_crs}
-                ) AS geometry,
-                *
-            """
+            to_cartesian = pyproj.Transformer.from_crs(f"EPSG:{self.lulc_crs}", f"EPSG:{epsg}", always_xy=True)
+            transform = lambda coords: np.column_stack(to_cartesian.transform(coords[:, 0], coords[:, 1]))
+            wkbs = shapely.to_wkb(shapely.transform(shapely.from_wkb(wkbs), transform))
+
+        chunks = [(wkbs[i:i + self.BUFFER_CHUNK_SIZE], distances[i:i + self.BUFFER_CHUNK_SIZE]) for i in range(0, len(wkbs), self.BUFFER_CHUNK_SIZE)]
+        if jobs > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=min(jobs, len(chunks))) as executor:
+                buffered = list(executor.map(buffer_chunk, *zip(*chunks)))
         else:
-            query = f""" ST_Buffer(geom, {subquery}) AS geometry, * """
+            buffered = [buffer_chunk(chunk_wkbs, chunk_distances) for chunk_wkbs, chunk_distances in chunks]
+        buffered = np.concatenate(buffered) if buffered else np.empty(0, dtype=object)
 
-        # DEBUG: print(query)
+        if self.lulc_is_cartesian == False:
+            to_original = pyproj.Transformer.from_crs(f"EPSG:{epsg}", f"EPSG:{self.lulc_crs}", always_xy=True)
+            transform = lambda coords: np.column_stack(to_original.transform(coords[:, 0], coords[:, 1]))
+            buffered = shapely.to_wkb(shapely.transform(shapely.from_wkb(buffered), transform))
+        return buffered
 
-        print(f"Buffering {layer} layer...")
-        #NOTE only for roads and railways for now
-        ogr2ogr_command = [
-            'ogr2ogr',
-            '-f', 'GPKG',
-            output_filepath, # output file path
-            self.vector_refine, # input file path (should be before the SQL statement)
-            '-dialect', 'SQLite',
-            '-sql', f"""
-                SELECT
-                {query}
-                FROM {layer}; /* to specify layer of input file */
-            """,
-            '-nln', layer, # define layer in the output file
-            '-nlt', 'POLYGON' # ensure the output is a polygon
-        ]
-
-        # execute ogr2ogr command
-        try:
-            result = subprocess.run(ogr2ogr_command, check=True, capture_output=True, text=True)
-            print(f"Successfully buffered {layer} layer and saved to {output_filepath}.")
-            if result.stderr:
-                print(f"Warnings or errors:\n{result.stderr}")
-                os.remove(output_filepath)
-        except subprocess.CalledProcessError as e:
-            print(f"Error buffering layer: {e.stderr}")
-            os.remove(output_filepath)
-        except Exception as e:
-            print(f"Unexpected error: {str(e)}")
+    def buffer_features(self, layer:str, output_filepath:str, epsg:int=27700, jobs:int=1) -> str:
+        """
+        Buffer the features in the input vector layer based either on config file or 'width' column.
+        The layer is read once, buffer widths are computed for all features at once and geometries are buffered in bulk with Shapely.
+        If the instance is not in cartesian coordinates, a temporary transformation is used to apply the buffer in meters and then transform back to the original CRS.
+        
+        Args:
+            layer (str): layer name
+            output_filepath (str): output file path (an in-memory '/vsimem/' path keeps the buffered layer in memory for the rasterization)
+            epsg (int, optional): EPSG code. Defaults to 27700.
+            jobs (int, optional): number of processes buffering chunks of features. Defaults to 1.
+        
+        Returns:
+            str: output file path
+        """
+        if os.path.exists(output_filepath):
             os.remove(output_filepath)
 
+        #NOTE only for roads and railways for now
+        print(f"Buffering {layer} layer...")
+        wkbs, attributes = self.read_layer(layer, ['highway', 'width'])
+        valid = np.array([wkb is not None for wkb in wkbs], dtype=bool)
+        wkbs = wkbs[valid]
+        attributes = {column: values[valid] for column, values in attributes.items()}
+        buffered = self.buffer_geometries(wkbs, self.buffer_distances(len(wkbs), attributes), epsg, jobs)
+
+        # write the buffered features with all the attributes of the input features
+        self.write_features_with_geometries(layer, output_filepath, buffered)
+        print(f"Successfully buffered {len(buffered)} features of {layer} layer and saved to {output_filepath}.")
+        print("-"*40)
+        return output_filepath
+
+    def write_features_with_geometries(self, layer:str, output_filepath:str, wkbs:np.ndarray, properties:list[dict]=None) -> None:
+        """
+        Writes the features of the input vector layer which have a geometry with all their attributes and new geometries (e.g. buffered geometries).
+
+        Args:
+            layer (str): layer name
+            output_filepath (str): output file path
+            wkbs (np.ndarray): WKB geometries of the features which have a geometry, in the order of the layer (as read by read_layer)
+            properties (list): other properties of each of these features (optional)
+        """
+        data_source = ogr.Open(self.vector_refine)
+        src_layer = data_source.GetLayerByName(layer)
+        with GPKGStreamWriter(output_filepath, layer, self.lulc_crs, batch_size=None) as writer:
+            writer.copy_fields(src_layer.GetLayerDefn())
+            i = 0
+            for feature in src_layer:
+                if feature.GetGeometryRef() is None:
+                    continue
+                writer.write_copy(feature, ogr.CreateGeometryFromWkb(wkbs[i]), properties[i] if properties else None)
+                i += 1
+        src_layer = None
+        data_source = None
+
+    def centerline_features(self, layer:str, output_filepath:str) -> list[float]:
+        """
+        Writes the features of the input vector layer with their buffer distance (half width, see buffer_distances) in the 'half_width' field, without buffering them.
+        The footprint of each width is rasterized from the centerlines instead (see RasterizationEngine.burn_layer).
+
+        Args:
+            layer (str): layer name
+            output_filepath (str): output file path (an in-memory '/vsimem/' path keeps the centerlines in memory for the rasterization)
+
+        Returns:
+            list: distinct buffer distances of the features
+        """
+        print(f"Preparing centerlines of {layer} layer...")
+        wkbs, attributes = self.read_layer(layer, ['highway', 'width'])
+        valid = np.array([wkb is not None for wkb in wkbs], dtype=bool)
+        wkbs = wkbs[valid]
+        attributes = {column: values[valid] for column, values in attributes.items()}
+        distances = self.buffer_distances(len(wkbs), attributes)
+
+        self.write_features_with_geometries(layer, output_filepath, wkbs, [{'half_width': str(float(distance))} for distance in distances])
+        half_widths = sorted(set(float(distance) for distance in distances))
+        print(f"Saved {len(wkbs)} centerlines of {layer} layer with buffer distances {half_widths} to {output_filepath}.")
         print("-"*40)
+        return half_widths
 
 
 # for debugging
@@ -0,0 +1,139 @@
+import os
+import json
+from typing import Iterator
+
+class GeoJSONStreamWriter():
+    """
+    Writes a GeoJSON FeatureCollection incrementally, one feature at a time, so that memory is bounded by the features being written
+    instead of the whole collection. Features are serialized compactly and the file is written under a temporary name
+    until the collection is closed, so that incomplete files are never mistaken for complete ones.
+    """
+
+    def __init__(self, output_path:str, name:str=None) -> None:
+        """
+        Opens the output file and writes the header of the FeatureCollection.
+
+        Args:
+            output_path (str): path to the output GeoJSON file
+            name (str): name of the FeatureCollection, used as the layer name by GDAL (optional)
+        """
+        self.output_path = output_path
+        self.temp_path = output_path + ".part"
+        self.feature_count = 0
+        self.file = open(self.temp_path, 'w', encoding='utf-8')
+        name = f'"name": {json.dumps(name)}, ' if name is not None else ''
+        self.file.write('{"type": "FeatureCollection", ' + name + '"features": [\n')
+
+    def write_feature(self, feature:dict) -> None:
+        """
+        Appends a feature to the FeatureCollection.
+
+        Args:
+            feature (dict): GeoJSON feature
+        """
+        if self.feature_count > 0:
+            self.file.write(',\n')
+        self.file.write(json.dumps(feature, separators=(',', ':')))
+        self.feature_count += 1
+
+    def write_features(self, features:list[dict]) -> None:
+        """
+        Appends a list of features to the FeatureCollection.
+
+        Args:
+            features (list): GeoJSON features
+        """
+        for feature in features:
+            self.write_feature(feature)
+
+    def close(self) -> str:
+        """
+        Writes the end of the FeatureCollection and moves the file to its final name.
+
+        Returns:
+            str: path to the output GeoJSON file
+        """
+        if not self.file.closed:
+            self.file.write('\n]}\n')
+            self.file.close()
+            os.replace(self.temp_path, self.output_path)
+        return self.output_path
+
+    def discard(self) -> None:
+        """
+        Closes and removes the incomplete file (e.g. if fetching the features failed), so that no *.part file is left behind.
+        """
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def __enter__(self) -> 'GeoJSONStreamWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # do not leave an incomplete file behind
+            self.discard()
+
+def iter_features(path:str, chunk_size:int=2**20, key:str="features") -> Iterator[dict]:
+    """
+    Reads the features of a GeoJSON FeatureCollection one at a time, so that memory is bounded by the largest feature instead of the whole file.
+    The file is read in chunks and each feature of the "features" array is decoded as soon as it is complete.
+
+    Args:
+        path (str): path to the GeoJSON (or JSON) file with a "features" array at the top level
+        chunk_size (int): number of characters read at a time (default is 1 MiB)
+        key (str): key of the array to read (e.g. "elements" for Overpass responses, default is "features")
+
+    Yields:
+        dict: GeoJSON feature
+    """
+    decoder = json.JSONDecoder()
+    with open(path, 'r', encoding='utf-8') as f:
+        buffer = f.read(chunk_size)
+        eof = not buffer
+
+        # find the start of the features array (keys before it, e.g. attribution and metadata, are skipped)
+        token = json.dumps(key)
+        position = buffer.find(token)
+        while position < 0 and not eof:
+            # keep the end of the buffer in case the key is split between chunks
+            buffer = buffer[-len(token):]
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+            position = buffer.find(token)
+        if position < 0:
+            return
+        buffer = buffer[position + len(token):]
+        while '[' not in buffer and not eof:
+            chunk = f.read(chunk_size)
+            eof = not chunk
+            buffer += chunk
+        position = buffer.find('[') + 1
+
+        while True:
+            # skip the separators between features
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if position < len(buffer) and buffer[position] == ']':
+                return
+            try:
+                feature, end = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                # the feature is incomplete, so the next chunk is appended to the buffer
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    raise ValueError(f"Unexpected end of the features array in {path}")
+                buffer = buffer[position:] + chunk
+                position = 0
+                continue
+            yield feature
+            position = end
+            # drop decoded features from the buffer
+            if position > chunk_size:
+                buffer = buffer[position:]
+                position = 0
@@ -0,0 +1,158 @@
+import numpy as np
+import shapely
+from concurrent.futures import ProcessPoolExecutor
+from osgeo import ogr
+
+def make_valid_wkb(wkbs:np.ndarray) -> np.ndarray:
+    """
+    Repairs a chunk of WKB geometries (module-level, so that chunks can be sent to worker processes).
+
+    Args:
+        wkbs (np.ndarray): WKB geometries
+
+    Returns:
+        np.ndarray: WKB of the repaired geometries
+    """
+    return shapely.to_wkb(shapely.make_valid(shapely.from_wkb(wkbs)))
+
+class GeometryValidator():
+    """
+    Validates and repairs the geometries of GeoPackage layers with vectorized Shapely functions instead of a Python loop over OGR features.
+    Geometries of a layer are read as WKB arrays through the Arrow stream of the layer (attributes are not read), checked with shapely.is_valid,
+    and only invalid geometries are repaired with shapely.make_valid (in chunks, optionally on a pool of processes) and written back in one transaction.
+    """
+    # number of features read per Arrow batch and repaired per chunk
+    CHUNK_SIZE = 50000
+
+    def __init__(self, jobs:int=1, chunk_size:int=CHUNK_SIZE) -> None:
+        """
+        Initializes the validator.
+
+        Args:
+            jobs (int): number of processes repairing chunks of invalid geometries (default is 1, in the current process)
+            chunk_size (int): number of features per batch and per chunk (default is 50000)
+        """
+        self.jobs = jobs
+        self.chunk_size = chunk_size
+
+    def read_geometries(self, layer:ogr.Layer) -> tuple[np.ndarray, np.ndarray]:
+        """
+        Reads the feature ids and geometries of a layer.
+
+        Args:
+            layer (ogr.Layer): the layer to read
+
+        Returns:
+            tuple: array of feature ids and array of Shapely geometries (None for features without geometry)
+        """
+        geom_column = layer.GetGeometryColumn()
+        fid_column = layer.GetFIDColumn() or "OGC_FID"
+        # only geometries are read
+        layer_defn = layer.GetLayerDefn()
+        layer.SetIgnoredFields([layer_defn.GetFieldDefn(i).GetName() for i in range(layer_defn.GetFieldCount())])
+        fids, geometries = [], []
+        try:
+            stream = layer.GetArrowStreamAsNumPy(options=["USE_MASKED_ARRAYS=NO", f"MAX_FEATURES_IN_BATCH={self.chunk_size}"])
+            for batch in stream:
+                fids.append(np.asarray(batch[fid_column]))
+                geometries.append(shapely.from_wkb(batch[geom_column]))
+            stream = None
+        finally:
+            layer.SetIgnoredFields([])
+        if not fids:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=object)
+        return np.concatenate(fids), np.concatenate(geometries)
+
+    def make_valid(self, geometries:np.ndarray) -> np.ndarray:
+        """
+        Repairs geometries in chunks, on a pool of processes if more than one job is used.
+
+        Args:
+            geometries (np.ndarray): Shapely geometries to repair
+
+        Returns:
+            np.ndarray: repaired Shapely geometries
+        """
+        chunks = [shapely.to_wkb(geometries[i:i + self.chunk_size]) for i in range(0, len(geometries), self.chunk_size)]
+        if self.jobs > 1 and len(chunks) > 1:
+            with ProcessPoolExecutor(max_workers=min(self.jobs, len(chunks))) as executor:
+                fixed = list(executor.map(make_valid_wkb, chunks))
+        else:
+            fixed = [make_valid_wkb(chunk) for chunk in chunks]
+        return shapely.from_wkb(np.concatenate(fixed)) if fixed else np.empty(0, dtype=object)
+
+    def check_layer(self, layer:ogr.Layer) -> dict:
+        """
+        Counts the invalid geometries of a layer.
+
+        Args:
+            layer (ogr.Layer): the layer to check
+
+        Returns:
+            dict: number of features, of features without geometry and of invalid geometries, and ids of invalid features
+        """
+        fids, geometries = self.read_geometries(layer)
+        missing = shapely.is_missing(geometries)
+        invalid = ~missing & ~shapely.is_valid(geometries)
+        return {"features": len(fids), "missing": int(missing.sum()), "invalid": int(invalid.sum()), "invalid_fids": fids[invalid].tolist()}
+
+    def fix_layer(self, data_source:ogr.DataSource, layer_name:str) -> dict:
+        """
+        Repairs the invalid geometries of a layer of a GeoPackage opened for update, writing the repaired geometries in one transaction.
+
+        Args:
+            data_source (ogr.DataSource): the GeoPackage opened for update
+            layer_name (str): the name of the layer
+
+        Returns:
+            dict: number of features, of features without geometry, of invalid geometries, of fixed geometries and of geometries which could not be fixed
+        """
+        layer = data_source.GetLayerByName(layer_name)
+        fids, geometries = self.read_geometries(layer)
+        missing = shapely.is_missing(geometries)
+        invalid = np.flatnonzero(~missing & ~shapely.is_valid(geometries))
+        counts = {"features": len(fids), "missing": int(missing.sum()), "invalid": len(invalid), "fixed": 0, "unfixable": 0}
+        if len(invalid) == 0:
+            return counts
+
+        fixed = self.make_valid(geometries[invalid])
+        is_fixed = shapely.is_valid(fixed)
+        counts["fixed"] = int(is_fixed.sum())
+        counts["unfixable"] = len(invalid) - counts["fixed"]
+        data_source.StartTransaction()
+        for fid, wkb in zip(fids[invalid][is_fixed], shapely.to_wkb(fixed[is_fixed])):
+            feature = layer.GetFeature(int(fid))
+            feature.SetGeometry(ogr.CreateGeometryFromWkb(wkb))
+            layer.SetFeature(feature)
+        data_source.CommitTransaction()
+        return counts
+
+    def fix_gpkg(self, gpkg_path:str, layer_names:list[str]=None) -> dict:
+        """
+        Repairs the invalid geometries of a GeoPackage file in place and prints the counts of each layer.
+
+        Args:
+            gpkg_path (str): path to the GeoPackage file
+            layer_names (list): names of the layers to repair (default is None, all layers)
+
+        Returns:
+            dict: counts of each layer (see fix_layer)
+        """
+        data_source = ogr.Open(gpkg_path, update=1)
+        if data_source is None:
+            raise RuntimeError(f"Failed to open GeoPackage: {gpkg_path}")
+        if layer_names is None:
+            layer_names = [data_source.GetLayerByIndex(i).GetName() for i in range(data_source.GetLayerCount())]
+
+        layer_counts = {}
+        for layer_name in layer_names:
+            counts = layer_counts[layer_name] = self.fix_layer(data_source, layer_name)
+            if counts["invalid"] == 0:
+                print(f"All geometries of features in the layer '{layer_name}' of {gpkg_path} are valid ({counts['features']} features).")
+            else:
+                print(f"Layer '{layer_name}': {counts['invalid']} of {counts['features']} geometries are invalid, {counts['fixed']} geometries fixed.")
+                if counts["unfixable"] > 0:
+                    print(f"Layer '{layer_name}': {counts['unfixable']} geometries could not be fixed.")
+            print("-" * 40)
+        data_source = None
+        return layer_counts
@@ -0,0 +1,157 @@
+import os
+import json
+from osgeo import ogr, osr
+
+class GPKGStreamWriter():
+    """
+    Writes GeoJSON-like features to a GeoPackage layer one at a time, so that memory is bounded by the features being written
+    instead of the whole collection. Fields are created as new properties appear (as strings, like OSM tags) or copied from another layer with their types,
+    features are committed in batched transactions and the spatial index is built once all features are written.
+    """
+    # number of features written per transaction
+    BATCH_SIZE = 20000
+
+    def __init__(self, output_path:str, layer_name:str, epsg:int=4326, batch_size:int=BATCH_SIZE) -> None:
+        """
+        Creates the GeoPackage file (overwritten if it exists) and its layer.
+
+        Args:
+            output_path (str): path to the output GeoPackage file
+            layer_name (str): name of the layer
+            epsg (int): EPSG code of the coordinates of the features (default is 4326)
+            batch_size (int): number of features written per transaction (all features are written in one transaction if None)
+        """
+        self.output_path = output_path
+        self.layer_name = layer_name
+        self.batch_size = batch_size
+        self.feature_count = 0
+        if os.path.exists(output_path):
+            os.remove(output_path)
+
+        srs = osr.SpatialReference()
+        srs.ImportFromEPSG(int(epsg))
+        srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER) # GeoJSON coordinates are (lon, lat)
+        self.ds = ogr.GetDriverByName("GPKG").CreateDataSource(output_path)
+        self.layer = self.ds.CreateLayer(layer_name, srs, ogr.wkbUnknown, ["SPATIAL_INDEX=NO"])
+        self.layer_defn = self.layer.GetLayerDefn()
+        # GeoPackage column names are case-insensitive, so properties differing only by case share a field
+        self.fields = {}
+        self.ds.StartTransaction()
+
+    def field_index(self, key:str) -> int:
+        """
+        Returns the index of the field of a property, creating the field if it doesn't exist yet.
+        """
+        name = self.fields.get(key.lower())
+        if name is None:
+            self.layer.CreateField(ogr.FieldDefn(key, ogr.OFTString))
+            name = self.fields[key.lower()] = key
+        return self.layer_defn.GetFieldIndex(name)
+
+    def write_feature(self, feature:dict) -> None:
+        """
+        Appends a feature to the layer.
+
+        Args:
+            feature (dict): GeoJSON feature
+        """
+        geometry = ogr.CreateGeometryFromJson(json.dumps(feature["geometry"])) if feature.get("geometry") is not None else None
+        self.write_geometry(geometry, feature.get("properties"))
+
+    def write_geometry(self, geometry:ogr.Geometry, properties:dict) -> None:
+        """
+        Appends a feature to the layer from its geometry and properties.
+
+        Args:
+            geometry (ogr.Geometry): geometry of the feature (e.g. created from WKB), or None
+            properties (dict): properties of the feature
+        """
+        out_feature = ogr.Feature(self.layer_defn)
+        self.set_properties(out_feature, properties)
+        if geometry is not None:
+            out_feature.SetGeometry(geometry)
+        self.add_feature(out_feature)
+
+    def copy_fields(self, layer_defn:ogr.FeatureDefn) -> None:
+        """
+        Creates the fields of another layer with their types, so that its features can be copied with write_copy.
+
+        Args:
+            layer_defn (ogr.FeatureDefn): definition of the layer to copy the fields from
+        """
+        for i in range(layer_defn.GetFieldCount()):
+            field_defn = layer_defn.GetFieldDefn(i)
+            if field_defn.GetName().lower() not in self.fields:
+                self.layer.CreateField(field_defn)
+                self.fields[field_defn.GetName().lower()] = field_defn.GetName()
+
+    def write_copy(self, feature:ogr.Feature, geometry:ogr.Geometry, properties:dict=None) -> None:
+        """
+        Appends a copy of a feature with all its attributes (fields are created by copy_fields) and another geometry.
+
+        Args:
+            feature (ogr.Feature): feature to copy the attributes from
+            geometry (ogr.Geometry): geometry of the copy (e.g. the buffered geometry of the feature)
+            properties (dict): other properties of the copy (optional)
+        """
+        out_feature = ogr.Feature(self.layer_defn)
+        out_feature.SetFrom(feature)
+        self.set_properties(out_feature, properties)
+        out_feature.SetGeometry(geometry)
+        self.add_feature(out_feature)
+
+    def set_properties(self, out_feature:ogr.Feature, properties:dict) -> None:
+        """
+        Sets the properties of a feature, creating the fields of new properties.
+        """
+        for key, value in (properties or {}).items():
+            if value is None:
+                continue
+            out_feature.SetField(self.field_index(key), value if isinstance(value, str) else json.dumps(value))
+
+    def add_feature(self, out_feature:ogr.Feature) -> None:
+        """
+        Writes a feature to the layer, committing the transaction once a batch of features is written.
+        """
+        self.layer.CreateFeature(out_feature)
+        self.feature_count += 1
+        if self.batch_size and self.feature_count % self.batch_size == 0:
+            self.ds.CommitTransaction()
+            self.ds.StartTransaction()
+
+    def write_features(self, features:list[dict]) -> None:
+        """
+        Appends a list of features to the layer.
+
+        Args:
+            features (list): GeoJSON features
+        """
+        for feature in features:
+            self.write_feature(feature)
+
+    def close(self) -> str:
+        """
+        Commits the last features, builds the spatial index and closes the GeoPackage file.
+
+        Returns:
+            str: path to the output GeoPackage file
+        """
+        if self.ds is not None:
+            self.ds.CommitTransaction()
+            result = self.ds.ExecuteSQL(f"SELECT CreateSpatialIndex('{self.layer_name}', '{self.layer.GetGeometryColumn()}')")
+            self.ds.ReleaseResultSet(result)
+            self.layer = None
+            self.ds = None
+        return self.output_path
+
+    def __enter__(self) -> 'GPKGStreamWriter':
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            # do not leave an incomplete file behind
+            self.layer = None
+            self.ds = None
+            ogr.GetDriverByName("GPKG").DeleteDataSource(self.output_path)
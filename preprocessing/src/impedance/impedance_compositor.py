@@ -0,0 +1,125 @@
+from osgeo import gdal
+import numpy as np
+# local imports
+from utils import block_windows, create_tiled_raster
+from impedance.impedance_processor import PROXIMITY_NODATA, decay_edge_effect
+
+class ImpedanceCompositor():
+    """
+    The ImpedanceCompositor class combines the edge effects of all stressors with the initial impedance dataset in a single block-wise pass.
+    Instead of keeping a full-raster maximum array and writing an edge effect raster per stressor, it reads the proximity rasters of all stressors
+    block by block, applies the decay of each stressor and keeps the maximum value with the initial impedance (capped by its maximum value).
+    Edge effect rasters already computed by tiles (see ImpedanceProcessor.calculate_edge_effect_tiled) are combined in the same pass.
+    Blocks left out of sparse proximity or edge effect rasters (beyond the maximum distance of stressors) are not read.
+    """
+
+    def __init__(self, impedance_ds:gdal.Dataset, impedance_max:float, verbose:bool=False) -> None:
+        """
+        Initialize the ImpedanceCompositor class with the impedance dataset.
+
+        Args:
+            impedance_ds (gdal.Dataset): The impedance raster dataset.
+            impedance_max (float): The maximum value of the impedance dataset.
+            verbose (bool): The flag to print the debug statements.
+        """
+        self.impedance_ds = impedance_ds
+        self.impedance_max = impedance_max
+        self.verbose = verbose
+        self.stressors = [] # list of stressor sources to be composited
+
+    def add_stressor(self, proximity_raster:str, decay_params:tuple[str, float, float], nodata_value:float, edge_output_path:str=None) -> None:
+        """
+        Register the proximity raster of a stressor for compositing.
+
+        Args:
+            proximity_raster (str): The path to the proximity raster of the stressor.
+            decay_params (tuple): Tuple containing the decline type, the lambda decay parameter and the k-value.
+            nodata_value (float): The no data value of the stressor (used for the edge effect raster).
+            edge_output_path (str): The path to write the edge effect raster of the stressor (optional, not written if None).
+        """
+        self.stressors.append({
+            'proximity_raster': proximity_raster,
+            'decay_params': decay_params,
+            'nodata_value': nodata_value,
+            'edge_output_path': edge_output_path
+        })
+
+    def add_edge_effect(self, edge_raster:str, nodata_value:float) -> None:
+        """
+        Register the edge effect raster of a stressor (already decayed, e.g. computed by tiles) for compositing.
+
+        Args:
+            edge_raster (str): The path to the edge effect raster of the stressor.
+            nodata_value (float): The no data value of the edge effect raster (pixels not affected by the stressor).
+        """
+        self.stressors.append({
+            'edge_raster': edge_raster,
+            'nodata_value': nodata_value,
+            'edge_output_path': None
+        })
+
+    def composite(self, output_path:str, nodata_value:float=None) -> str:
+        """
+        Compute the edge effect of all registered stressors block by block and write the maximum result raster.
+
+        Args:
+            output_path (str): The path to the output raster with the maximum result.
+            nodata_value (float): The no data value of the output raster.
+
+        Returns:
+            str: The path to the maximum result raster GeoTIFF file.
+        """
+        impedance_band = self.impedance_ds.GetRasterBand(1)
+        out_ds = create_tiled_raster(output_path, self.impedance_ds, gdal.GDT_Int32, nodata_value)
+        out_band = out_ds.GetRasterBand(1)
+
+        # open the sources (and the edge effect outputs if requested) once for the whole pass
+        sources = []
+        for stressor in self.stressors:
+            prox_ds = gdal.Open(stressor.get('edge_raster') or stressor['proximity_raster'])
+            edge_ds = None
+            if stressor['edge_output_path'] is not None:
+                edge_ds = create_tiled_raster(stressor['edge_output_path'], self.impedance_ds, gdal.GDT_Int32, stressor['nodata_value'])
+            sources.append((prox_ds, edge_ds, stressor))
+
+        for xoff, yoff, xsize, ysize in block_windows(impedance_band):
+            max_result = impedance_band.ReadAsArray(xoff, yoff, xsize, ysize).astype(np.float64)
+            for prox_ds, edge_ds, stressor in sources:
+                # blocks of truncated proximity rasters beyond the maximum distance are not written, so they are skipped (edge effect rasters are no data there)
+                prox_band = prox_ds.GetRasterBand(1)
+                if prox_band.GetDataCoverageStatus(xoff, yoff, xsize, ysize)[0] == gdal.GDAL_DATA_COVERAGE_STATUS_EMPTY:
+                    continue
+                if 'edge_raster' in stressor:
+                    # edge effect is already computed, pixels not affected by the stressor are left out of the maximum
+                    edge_data = prox_band.ReadAsArray(xoff, yoff, xsize, ysize)
+                    np.maximum(max_result, edge_data, out=max_result, where=edge_data != stressor['nodata_value'])
+                    continue
+                proximity_data = prox_band.ReadAsArray(xoff, yoff, xsize, ysize)
+                # evaluate decay only within the maximum distance (the whole block if proximity was not truncated)
+                within_distance = proximity_data != PROXIMITY_NODATA
+                result = np.full(proximity_data.shape, stressor['nodata_value'], dtype=np.float64)
+                if within_distance.any():
+                    result[within_distance] = decay_edge_effect(proximity_data[within_distance], stressor['decay_params'][0], self.impedance_max, *stressor['decay_params'][1:])
+                    # pixels not affected by the stressor are left out of the maximum
+                    valid = within_distance & (result > 0)
+                    np.maximum(max_result, result, out=max_result, where=valid)
+                    result[~valid] = stressor['nodata_value']
+                if edge_ds is not None:
+                    edge_ds.GetRasterBand(1).WriteArray(result, xoff, yoff)
+
+            # impedance can't be higher than in the initial impedance dataset
+            np.minimum(max_result, self.impedance_max, out=max_result)
+            out_band.WriteArray(max_result, xoff, yoff)
+
+        for prox_ds, edge_ds, stressor in sources:
+            if edge_ds is not None:
+                edge_ds.FlushCache()
+                print(f"Edge effect raster has been exported to: {stressor['edge_output_path']}")
+        sources = None
+
+        out_band.FlushCache()
+        out_ds.FlushCache()
+        out_ds = None
+        print(f"The updated impedance raster dataset has been exported to: {output_path}")
+
+        return output_path
@@ -1,9 +1,106 @@
-import warnings
+import math
+import multiprocessing
 from osgeo import gdal
 import numpy as np
 import os
 # local imports
-from utils import find_stressor_params
+from utils import find_stressor_params, create_tiled_raster
+
+# no data value of proximity rasters computed with a maximum distance (pixels beyond it are not affected by the stressor)
+PROXIMITY_NODATA = -1
+
+def edge_effect_cutoff(decline_type:str, impedance_max:float, lambda_decay:float, k_value:float) -> float:
+    """
+    Estimates the distance (in georeferenced units) beyond which the edge effect of a stressor falls below one impedance unit.
+    For exponential decline it is the distance where impedance_max * exp(-d / lambda_decay) < 1, 
+    for proportional decline it is the distance where impedance_max - k_value * d <= 0.
+
+    Args:
+        decline_type (str): The type of decline ('exp_decline' or 'prop_decline').
+        impedance_max (float): The maximum value of the impedance dataset.
+        lambda_decay (float): The lambda decay parameter (exponential decline).
+        k_value (float): The k-value (proportional decline).
+
+    Returns:
+        float: The cut-off distance of the edge effect.
+    """
+    if decline_type == 'exp_decline':
+        return lambda_decay * math.log(max(impedance_max, 1.0))
+    elif decline_type == 'prop_decline':
+        return impedance_max / k_value
+    raise ValueError(f"Unknown decline type: {decline_type}. Use either 'exp_decline' or 'prop_decline'.")
+
+def decay_edge_effect(proximity_data:np.ndarray, decline_type:str, impedance_max:float, lambda_decay:float, k_value:float) -> np.ndarray:
+    """
+    Calculates the edge effect of a stressor from the distance to it.
+
+    Args:
+        proximity_data (np.ndarray): The distance to the stressor.
+        decline_type (str): The type of decline ('exp_decline' or 'prop_decline').
+        impedance_max (float): The maximum value of the impedance dataset.
+        lambda_decay (float): The lambda decay parameter (exponential decline).
+        k_value (float): The k-value (proportional decline).
+
+    Returns:
+        np.ndarray: The edge effect.
+    """
+    if decline_type == 'exp_decline':
+        return impedance_max * np.exp(-proximity_data / lambda_decay)
+    elif decline_type == 'prop_decline':
+        return np.maximum(impedance_max - k_value * proximity_data, 0)
+    raise ValueError(f"Unknown decline type: {decline_type}. Use either 'exp_decline' or 'prop_decline'.")
+
+def compute_tile_edge_effect(tile_args:tuple) -> tuple[tuple[int,int,int,int], np.ndarray]:
+    """
+    Computes the edge effect of a stressor for a single tile (executed by the workers of a process pool).
+    The tile is read together with a halo as wide as the cut-off distance, so that stressors outside of the tile are taken into account.
+
+    Args:
+        tile_args (tuple): Tuple containing the path to the stressor raster, the tile window (xoff, yoff, xsize, ysize), 
+            the halo (in pixels), the no data value of the stressor, the cut-off distance and the decay parameters (decline type, impedance_max, lambda_decay, k_value).
+
+    Returns:
+        tuple: Tuple containing the tile window and the edge effect of the tile (no data where the stressor has no effect).
+    """
+    stressor_raster, window, halo, nodata_value, max_distance, decay_params = tile_args
+    xoff, yoff, xsize, ysize = window
+
+    ds = gdal.Open(stressor_raster)
+    band = ds.GetRasterBand(1)
+    # extend the tile with the halo (clipped to the raster extent)
+    x0, y0 = max(xoff - halo, 0), max(yoff - halo, 0)
+    x1, y1 = min(xoff + xsize + halo, ds.RasterXSize), min(yoff + ysize + halo, ds.RasterYSize)
+    geotransform = ds.GetGeoTransform()
+    tile_geotransform = (geotransform[0] + x0 * geotransform[1] + y0 * geotransform[2], geotransform[1], geotransform[2],
+                         geotransform[3] + x0 * geotransform[4] + y0 * geotransform[5], geotransform[4], geotransform[5])
+
+    mem_driver = gdal.GetDriverByName('MEM')
+    src_ds = mem_driver.Create('', x1 - x0, y1 - y0, 1, band.DataType)
+    src_ds.SetGeoTransform(tile_geotransform)
+    src_ds.SetProjection(ds.GetProjection())
+    src_band = src_ds.GetRasterBand(1)
+    src_band.SetNoDataValue(nodata_value)
+    src_band.WriteArray(band.ReadAsArray(x0, y0, x1 - x0, y1 - y0))
+    ds = None
+
+    prox_ds = mem_driver.Create('', x1 - x0, y1 - y0, 1, gdal.GDT_Int32)
+    prox_ds.SetGeoTransform(tile_geotransform)
+    prox_ds.SetProjection(src_ds.GetProjection())
+    prox_band = prox_ds.GetRasterBand(1)
+    gdal.ComputeProximity(src_band, prox_band, ['DISTUNITS=GEO', f'NODATA={PROXIMITY_NODATA}', f'MAXDIST={max_distance}'])
+
+    # crop the halo away
+    proximity_data = prox_band.ReadAsArray(xoff - x0, yoff - y0, xsize, ysize)
+    src_ds = None
+    prox_ds = None
+
+    # evaluate decay only within the maximum distance
+    result = np.full(proximity_data.shape, nodata_value, dtype=np.float64)
+    within_distance = proximity_data != PROXIMITY_NODATA
+    if within_distance.any():
+        result[within_distance] = decay_edge_effect(proximity_data[within_distance], *decay_params)
+        result[result <= 0] = nodata_value
+    return window, result
 
 class ImpedanceProcessor():
     """
@@ -60,82 +157,59 @@ class ImpedanceProcessor():
             self.input_band.SetNoDataValue(self.nodata_value)
         print(f"No data value for input dataset is {self.nodata_value}") # debug
 
-        data = self.input_band.ReadAsArray()
-        # debug
-        min_value = np.min(data)
-        max_value = np.max(data)
-        print(f"Range of values in the data: {min_value} to {max_value}")
+        # debug (reads the whole raster, so only in verbose mode)
+        if self.verbose:
+            data = self.input_band.ReadAsArray()
+            min_value = np.min(data)
+            max_value = np.max(data)
+            print(f"Range of values in the data: {min_value} to {max_value}")
 
-        no_data_count = np.sum(data == self.nodata_value) # supposed to be non-zero
-        print (f"No data count: {no_data_count}")
+            no_data_count = np.sum(data == self.nodata_value) # supposed to be non-zero
+            print (f"No data count: {no_data_count}")
 
         # get the geo-transform (affine transformation parameters)
         self.geotransform = self.ds.GetGeoTransform()
         self.projection = self.ds.GetProjection()
         return self.nodata_value, self.geotransform, self.projection
 
-    def compute_proximity(self):
+    def compute_proximity_to_file(self, max_distance:float=None) -> str:
         """
-        Compute the proximity raster for the stressor raster dataset.
+        Compute the proximity raster for the stressor raster dataset directly into a tiled GeoTIFF (without keeping it in memory).
+
+        Args:
+            max_distance (float): The maximum distance to compute (optional). Pixels further from the stressor are set to PROXIMITY_NODATA.
 
         Returns:
-            np.ndarray: The proximity data as a NumPy array.
+            str: The path to the proximity raster GeoTIFF file.
         """
-        output_ds = self.mem_driver.Create('', self.impedance_ds.RasterXSize, self.impedance_ds.RasterYSize, 1, gdal.GDT_Int32) # Int64 might not support .SetNoDataValue()
-        # NOTE: it is not possible to specify no data value directly in gdal_create
-
-        # set geotransform parameters from input file
-        if self.geotransform:
-            output_ds.SetGeoTransform(self.geotransform)
-        if self.projection:
-            output_ds.SetProjection(self.projection)
+        dist_tiff_output = self.proximity_output_path()
+        print(f"Distance path: {dist_tiff_output}") # debug
 
+        # blocks beyond the maximum distance are entirely no data, so they are not written (and skipped by ImpedanceCompositor)
+        output_ds = create_tiled_raster(dist_tiff_output, self.impedance_ds, gdal.GDT_Int32, PROXIMITY_NODATA, sparse=max_distance is not None) # Int64 might not support .SetNoDataValue()
         output_band = output_ds.GetRasterBand(1)
-        
+        options = ['DISTUNITS=GEO', f'NODATA={PROXIMITY_NODATA}']
+        if max_distance is not None:
+            options.append(f'MAXDIST={max_distance}')
         try:
-            gdal.ComputeProximity(self.input_band, output_band, ['DISTUNITS=GEO', f'NODATA={self.nodata_value}']) 
+            gdal.ComputeProximity(self.input_band, output_band, options)
         except RuntimeError as e:
             print(f"Error computing proximity for {self.stressor_raster}: {str(e)}")
 
-        # 3.1 read proximity data as a NumPy array for validation/debugging
-        proximity_data = output_band.ReadAsArray()
-        output_nodata_value = output_band.GetNoDataValue()
-        print(f"NoData value of output raster is {output_nodata_value}")
-        # print(proximity_data) # debug: 0 for all pixels of last raster
-
-        output_nodata_count = np.sum(proximity_data == output_nodata_value)
-        print(f"Output no data count is {output_nodata_count}") # supposed to be 0
-        print(f"No data value for output dataset is {output_nodata_value}") # debug
-
-        # warn if no data values are detected
-        if output_nodata_count > 0:
-            warnings.warn(f"No data values have been detected in the proximity raster for {self.stressor_raster}. Check the validity of the input vector dataset.")
-
-        # create a VRT file as a reference to the proximity raster in memory
-        vrt_output_path = os.path.join(self.output_dir, f'{os.path.basename(self.stressor_raster).replace(".tif", "")}_dist.vrt')
-        vrt_options = gdal.BuildVRTOptions(resampleAlg='nearest')
-
-        # build VRT from the in-memory proximity dataset
-        vrt_ds = gdal.BuildVRT(vrt_output_path, [output_ds], options=vrt_options)
-
-        # debug: export proximity raster to GeoTIFF
-        tiff_output = f'{os.path.basename(self.stressor_raster).replace(".tif", "")}_dist.tif'
-        dist_tiff_output = os.path.normpath(os.path.join(self.current_dir, self.output_dir ,tiff_output))
-        print(f"Distance path: {dist_tiff_output}") # debug
-        gdal.Translate(dist_tiff_output, vrt_ds, format="GTiff", outputType=gdal.GDT_Int32, creationOptions=["COMPRESS=LZW"])
-        # debug
-        if os.path.exists(dist_tiff_output):
-            print(f"File successfully created: {dist_tiff_output}")
-        else:
-            print(f"Error: File not created at: {dist_tiff_output}")
-
         # flush the cache
         output_band.FlushCache()
-        vrt_ds.FlushCache()
         output_ds.FlushCache()
+        output_ds = None
+
+        return dist_tiff_output
+
+    def proximity_output_path(self) -> str:
+        """
+        Returns the path to the proximity raster of the stressor written by compute_proximity_to_file.
+        """
+        tiff_output = f'{os.path.basename(self.stressor_raster).replace(".tif", "")}_dist.tif'
+        return os.path.normpath(os.path.join(self.current_dir, self.output_dir, tiff_output))
 
-        return proximity_data
-    
     def find_param(self, stressor_dict, search_key):
         """
         Find the parameter in the stressor dictionary by searching the key recursively
@@ -156,24 +230,19 @@ class ImpedanceProcessor():
                     return result
         return None
                 
-    def calculate_edge_effect(self, proximity_data: np.ndarray):
+    def edge_effect_output_path(self) -> str:
+        """
+        Returns the path to the output raster dataset with the edge effect of the stressor.
         """
-        Calculate the edge effect based on the proximity data and the impedance configuration parameters (decay type, lambda decay, k-value).
+        return os.path.join(self.output_dir, f'{os.path.basename(self.stressor_raster).replace(".tif", "")}_edge.tif')
 
-        Args:
-            proximity_data (np.ndarray): The proximity data as a NumPy array.
+    def get_decay_params(self) -> tuple[str, float, float]:
+        """
+        Fetches the decay parameters of the stressor from the impedance configuration.
 
         Returns:
-            np.ndarray: The maximum result for the impedance calculation.
+            tuple: Tuple containing the decline type, the lambda decay parameter and the k-value.
         """
-        # NOTE: decay might vary across classes of stressors. For example, primary and tertiary roads will have the different negative impact on natural habitats. 
-        # In first case it will occur more likely at some distance than in the second case.
-        # therefore, we attempt to define different decay parameter by types of vector dataset
-         # set decay output path
-        edgeEff_output_path = os.path.join(self.output_dir, f'{os.path.basename(self.stressor_raster).replace(".tif", "")}_edge.tif')
-        print(f"Path to output raster dataset with calculated edge effect: {edgeEff_output_path}") # debug
-
-        # get corresponding parameter for each stressor
         stressor_params = find_stressor_params(self.config_impedance, self.yaml_stressor) # !if the output of find_stressor_params it will be automatically replaced with sample values!
         print(f"self.yaml_stressor is {self.yaml_stressor}")
         print(f"Stressor parameters: {stressor_params}") # debug 
@@ -187,107 +256,62 @@ class ImpedanceProcessor():
             {lambda_decay} (lambda decay parameter), 
             {k_value} (k-value of proportional decline)"""
         )
+        return decline_type, lambda_decay, k_value
 
-        # calculate impedance now
-        if decline_type == 'exp_decline':
-            result = self.impedance_max * np.exp(-proximity_data / lambda_decay) # impedance_max value has already been extracted through a separate function
-            print(f"Decline type is {decline_type}. Expression to calculate edge effect: {self.impedance_max} * exp(- proximity_data / {lambda_decay})") # debug
-        elif decline_type == 'prop_decline':  # proportional decay 
-            result = np.maximum(self.impedance_max - k_value * proximity_data, 0)
-            print(f"Decline type is {decline_type}. Expression to calculate edge effect: max({self.impedance_max} - {k_value} * proximity_data, 0)") # debugt
-
-        # set values < 0 to no data value
-        result[result <= 0] = self.nodata_value
-        result = np.ma.masked_equal(result, self.nodata_value)
-
-        # combine the results: keep the maximum value for each pixel throutgh iterations (keep the larger impedance)
-        if self.max_result is None:
-            self.max_result = result.copy()  # initialize with the first raster's result
-        else:
-            self.max_result = np.maximum(self.max_result, result)  # take max of previous and current
-        
-        # FOR CUMULATIVE FUNCTION OF DIFFERENT STRESSORS 
-        '''
-        # combine the results from each raster by summing
-        if self.cumul_result is None:
-            self.cumul_result = result.copy()  # initialize with a copy of the first raster
-        else:
-            self.cumul_result += result  # increment cumulative result
-        '''
-        # define edge effect result for export
-        out_result = self.driver.Create(edgeEff_output_path, self.impedance_ds.RasterXSize, self.impedance_ds.RasterYSize, 1, gdal.GDT_Int32, ['COMPRESS=LZW']) # compress
-        # set geotransform and projection before exporting
-        out_result.SetGeoTransform(self.geotransform)
-        out_result.SetProjection(self.projection)
-        
-        # write the masked result to the output raster's first band
-        out_band = out_result.GetRasterBand(1)
-
-        # set the nodata value in the band
-        if self.nodata_value is not None:
-            out_band.SetNoDataValue(self.nodata_value)  # define nodata 
-
-        # write array to the band of output dataset (export)
-        out_band.WriteArray(result)
-
-        # clean up intermediate objects by flushing the cache
-        # flush the cache
-        out_band.FlushCache()
-        out_result.FlushCache()
-        self.ds.FlushCache()   
+    def get_max_distance(self) -> float:
+        """
+        Derives the maximum effective distance of the stressor from its decay parameters (beyond it the edge effect is below one impedance unit).
 
-        print(f"Finished processing: {self.stressor_raster}")
-        print("-" * 40)
-        
-        return self.max_result # return the maximum result to be used in the next iteration
+        Returns:
+            float: The maximum effective distance of the stressor.
+        """
+        decline_type, lambda_decay, k_value = self.get_decay_params()
+        max_distance = edge_effect_cutoff(decline_type, self.impedance_max, lambda_decay, k_value)
+        print(f"Maximum effective distance of the stressor is {max_distance:.2f}") # debug
+        return max_distance
 
-    def update_impedance_with_decay(self) -> str:
+    def calculate_edge_effect_tiled(self, workers:int, tile_size:int=1024) -> str:
         """
-        Once the edge effect for all stressors is calculated, this function will be called to generate a maximum result raster.
-        The maximum result is the maximum impedance value for each pixel across all stressors.
+        Computes proximity and edge effect of the stressor tile by tile on a process pool and writes each tile into the edge effect raster as soon as it is computed,
+        so that no full-raster array is kept in memory (edge effect rasters of all stressors are combined block by block by ImpedanceCompositor).
+        Each tile is extended with a halo sized from the cut-off distance of the decay, so the result matches the whole-raster computation 
+        wherever the edge effect is at least one impedance unit (pixels beyond the cut-off distance are set to no data).
+
+        Args:
+            workers (int): The number of worker processes.
+            tile_size (int): The size of the tiles in pixels (default is 1024).
 
         Returns:
-            str: The path to the maximum result raster GeoTIFF file.
+            str: The path to the edge effect raster of the stressor.
         """
-        impedance_band = self.impedance_ds.GetRasterBand(1)
-        impedance_array = impedance_band.ReadAsArray()
-
-        #let's choose the maximum value from initial impedance dataset and edge effect calculated previously:
-        self.max_result = np.maximum(self.max_result, impedance_array)
-        #then, apply the maximum value of initial impedance dataset as a cap to the maximum result (impedance can't be higher than in the initial impedance dataset):
-        self.max_result[self.max_result > self.impedance_max] = self.impedance_max
-
-        # DEBUG: ensure the size of the final result matches initial impedance dataset. In theory, they should be identical, but rasterised OSM datasets can have larger spatial extent than input LULC or impedance datasets.
-        impedance_array_shape = impedance_array.shape # shape of input impedance dataset
-        max_result_shape = self.max_result.shape # shape of output dataset with maximum values of edfe effect
-        if impedance_array.shape != self.max_result.shape:
-            warnings.showwarning("The impedance raster dimensions do not match the cumulative decay raster dimensions.")
-            print(f"Initial impedance shape is {impedance_array_shape} and maximum result shape is {max_result_shape}.")
-        else:
-            print(f"The shape of maximum result is the same as the shape of initial impedance array shape: {impedance_array_shape} and {max_result_shape}.") # debug
-
-        # write the maximum result to the output raster's first band
-        max_output_path = os.path.join(self.output_dir, 'max_result.tif') # TODO - to cast filename to config.yaml: 'impedance_lulc_ukceh_25m_{year}_upd.tif' 
-        max_out_result = self.driver.Create(max_output_path, self.impedance_ds.RasterXSize,  self.impedance_ds.RasterYSize, 1, gdal.GDT_Int32, ['COMPRESS=LZW'])
-        # set geotransform and projection for export
-        max_out_result.SetGeoTransform(self.geotransform)
-        max_out_result.SetProjection(self.projection)
-
-        # Then, export the maximum result to the output raster. No data value should be explicitly specified to avoid any potential issues:
-        try:
-            max_out_band = max_out_result.GetRasterBand(1)
-            max_out_band.WriteArray(self.max_result)
-            print(f"The updated impedance raster dataset has been exported to: {max_output_path}")
-        except Exception as e:
-            raise ValueError("The updated impedance raster dataset has not been exported: {e}")
+        edgeEff_output_path = self.edge_effect_output_path()
+        print(f"Path to output raster dataset with calculated edge effect: {edgeEff_output_path}") # debug
 
-        if self.nodata_value is not None: # set nodata value for maximum result
-            max_out_band.SetNoDataValue(self.nodata_value)
+        decline_type, lambda_decay, k_value = self.get_decay_params()
+        max_distance = edge_effect_cutoff(decline_type, self.impedance_max, lambda_decay, k_value)
+        halo = math.ceil(max_distance / abs(self.geotransform[1]))
+        print(f"Cut-off distance of the edge effect is {max_distance:.2f}, tiles of {tile_size} pixels are extended by {halo} pixels") # debug
 
-        # flush the cache
-        max_out_band.FlushCache()
-        max_out_result.FlushCache()
-        self.impedance_ds.FlushCache()
+        x_size, y_size = self.ds.RasterXSize, self.ds.RasterYSize
+        tiles = [
+            (self.stressor_raster, (xoff, yoff, min(tile_size, x_size - xoff), min(tile_size, y_size - yoff)), halo, self.nodata_value, max_distance, 
+             (decline_type, self.impedance_max, lambda_decay, k_value))
+            for yoff in range(0, y_size, tile_size) for xoff in range(0, x_size, tile_size)
+        ]
+
+        # tiles without any edge effect are not written (and skipped by ImpedanceCompositor)
+        out_result = create_tiled_raster(edgeEff_output_path, self.ds, gdal.GDT_Int32, self.nodata_value, sparse=True)
+        out_band = out_result.GetRasterBand(1)
+        with multiprocessing.Pool(workers) as pool:
+            for (xoff, yoff, xsize, ysize), tile_result in pool.imap_unordered(compute_tile_edge_effect, tiles):
+                if (tile_result != self.nodata_value).any():
+                    out_band.WriteArray(tile_result, xoff, yoff)
+
+        out_band.FlushCache()
+        out_result.FlushCache()
+        out_result = None
+
+        print(f"Finished processing: {self.stressor_raster}")
+        print("-" * 40)
 
-        return max_output_path
-        
\ No newline at end of file
+        return edgeEff_output_path
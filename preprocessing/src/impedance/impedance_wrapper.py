@@ -1,8 +1,12 @@
 from osgeo import gdal
 import os
+from typing import Callable
 # local imports
 from utils import load_yaml, save_yaml, get_max_from_tif, find_stressor_params, read_years_from_config
+from scheduler import estimate_raster_memory
+from stage_cache import StageCache
 from impedance.impedance_processor import ImpedanceProcessor
+from impedance.impedance_compositor import ImpedanceCompositor
 from impedance.impedance_config_processor import ImpedanceConfigProcessor
 
 #TODO use verbose flag to print debug messages
@@ -18,7 +22,12 @@ class ImpedanceWrapper():
         k_value: float,
         config_path:str,
         config_impedance_path:str,
-        verbose: bool 
+        verbose: bool,
+        workers: int = 1,
+        tile_size: int = 1024,
+        save_edge_rasters: bool = False,
+        truncate_distance: bool = False,
+        use_cache: bool = False
     ):
         """
         Initialize the ImpedanceWrapper class with the configuration file paths and other parameters.
@@ -31,6 +40,11 @@ class ImpedanceWrapper():
             config_path (str): The path to the main configuration file.
             config_impedance_path (str): The path to the impedance configuration file.
             verbose (bool): The verbosity flag.
+            workers (int): The number of worker processes to compute the edge effect by tiles (1 processes the whole raster at once).
+            tile_size (int): The size of the tiles in pixels (if workers > 1).
+            save_edge_rasters (bool): Whether to write the edge effect raster of each stressor (always written if workers > 1).
+            truncate_distance (bool): Whether to compute proximity only up to the maximum effective distance of each stressor (always applied if workers > 1).
+            use_cache (bool): Whether to skip the proximity of stressors and the composite if their inputs, parameters and code are unchanged since the last run.
         """
     
         # load the configuration files
@@ -38,6 +52,10 @@ class ImpedanceWrapper():
         self.config_impedance_path = config_impedance_path
         self.config_impedance = load_yaml(self.config_impedance_path)
         self.verbose = verbose
+        self.workers = workers
+        self.tile_size = tile_size
+        self.save_edge_rasters = save_edge_rasters
+        self.truncate_distance = truncate_distance
         
         # define the dictionary template for the configuration YAML file (for each stressor). We are using variables defined above.
         self.params_placeholder = {
@@ -68,6 +86,9 @@ class ImpedanceWrapper():
         if not os.path.exists(self.impedance_res_dir):
             os.makedirs(self.impedance_res_dir)
 
+        # manifest of completed stages (shared by all commands of the case study)
+        self.cache = StageCache(os.path.join(self.output_dir, "stage_cache")) if use_cache else None
+
         
 
     def validate_impedance_config(self, impedance_stressors:dict) -> str:
@@ -111,6 +132,20 @@ class ImpedanceWrapper():
                 self.config_impedance = validation_config
                 return "exit"
 
+    def get_impedance_tif(self, year:int) -> str:
+        """
+        Get the path to the impedance raster dataset of the year.
+
+        Args:
+            year (int): The year to use for the impedance dataset.
+
+        Returns:
+            str: The path to the impedance raster dataset.
+        """
+        impedance_tif_template = self.config.get('impedance_tif')
+        impedance_tif = impedance_tif_template.format(year=year) # substitute year from the configuration file
+        return os.path.normpath(os.path.join(self.current_dir,self.impedance_dir,impedance_tif))
+
     def get_impedance_max_value(self, year:int) -> tuple[gdal.Dataset, float]:
         """
         Get the maximum value from the impedance raster dataset.
@@ -121,9 +156,7 @@ class ImpedanceWrapper():
         Returns:
             tuple: Tuple containing the impedance dataset and the maximum value of the impedance dataset.
         """
-        impedance_tif_template = self.config.get('impedance_tif')
-        impedance_tif = impedance_tif_template.format(year=year) # substitute year from the configuration file
-        impedance_tif = os.path.normpath(os.path.join(self.current_dir,self.impedance_dir,impedance_tif))
+        impedance_tif = self.get_impedance_tif(year)
         
         if impedance_tif is not None:
             impedance_ds = gdal.Open(impedance_tif) # open raster impedance dataset
@@ -157,7 +190,7 @@ class ImpedanceWrapper():
         return impedance_stressors
     
 
-    def calculate_impedance(self, impedance_stressors:dict, impedance_ds:gdal.Dataset, impedance_max:float) -> str:
+    def calculate_impedance(self, impedance_stressors:dict, impedance_ds:gdal.Dataset, impedance_max:float, output_dir:str=None) -> str:
         """
         Calculate the impedance for the stressors and generate the maximum result raster.
 
@@ -165,16 +198,22 @@ class ImpedanceWrapper():
             impedance_stressors (dict): The dictionary of stressors, mapping stressor raster path to YAML alias.
             impedance_ds (gdal.Dataset): The impedance raster dataset.
             impedance_max (float): The maximum value of the impedance dataset.
+            output_dir (str): The directory of the results (default is None, the impedance results directory).
         
         Returns:
             str: The path to the maximum result raster GeoTIFF file.
         """
-        # initialise variables with outputs of the effects from all rasters
-        max_result = None
-        cumul_result = None
+        if output_dir is None:
+            output_dir = self.impedance_res_dir
+        if self.workers == 1:
+            # composite all stressors in a single block-wise pass
+            return self.composite_impedance(impedance_stressors, impedance_ds, impedance_max, output_dir)
+
+        # edge effect rasters of all stressors are computed by tiles, then combined with the impedance dataset block by block
         driver = gdal.GetDriverByName('GTiff') # has already been defined above
         mem_driver = gdal.GetDriverByName('MEM')
-        impedance_processor = None # initialize the impedance processor to use after the loop
+        compositor = ImpedanceCompositor(impedance_ds=impedance_ds, impedance_max=impedance_max, verbose=self.verbose)
+        nodata_value = None
 
         for yaml_stressor, stressor_raster in impedance_stressors.items():
             # read the raster
@@ -182,10 +221,10 @@ class ImpedanceWrapper():
             print(f"Corresponding key in YAML configuration: {yaml_stressor}") # debug
             # open the input raster dataset
             impedance_processor = ImpedanceProcessor(
-                max_result=max_result,
-                cumul_result=cumul_result,
+                max_result=None,
+                cumul_result=None,
                 current_dir=self.current_dir,
-                output_dir=self.impedance_res_dir,
+                output_dir=output_dir,
                 config_impedance=self.config_impedance,
                 yaml_stressor=yaml_stressor,
                 stressor_raster=stressor_raster,
@@ -199,14 +238,143 @@ class ImpedanceWrapper():
                 print(f"Failed to open {stressor_raster}, skipping...")
                 continue
             else:
-                impedance_processor.handle_no_data()
-                proximity_data = impedance_processor.compute_proximity()
-                max_result = impedance_processor.calculate_edge_effect(proximity_data)
-                # print(f"Maximum result: {max_result}") # debug
+                nodata_value, _, _ = impedance_processor.handle_no_data()
+                # compute proximity and edge effect by tiles in parallel
+                edge_raster = impedance_processor.calculate_edge_effect_tiled(self.workers, self.tile_size)
+                compositor.add_edge_effect(edge_raster, nodata_value)
         
         # Once all stressors have been processed, update the impedance dataset with decay
-        max_result_tif = impedance_processor.update_impedance_with_decay()
-        return max_result_tif
+        max_output_path = os.path.join(output_dir, 'max_result.tif')
+        return compositor.composite(max_output_path, nodata_value)
+
+    def composite_impedance(self, impedance_stressors:dict, impedance_ds:gdal.Dataset, impedance_max:float, output_dir:str) -> str:
+        """
+        Compute the proximity raster of each stressor and combine the edge effects of all stressors with the impedance dataset in a single block-wise pass.
+        Edge effect rasters of each stressor are only written if requested.
+
+        Args:
+            impedance_stressors (dict): The dictionary of stressors, mapping stressor raster path to YAML alias.
+            impedance_ds (gdal.Dataset): The impedance raster dataset.
+            impedance_max (float): The maximum value of the impedance dataset.
+            output_dir (str): The directory of the results.
+
+        Returns:
+            str: The path to the maximum result raster GeoTIFF file.
+        """
+        driver = gdal.GetDriverByName('GTiff')
+        mem_driver = gdal.GetDriverByName('MEM')
+        compositor = ImpedanceCompositor(impedance_ds=impedance_ds, impedance_max=impedance_max, verbose=self.verbose)
+        nodata_value = None
+
+        for yaml_stressor, stressor_raster in impedance_stressors.items():
+            print(f"Processing: {stressor_raster}") # debug
+            print(f"Corresponding key in YAML configuration: {yaml_stressor}") # debug
+            impedance_processor = ImpedanceProcessor(
+                max_result=None,
+                cumul_result=None,
+                current_dir=self.current_dir,
+                output_dir=output_dir,
+                config_impedance=self.config_impedance,
+                yaml_stressor=yaml_stressor,
+                stressor_raster=stressor_raster,
+                driver=driver,
+                mem_driver=mem_driver,
+                impedance_ds=impedance_ds,
+                impedance_max=impedance_max,
+                verbose=self.verbose
+                )
+            if impedance_processor.ds is None:
+                print(f"Failed to open {stressor_raster}, skipping...")
+                continue
+            nodata_value, _, _ = impedance_processor.handle_no_data()
+            max_distance = impedance_processor.get_max_distance() if self.truncate_distance else None
+            proximity_raster = impedance_processor.proximity_output_path()
+            # proximity only depends on the stressor (and on the decay parameters if it is truncated)
+            self.run_stage(
+                f"proximity:{proximity_raster}",
+                lambda: impedance_processor.compute_proximity_to_file(max_distance),
+                [stressor_raster, impedance_ds.GetDescription()],
+                [proximity_raster],
+                {'max_distance': max_distance},
+                [ImpedanceProcessor]
+            )
+            edge_output_path = impedance_processor.edge_effect_output_path() if self.save_edge_rasters else None
+            compositor.add_stressor(proximity_raster, impedance_processor.get_decay_params(), nodata_value, edge_output_path)
+
+        max_output_path = os.path.join(output_dir, 'max_result.tif') # TODO - to cast filename to config.yaml: 'impedance_lulc_ukceh_25m_{year}_upd.tif' 
+        edge_outputs = [stressor['edge_output_path'] for stressor in compositor.stressors if stressor['edge_output_path'] is not None]
+        self.run_stage(
+            f"composite:{max_output_path}",
+            lambda: compositor.composite(max_output_path, nodata_value),
+            [impedance_ds.GetDescription()] + [stressor['proximity_raster'] for stressor in compositor.stressors],
+            [max_output_path] + edge_outputs,
+            {
+                'impedance_max': impedance_max,
+                'nodata_value': nodata_value,
+                'stressors': [(stressor['decay_params'], stressor['nodata_value'], stressor['edge_output_path']) for stressor in compositor.stressors]
+            },
+            [ImpedanceCompositor, ImpedanceProcessor]
+        )
+        return max_output_path
+
+    def run_stage(self, stage:str, func:Callable, inputs:list, outputs:list, params:dict, code:list) -> any:
+        """
+        Run a stage of the impedance calculation, skipping it if the cache is used and its inputs, parameters and code are unchanged.
+
+        Args:
+            stage (str): The unique name of the stage.
+            func (Callable): The function running the stage.
+            inputs (list): The paths to the input files.
+            outputs (list): The paths to the output files.
+            params (dict): The parameters of the stage.
+            code (list): The modules or classes implementing the stage.
+
+        Returns:
+            any: The result of the function (None if the stage was skipped).
+        """
+        if self.cache is None:
+            return func()
+        return self.cache.run(stage, func, inputs, outputs, params, code)
+
+    def estimate_year_memory(self, year:int) -> int:
+        """
+        Estimate the peak memory used to calculate the impedance of a year (rasters are processed block by block, and tile by tile by the workers if edge effect is computed by tiles).
+
+        Args:
+            year (int): The year to use for the impedance dataset.
+
+        Returns:
+            int: The estimated peak memory in bytes.
+        """
+        memory = estimate_raster_memory(self.get_impedance_tif(year), 1)
+        if self.workers > 1:
+            # each worker holds the stressor, the proximity and the float64 edge effect of a tile (halos depend on the stressors and are not counted)
+            memory += self.workers * self.tile_size ** 2 * TILE_BYTES_PER_PIXEL
+        return memory
+
+# approximate bytes held in memory per pixel of a tile by each worker computing edge effect by tiles
+TILE_BYTES_PER_PIXEL = 24
+
+def calculate_impedance_year(year:int, iw:ImpedanceWrapper, impedance_stressors:dict) -> str:
+    """
+    Calculate the impedance of one year (to be dispatched to a worker process by the year scheduler).
+    Results are written into a subdirectory of the year, so that years (concurrent or not) don't overwrite each other.
+    The wrapper is not modified, so that it can be reused for the next year.
+
+    Args:
+        year (int): The year to use for the impedance dataset.
+        iw (ImpedanceWrapper): The impedance wrapper.
+        impedance_stressors (dict): The dictionary of stressors, mapping stressor raster path to YAML alias.
+
+    Returns:
+        str: The path to the maximum result raster GeoTIFF file.
+    """
+    output_dir = os.path.join(iw.impedance_res_dir, str(year))
+    os.makedirs(output_dir, exist_ok=True)
+    # 3.  Get the maximum value of the impedance raster dataset
+    impedance_ds, impedance_max = iw.get_impedance_max_value(year)
+    # 3.0 Calculate impedance
+    return iw.calculate_impedance(impedance_stressors, impedance_ds, impedance_max, output_dir)
     
 if __name__ == "__main__":
     stressor_yaml_path = os.path.join('config', 'stressors.yaml')
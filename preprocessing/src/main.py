@@ -6,8 +6,10 @@ from cli_markdown import print_table
 import os
 from protected_areas.wpda_wrapper import WDPAWrapper
 from osm.osm_wrapper import OSMWrapper
-from enrichment.lulc_enrichment_wrapper import LULCEnrichmentWrapper
-from impedance.impedance_wrapper import ImpedanceWrapper
+from enrichment.lulc_enrichment_wrapper import LULCEnrichmentWrapper, enrich_lulc_year
+from impedance.impedance_wrapper import ImpedanceWrapper, calculate_impedance_year
+from scheduler import run_per_year
+from pipeline_dag import DAGRunner, Node
 import time
 
 # TODO - to add the function that can create impedance dataset based on csv table if user doesn't have it yet. So, the function can be used as option in 1,3 and 4th commands independently.
@@ -47,6 +49,12 @@ def process_wdpa(
     auto_confirm: Annotated[bool, typer.Option("--force", "-f", help="Auto confirm all prompts")] = False,
     skip_fetch: Annotated[bool, typer.Option("--skip-fetch", "-s", help="Skip fetching protected areas for existing country PA geojson (if data was already fetched from previous sessions)")] = False,
     delete_intermediate_files: Annotated[bool, typer.Option("--del-temp", "-dt", help="Delete intermediate GeoJSON & GPKG files")] = True,
+    fetch_workers: Annotated[int, typer.Option("--fetch-workers", "-fw", help="Number of pages of protected areas fetched concurrently")] = 4,
+    pa_year_raster: Annotated[bool, typer.Option("--pa-year-raster", "-yr", help="Rasterize the years of protection once and derive yearly PA rasters from it")] = False,
+    fused: Annotated[bool, typer.Option("--fused", "-fu", help="Sum LULC and PA rasters, update impedance and compute affinity in a single block-wise pass")] = False,
+    save_lulc_pa: Annotated[bool, typer.Option("--save-lulc-pa", "-sl", help="Save the sum of LULC and PA rasters in the fused mode")] = False,
+    jobs: Annotated[int, typer.Option("--jobs", "-j", help="Number of years processed concurrently in the fused mode")] = 1,
+    use_cache: Annotated[bool, typer.Option("--use-cache", "-uc", help="Skip years of the fused mode whose inputs and parameters are unchanged since the last run")] = False,
     verbose: Annotated[bool, typer.Option("--verbose", "-v", help="Verbose mode")] = False,
     record_time: Annotated[bool, typer.Option("--record-time", "-t", help="Record execution time")] = False,
 ):
@@ -60,6 +68,12 @@ def process_wdpa(
         auto_confirm (bool): Auto confirm all prompts.
         skip_fetch (bool): Skip fetching protected areas data from the API if the data already exists in the shared input directory.
         delete_intermediate_files (bool): Delete intermediate GPKG files
+        fetch_workers (int): Number of pages of protected areas fetched concurrently (interrupted fetches resume from the pages already fetched).
+        pa_year_raster (bool): Rasterize the years of protection once and derive yearly PA rasters by threshold instead of rasterizing PAs for each year.
+        fused (bool): Sum LULC and PA rasters, update impedance and compute affinity block by block in one pass, writing only the final outputs.
+        save_lulc_pa (bool): Save the sum of LULC and PA rasters in the fused mode.
+        jobs (int): Number of years processed concurrently in the fused mode.
+        use_cache (bool): Skip years of the fused mode whose inputs, parameters and code are unchanged since the last run.
         verbose (bool): Verbose mode.
         record_time (bool): Record the execution time
     """
@@ -95,33 +109,46 @@ def process_wdpa(
         print("Fetching protected areas for the selected countries...")
         # strip case study name from data/{case_study}
         merged_gpkg = case_study + "_merged_pa.gpkg"
-        merged_gpkg = wp.protected_area_to_merged_geopackage(country_codes, merged_gpkg, skip_fetch)
+        merged_gpkg = wp.protected_area_to_merged_geopackage(country_codes, merged_gpkg, skip_fetch, fetch_workers)
 
         # # STEP 3.0: Rasterize the merged GeoPackage file
         print("Rasterizing the merged GeoPackage file...")
         lulc_dir = wp.config.get("lulc_dir")
-        wp.rasterize_protected_areas(merged_gpkg, lulc_dir, use_yearly_pa_raster)
+        # the fused mode thresholds the years of protection on the fly, so yearly PA rasters are not needed
+        wp.rasterize_protected_areas(merged_gpkg, lulc_dir, use_yearly_pa_raster, pa_year_raster, write_yearly_rasters=not fused)
 
         if delete_intermediate_files:
             os.remove(merged_gpkg)
             typer.secho(f"{merged_gpkg} file has been deleted", fg=typer.colors.YELLOW)
         
-        # # STEP 4.0: Raster calculation
-        print("Summing LULC and PA rasters...")
-        wp.sum_lulc_pa_rasters(
-            input_path=os.path.join(working_dir, case_study_dir, "input"),
-            output_path=os.path.join(working_dir, case_study_dir, "output"),
-            lulc_dir=wp.config.get("lulc_dir"),
-            use_yearly_pa_rasters= use_yearly_pa_raster
-        )
-
-        # # STEP 5.0: Reclassify input raster with impedance values
-        print("Reclassifying the raster with impedance values...")
-        wp.reclassify_raster_with_impedance()
-
-        # # STEP 6: Compute affinity
-        print("Computing affinity")
-        wp.compute_affinity(os.path.join(working_dir, case_study_dir, "output", "affinity"))
+        if fused:
+            # # STEP 4.0-6.0: Raster calculation, reclassification and affinity in a single pass
+            print("Summing LULC and PA rasters, reclassifying with impedance values and computing affinity...")
+            wp.process_pa_rasters_fused(
+                lulc_dir=wp.config.get("lulc_dir"),
+                use_yearly_pa_rasters=use_yearly_pa_raster,
+                affinity_dir=os.path.join(working_dir, case_study_dir, "output", "affinity"),
+                save_lulc_pa=save_lulc_pa,
+                jobs=jobs,
+                use_cache=use_cache
+            )
+        else:
+            # # STEP 4.0: Raster calculation
+            print("Summing LULC and PA rasters...")
+            wp.sum_lulc_pa_rasters(
+                input_path=os.path.join(working_dir, case_study_dir, "input"),
+                output_path=os.path.join(working_dir, case_study_dir, "output"),
+                lulc_dir=wp.config.get("lulc_dir"),
+                use_yearly_pa_rasters= use_yearly_pa_raster
+            )
+
+            # # STEP 5.0: Reclassify input raster with impedance values
+            print("Reclassifying the raster with impedance values...")
+            wp.reclassify_raster_with_impedance()
+
+            # # STEP 6: Compute affinity
+            print("Computing affinity")
+            wp.compute_affinity(os.path.join(working_dir, case_study_dir, "output", "affinity"))
 
     except Exception as e:
         err_console.print(f"Error: {e}")
@@ -138,6 +165,10 @@ def process_osm(
     api_type: Annotated[str, typer.Option("--api", "-a", help="API to use for fetching OSM data. Choose from 'overpass' or 'ohsome)")] = "ohsome",
     skip_fetch: Annotated[bool, typer.Option("--skip-fetch", "-s", help="Skip fetching OSM data. Overwrites existing data if FALSE")] = False,
     delete_intermediate_files: Annotated[bool, typer.Option("--del-temp", "-dt", help="Delete intermediate GeoJSON & GPKG files")] = False,
+    fetch_workers: Annotated[int, typer.Option("--fetch-workers", "-fw", help="Number of filters (or tiles, if the bounding box is tiled) fetched concurrently")] = 4,
+    tile_size: Annotated[float, typer.Option("--tile-size", "-ts", help="Split the bounding box into tiles of at most this size in degrees")] = None,
+    max_tile_depth: Annotated[int, typer.Option("--max-tile-depth", "-td", help="Maximum number of times a tile is split again after a timeout or a too large response")] = 4,
+    jobs: Annotated[int, typer.Option("--jobs", "-j", help="Number of years converted concurrently (ohsome only), other jobs repair invalid geometries")] = 1,
     verbose: Annotated[bool, typer.Option("--verbose", "-v", help="Verbose mode")] = False,
     record_time: Annotated[bool, typer.Option("--record-time", "-t", help="Record execution time")] = False
     ):
@@ -150,6 +181,10 @@ def process_osm(
         api_type (str): API to use for fetching OSM data. Choose from 'overpass' or 'ohsome
         skip_fetch (bool): Skip fetching OSM data. Overwrites existing data if FALSE.
         delete_intermediate_files (bool): Delete intermediate GeoJSON & GPKG files.
+        fetch_workers (int): Number of filters (roads, railways, waterways, etc.) fetched concurrently (ohsome only), or of tiles if the bounding box is tiled. Responses are streamed to disk.
+        tile_size (float): Split the bounding box into tiles of at most this size in degrees, fetched concurrently and merged without duplicates (not tiled if None).
+        max_tile_depth (int): Maximum number of times a tile is split into quadrants after a timeout or a too large response.
+        jobs (int): Number of years converted to GeoPackage concurrently (ohsome only, as Overpass files are shared by all years). Jobs not used by concurrent years repair invalid geometries of each year on a pool of processes.
         verbose (bool): Verbose mode.
         record_time (bool): Record the execution time.
 
@@ -175,10 +210,10 @@ def process_osm(
                     osm.years = [int(year)]
 
         # fetch OSM data for the selected years using the selected API
-        osm.osm_to_geojson(osm.years, skip_fetch)
+        osm.osm_to_geojson(osm.years, skip_fetch, fetch_workers, tile_size, max_tile_depth)
 
         # STEP 2: Convert OSM data to merged GeoPackage (creates intermediate GeoJSON files for each year)
-        osm.osm_to_merged_gpkg(osm.years,osm.api_type)
+        osm.osm_to_merged_gpkg(osm.years,osm.api_type,jobs)
        
         # STEP 3: Delete intermediate files
         if delete_intermediate_files:
@@ -202,6 +237,9 @@ def enrich_lulc(
     cog_compress: Annotated[bool, typer.Option("--cog-compress", "-c", help="Compress the output GeoTIFF files using Cloud Optimized GeoTIFF (COG)")] = False,
     verbose: Annotated[bool, typer.Option("--verbose", "-v", help="Verbose mode")] = False,
     save_osm_stressors: Annotated[bool, typer.Option("--save-osm-stressors", "-s", help="Save OSM stressors to file")] = False,
+    single_pass: Annotated[bool, typer.Option("--single-pass", "-sp", help="Burn all OSM layers directly into the LULC dataset in a single pass")] = False,
+    skip_buffer: Annotated[bool, typer.Option("--skip-buffer", "-sb", help="Rasterize roads and railways from their centerlines and widths instead of buffering them")] = False,
+    jobs: Annotated[int, typer.Option("--jobs", "-j", help="Number of years processed concurrently")] = 1,
     record_time: Annotated[bool, typer.Option("--record-time", "-t", help="Record execution time")] = False
     ):
     """
@@ -214,6 +252,9 @@ def enrich_lulc(
         threads (int): Number of threads to use for processing (default is 4).
         verbose (bool): Verbose mode.
         save_osm_stressors (bool): Save OSM stressors to file.
+        single_pass (bool): Burn all OSM layers directly into the LULC dataset in a single pass (if OSM stressors are saved, their rasters are merged instead).
+        skip_buffer (bool): Rasterize roads and railways from the distance to their centerlines instead of buffering them into polygons.
+        jobs (int): Number of years processed concurrently (capped by the available memory).
         record_time (bool): Record the execution time.
     """
     # TODO - to delete intermediate files (buffered features) as if we don't delete it they can raise errors for following runs
@@ -233,13 +274,12 @@ def enrich_lulc(
                 # replace the years list with the selected year
                 lew.years = [int(year)]
 
-        for year in lew.years:
-            # 1. prepare and merge LULC and OSM data
-            lew.initialise_data_processors(year)
-            # 1.2 buffer vector data
-            lew.buffer_vector_roads_and_railways()
-            # 2. rasterize vector data
-            lew.merge_lulc_osm_data(year, save_osm_stressors, cog_compress)
+        # road types of user vector files are selected once here, as years can be processed in worker processes
+        lew.select_road_types(lew.years)
+
+        # prepare, buffer, rasterize and merge LULC and OSM data of each year
+        memory_per_job = max(lew.estimate_year_memory(year) for year in lew.years)
+        run_per_year(enrich_lulc_year, lew.years, (lew, save_osm_stressors, cog_compress, single_pass, skip_buffer), jobs, memory_per_job)
 
     except Exception as e:
         err_console.print(f"Error: {e}")
@@ -258,6 +298,12 @@ def recalc_impedance(
     decline_type: Annotated[str, typer.Option("--decline-type", "-dt", help="Type of decline to use for impedance calculation. Use either 'exp_decline' OR 'prop_decline'")] = "exp_decline",
     lambda_decay: Annotated[int, typer.Option("--lambda-decay", "-ld", help="Lambda decay value for impedance calculation")] = 500,
     k_value: Annotated[int, typer.Option("--k-value", "-k", help="K-value for impedance calculation")] = 500,
+    workers: Annotated[int, typer.Option("--workers", "-w", help="Number of worker processes to compute the edge effect by tiles (1 processes the whole raster at once)")] = 1,
+    tile_size: Annotated[int, typer.Option("--tile-size", help="Size of the tiles in pixels (if workers > 1)")] = 1024,
+    save_edge_rasters: Annotated[bool, typer.Option("--save-edge-rasters", "-e", help="Save the edge effect raster of each stressor")] = False,
+    truncate_distance: Annotated[bool, typer.Option("--truncate-distance", "-md", help="Compute edge effect only up to the distance where it drops below one impedance unit")] = False,
+    jobs: Annotated[int, typer.Option("--jobs", "-j", help="Number of years processed concurrently")] = 1,
+    use_cache: Annotated[bool, typer.Option("--use-cache", "-uc", help="Skip stressors and composites whose inputs and parameters are unchanged since the last run")] = False,
     record_time: Annotated[bool, typer.Option("--record-time", "-t", help="Record execution time")] = True
     ):
     """
@@ -271,6 +317,12 @@ def recalc_impedance(
         decline_type (str): Type of decline to use for impedance calculation. Use either exp_decline OR prop_decline.
         lambda_decay (int): Lambda decay value for impedance calculation (if decline type is exponential).
         k_value (int): K-value for impedance calculation (if decline type is proportional).
+        workers (int): Number of worker processes to compute the edge effect by tiles (1 processes the whole raster at once).
+        tile_size (int): Size of the tiles in pixels (if workers > 1).
+        save_edge_rasters (bool): Save the edge effect raster of each stressor (always saved if workers > 1).
+        truncate_distance (bool): Compute edge effect only up to the maximum effective distance of each stressor, derived from its decay parameters.
+        jobs (int): Number of years processed concurrently (capped by the available memory). Results of each year are written to a subdirectory of the year in impedance_results.
+        use_cache (bool): Skip the proximity of stressors and the composite if their inputs, parameters and code are unchanged since the last run.
         record_time (bool): Record the execution time.
     """
     if record_time:
@@ -290,7 +342,12 @@ def recalc_impedance(
         k_value = k_value,
         config_path= config_path,
         config_impedance_path= os.path.join(config_dir,"config_impedance.yaml"),
-        verbose=verbose
+        verbose=verbose,
+        workers=workers,
+        tile_size=tile_size,
+        save_edge_rasters=save_edge_rasters,
+        truncate_distance=truncate_distance,
+        use_cache=use_cache
     )
 
     # prompt user to use all years or a specific year
@@ -338,13 +395,11 @@ def recalc_impedance(
                 err_console.print("Exiting...")
                 raise typer.Exit(code=1)
 
-    for year in iw.years:
-        # 3.  Get the maximum value of the impedance raster dataset
-        impedance_ds, impedance_max = iw.get_impedance_max_value(year)
-
-        # 3.0 Calculate impedance
-        max_result_tif = iw.calculate_impedance(impedance_stressors,impedance_ds,impedance_max)
-        if verbose:
+    # 3.0 Calculate impedance of each year (results of each year are written to a separate directory)
+    memory_per_job = max(iw.estimate_year_memory(year) for year in iw.years)
+    max_result_tifs = run_per_year(calculate_impedance_year, iw.years, (iw, impedance_stressors), jobs, memory_per_job)
+    if verbose:
+        for max_result_tif in max_result_tifs.values():
             typer.secho(f"max_result_tif saved to: {max_result_tif}", fg=typer.colors.GREEN)
 
     # delete temporary impedance stressors.yaml
@@ -358,6 +413,159 @@ def recalc_impedance(
         typer.secho(f"Elapsed time: {elapsed_time:.4f} seconds", fg=typer.colors.BLUE, bg=typer.colors.WHITE)
 
 
+@app.command("run-all")
+def run_all(
+    config_dir: Annotated[str, typer.Option(..., help="Directory with the configuration file")] = "./config",
+    api_type: Annotated[str, typer.Option("--api", "-a", help="API to use for fetching OSM data. Choose from 'overpass' or 'ohsome)")] = "ohsome",
+    skip_fetch: Annotated[bool, typer.Option("--skip-fetch", "-s", help="Skip fetching protected areas and OSM data that were already fetched from previous sessions")] = False,
+    use_yearly_pa_raster: Annotated[bool, typer.Option("--enrich-single-year", "-e", help="use a specific PA year to update LULC or use all years")] = False,
+    pa_year_raster: Annotated[bool, typer.Option("--pa-year-raster", "-yr", help="Rasterize the years of protection once and derive yearly PA rasters from it")] = False,
+    fused: Annotated[bool, typer.Option("--fused", "-fu", help="Sum LULC and PA rasters, update impedance and compute affinity in a single block-wise pass")] = False,
+    fetch_workers: Annotated[int, typer.Option("--fetch-workers", "-fw", help="Number of pages of protected areas and of ohsome filters fetched concurrently")] = 4,
+    tile_size: Annotated[float, typer.Option("--tile-size", "-ts", help="Split the bounding box of OSM queries into tiles of at most this size in degrees")] = None,
+    threads: Annotated[int, typer.Option("--threads", "-th", help="Number of threads to use for the LULC enrichment")] = 4,
+    single_pass: Annotated[bool, typer.Option("--single-pass", "-sp", help="Burn all OSM layers directly into the LULC dataset in a single pass")] = False,
+    skip_buffer: Annotated[bool, typer.Option("--skip-buffer", "-sb", help="Rasterize roads and railways from their centerlines and widths instead of buffering them")] = False,
+    decline_type: Annotated[str, typer.Option("--decline-type", "-dt", help="Type of decline to use for impedance calculation. Use either 'exp_decline' OR 'prop_decline'")] = "exp_decline",
+    lambda_decay: Annotated[int, typer.Option("--lambda-decay", "-ld", help="Lambda decay value for impedance calculation")] = 500,
+    k_value: Annotated[int, typer.Option("--k-value", "-k", help="K-value for impedance calculation")] = 500,
+    nodes: Annotated[int, typer.Option("--nodes", "-n", help="Number of workflow steps run concurrently")] = 4,
+    restart: Annotated[bool, typer.Option("--restart", "-r", help="Run all steps again, ignoring the steps completed by previous runs")] = False,
+    verbose: Annotated[bool, typer.Option("--verbose", "-v", help="Verbose mode")] = False,
+    record_time: Annotated[bool, typer.Option("--record-time", "-t", help="Record execution time")] = False
+    ):
+    """
+    Runs the whole workflow (protected areas, OSM data, LULC enrichment and impedance) for all years without prompts (all road types of user vector files are used).
+    Each step is a node of a dependency graph built from its inputs and outputs, so independent steps (e.g. fetching protected areas and OSM data,
+    or rasterizing protected areas and enriching LULC data) run concurrently. Completed steps are checkpointed, so a failed run resumes from the failed steps.
+    Example usage: python main.py run-all --config-dir ./config --api ohsome --nodes 4 --verbose --record-time
+
+    Args:
+        config_dir (str): Directory containing the configuration file.
+        api_type (str): API to use for fetching OSM data. Choose from 'overpass' or 'ohsome'.
+        skip_fetch (bool): Skip fetching protected areas and OSM data if they were already fetched from previous sessions.
+        use_yearly_pa_raster (bool): Use less than or equal to PA year of establishment when TRUE, else use all years.
+        pa_year_raster (bool): Rasterize the years of protection once and derive yearly PA rasters by threshold.
+        fused (bool): Sum LULC and PA rasters, update impedance and compute affinity block by block in one pass.
+        fetch_workers (int): Number of pages of protected areas and of ohsome filters fetched concurrently.
+        tile_size (float): Split the bounding box of OSM queries into tiles of at most this size in degrees (not tiled if None).
+        threads (int): Number of threads to use for the LULC enrichment.
+        single_pass (bool): Burn all OSM layers directly into the LULC dataset in a single pass (not used, since OSM stressors are saved for impedance recalculation).
+        skip_buffer (bool): Rasterize roads and railways from the distance to their centerlines instead of buffering them into polygons.
+        decline_type (str): Type of decline to use for impedance calculation. Use either exp_decline OR prop_decline.
+        lambda_decay (int): Lambda decay value for impedance calculation (if decline type is exponential).
+        k_value (int): K-value for impedance calculation (if decline type is proportional).
+        nodes (int): Number of workflow steps run concurrently (1 runs the steps one after another).
+        restart (bool): Run all steps again, ignoring the checkpoint of previous runs.
+        verbose (bool): Verbose mode.
+        record_time (bool): Record the execution time.
+    """
+    if record_time:
+        start_time = time.time()
+
+    config_path = os.path.join(config_dir, "config.yaml")
+    check_file_exists(config_path)
+    stressor_yaml_path = os.path.join(config_dir,"stressors.yaml")
+    if not os.path.exists(stressor_yaml_path):
+        raise FileNotFoundError("The stressors.yaml file is not found. Please add the file to the config directory.")
+
+    try:
+        working_dir = os.getcwd()
+        wp = WDPAWrapper(working_dir, config_path, verbose=verbose)
+        osm = OSMWrapper(working_dir, config_path, api_type, verbose)
+        case_study_dir = str(wp.config.get("case_study_dir"))
+        case_study = case_study_dir.split("/")[-1]
+        output_dir = os.path.join(working_dir, case_study_dir, "output")
+        lulc_dir = wp.config.get("lulc_dir")
+        affinity_dir = os.path.join(output_dir, "affinity")
+        years = osm.years
+
+        def new_impedance_wrapper() -> ImpedanceWrapper:
+            # loaded when the step runs, as the impedance configuration is updated by previous steps
+            return ImpedanceWrapper(None, decline_type, lambda_decay, k_value, config_path, os.path.join(config_dir, "config_impedance.yaml"), verbose)
+
+        runner = DAGRunner(os.path.join(output_dir, "run_all_checkpoint.json"), nodes, restart)
+
+        # protected areas (fetched once for the countries of all years)
+        merged_gpkg = os.path.join(wp.pa_geojson_dir, case_study + "_merged_pa.gpkg")
+        pa_rasters_dir = os.path.join(wp.pa_output_dir, "pa_rasters")
+        runner.add(Node("wdpa-fetch",
+            lambda results: wp.protected_area_to_merged_geopackage(wp.get_lulc_country_codes(), os.path.basename(merged_gpkg), skip_fetch, fetch_workers),
+            inputs=[lulc_dir], outputs=[merged_gpkg]))
+        runner.add(Node("wdpa-rasterize",
+            lambda results: wp.rasterize_protected_areas(merged_gpkg, lulc_dir, use_yearly_pa_raster, pa_year_raster, write_yearly_rasters=not fused),
+            inputs=[merged_gpkg], outputs=[pa_rasters_dir]))
+
+        def pa_impedance(results:dict) -> None:
+            if fused:
+                wp.process_pa_rasters_fused(lulc_dir, use_yearly_pa_raster, affinity_dir)
+                return
+            wp.sum_lulc_pa_rasters(os.path.join(working_dir, case_study_dir, "input"), output_dir, lulc_dir, use_yearly_pa_raster)
+            wp.reclassify_raster_with_impedance()
+            wp.compute_affinity(affinity_dir)
+        runner.add(Node("wdpa-impedance", pa_impedance, inputs=[pa_rasters_dir], outputs=[affinity_dir]))
+
+        # OSM data (Overpass GeoPackage files are shared by all years, so years are converted one after another)
+        osm_data_dir = osm.osm_output_data_dir
+        runner.add(Node("osm-fetch", lambda results: osm.osm_to_geojson(years, skip_fetch, fetch_workers, tile_size), outputs=[osm_data_dir]))
+        if api_type == 'ohsome':
+            # ohsome files with the snapshots of all years are split into files of each year in one pass
+            runner.add(Node("osm-partition", lambda results: osm.ohsome_to_yearly_gpkg(years), inputs=[osm_data_dir]))
+        for i, year in enumerate(years):
+            runner.add(Node(f"osm-gpkg-{year}",
+                lambda results, year=year: osm.year_to_merged_gpkg(year, api_type),
+                inputs=[osm_data_dir], outputs=[os.path.join(osm.vector_dir, f'osm_merged_{year}.gpkg')],
+                deps=["osm-partition"] if api_type == 'ohsome' else [f"osm-gpkg-{years[i - 1]}"] if i > 0 else None))
+
+        # LULC enrichment of each year (each step has its own wrapper, as data processors are initialised for the year)
+        # all road types of user vector files are selected up front without prompting (steps run concurrently), failing fast if the files can't be read
+        stressors_lew = LULCEnrichmentWrapper(working_dir, config_path, api_type, threads, verbose)
+        road_types = stressors_lew.select_road_types(years, interactive=False)
+        for year in years:
+            lew = LULCEnrichmentWrapper(working_dir, config_path, api_type, threads, verbose)
+            lew.selected_road_types = road_types
+            # OSM layers are rasterized to files kept as impedance stressors (not burnt in a single pass), but stressors.yaml is not written by each year
+            runner.add(Node(f"enrich-{year}",
+                lambda results, year=year, lew=lew: enrich_lulc_year(year, lew, False, False, False, skip_buffer),
+                inputs=[os.path.join(osm.vector_dir, f'osm_merged_{year}.gpkg')], outputs=[os.path.join(output_dir, f'lulc_{year}_upd.tif')]))
+        # OSM stressors are the same for all years, so they are saved once instead of by each concurrent enrichment step
+        runner.add(Node("osm-stressors",
+            lambda results: stressors_lew.save_osm_stressors({'roads': stressors_lew.get_road_types(None, 'roads', groupby_roads=True), 'railways': None})))
+
+        # impedance stressors are configured once from the OSM stressors of all years
+        def impedance_config(results:dict) -> dict:
+            iw = new_impedance_wrapper()
+            for year in years:
+                impedance_stressors = iw.process_impedance_config(year)
+            print_table("Impedance stressors", impedance_stressors)
+            err_msg = iw.validate_impedance_config(impedance_stressors)
+            if err_msg != "exit":
+                raise ValueError(f"The following errors was found in the configuration file (config_impedance.yaml): {err_msg}")
+            return impedance_stressors
+        runner.add(Node("impedance-config", impedance_config, deps=[f"enrich-{year}" for year in years] + ["osm-stressors"]))
+
+        for year in years:
+            # impedance datasets updated with protected areas are only available once protected areas are processed
+            impedance_tif = new_impedance_wrapper().get_impedance_tif(year)
+            runner.add(Node(f"impedance-{year}",
+                lambda results, year=year: calculate_impedance_year(year, new_impedance_wrapper(), results["impedance-config"]),
+                deps=["impedance-config"] + (["wdpa-impedance"] if os.path.splitext(impedance_tif)[0].endswith('_pa') else [])))
+
+        results = runner.run()
+        if verbose:
+            for year in years:
+                typer.secho(f"max_result_tif saved to: {results[f'impedance-{year}']}", fg=typer.colors.GREEN)
+
+    except Exception as e:
+        err_console.print(f"Error: {e}")
+        raise typer.Exit(code=1)
+
+    if record_time:
+        finish_time = time.time()
+        elapsed_time = finish_time - start_time
+        typer.secho(f"Elapsed time: {elapsed_time:.4f} seconds", fg=typer.colors.BLUE, bg=typer.colors.WHITE)
+
+
 #Test command
 @app.command("test")
 def init(firstname: str, surname: str, formal: bool = False):
@@ -0,0 +1,223 @@
+import os
+import json
+import time
+import hashlib
+import requests
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable
+from rich import print as rprint
+# local imports
+from geojson_stream import iter_features
+
+class TileSplitError(Exception):
+    """
+    Raised by a fetch function when the response of a tile is too large or timed out, so that the tile is split into quadrants.
+    """
+
+class BBoxTiler():
+    """
+    Splits the bounding box of OSM queries into a quadtree of tiles, so that national-scale case studies are fetched as many small requests
+    instead of a single request hitting the timeout or the size limit of the server.
+    Tiles are fetched concurrently; a tile which times out or whose response exceeds the size limit is split into its four quadrants (up to max_depth times).
+    Responses of tiles are cached on disk by query and extent, so re-runs only fetch the tiles which are missing.
+    Bounding boxes are tuples (south, west, north, east) in WGS84, as returned by RasterTransform.bbox_to_WGS84.
+    """
+    # number of decimals of tile coordinates (about 1 cm)
+    COORDINATE_DECIMALS = 7
+    # HTTP status codes of responses which are too large or timed out on the server (the tile is split)
+    SPLIT_STATUS_CODES = (413, 504)
+    # HTTP status codes of rate limited or overloaded servers (the tile is fetched again after a delay)
+    RETRY_STATUS_CODES = (429, 503)
+
+    def __init__(self, bbox:tuple, cache_dir:str, max_tile_size:float=1.0, max_depth:int=4, max_workers:int=1, max_response_size:int=512 * 2**20) -> None:
+        """
+        Initializes the tiler.
+
+        Args:
+            bbox (tuple): bounding box to tile (south, west, north, east) in degrees
+            cache_dir (str): directory of the cached responses of tiles
+            max_tile_size (float): maximum width and height of the initial tiles in degrees (default is 1.0)
+            max_depth (int): maximum number of times a tile is split again after a timeout or a too large response (default is 4)
+            max_workers (int): number of tiles fetched concurrently (default is 1)
+            max_response_size (int): maximum size of the response of a tile in bytes before it is split (default is 512 MiB)
+        """
+        self.bbox = tuple(float(coord) for coord in bbox)
+        self.cache_dir = cache_dir
+        self.max_tile_size = max_tile_size
+        self.max_depth = max_depth
+        self.max_workers = max_workers
+        self.max_response_size = max_response_size
+
+    @staticmethod
+    def split(tile:tuple) -> list[tuple]:
+        """
+        Splits a tile into its four quadrants.
+        """
+        south, west, north, east = tile
+        middle_lat, middle_lon = (south + north) / 2, (west + east) / 2
+        return [(south, west, middle_lat, middle_lon), (south, middle_lon, middle_lat, east),
+                (middle_lat, west, north, middle_lon), (middle_lat, middle_lon, north, east)]
+
+    def initial_tiles(self) -> list[tuple]:
+        """
+        Splits the bounding box until the tiles are not larger than the maximum tile size.
+
+        Returns:
+            list: initial tiles (south, west, north, east)
+        """
+        tiles = [self.bbox]
+        while any(north - south > self.max_tile_size or east - west > self.max_tile_size for south, west, north, east in tiles):
+            tiles = [quadrant for tile in tiles for quadrant in self.split(tile)]
+        return tiles
+
+    def tile_path(self, name:str, signature:str, tile:tuple) -> str:
+        """
+        Returns the path to the cached response of a tile, keyed by the query and the extent of the tile.
+
+        Args:
+            name (str): name of the query (e.g. the filter name and the year), used as the subdirectory of the cache
+            signature (str): description of the query without the extent (e.g. the filter and the timestamps)
+            tile (tuple): extent of the tile
+
+        Returns:
+            str: path to the JSON file of the tile
+        """
+        tile = tuple(round(coord, self.COORDINATE_DECIMALS) for coord in tile)
+        key = hashlib.sha256(f"{signature}|{tile}".encode('utf-8')).hexdigest()[:24]
+        return os.path.join(self.cache_dir, name, f"{key}.json")
+
+    @staticmethod
+    def tile_string(tile:tuple, order:str="south,west,north,east") -> str:
+        """
+        Formats the extent of a tile for a query (e.g. 'west,south,east,north' for ohsome, 'south,west,north,east' for Overpass).
+        """
+        coords = dict(zip(("south", "west", "north", "east"), tile))
+        return ",".join(str(round(coords[key], BBoxTiler.COORDINATE_DECIMALS)) for key in order.split(","))
+
+    def fetch_tile(self, fetch:Callable, tile:tuple, path:str, retry_limit:int=3, backoff:float=2.0) -> None:
+        """
+        Fetches one tile into its cache file, raising TileSplitError if it has to be split.
+        Rate limited requests are retried with exponential backoff.
+        """
+        temp_path = path + ".part"
+        for attempt in range(retry_limit + 1):
+            try:
+                fetch(tile, temp_path)
+                if os.path.getsize(temp_path) > self.max_response_size:
+                    raise TileSplitError(f"response is larger than {self.max_response_size} bytes")
+                os.replace(temp_path, path)
+                return
+            except requests.Timeout as e:
+                raise TileSplitError(f"request timed out: {e}")
+            except requests.HTTPError as e:
+                status_code = e.response.status_code if e.response is not None else None
+                if status_code in self.SPLIT_STATUS_CODES:
+                    raise TileSplitError(f"request failed with status code {status_code}")
+                if status_code not in self.RETRY_STATUS_CODES or attempt == retry_limit:
+                    raise
+                time.sleep(backoff * 2**attempt)
+            finally:
+                # incomplete or too large responses are not cached
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    def fetch(self, name:str, signature:str, fetch:Callable) -> list[str]:
+        """
+        Fetches all tiles of a query (cached tiles are reused), splitting the tiles which time out or are too large.
+
+        Args:
+            name (str): name of the query (e.g. the filter name and the year)
+            signature (str): description of the query without the extent
+            fetch (Callable): function fetching one tile, called as fetch(tile, output_path), which writes the response to the output path
+                (it raises TileSplitError or requests.Timeout if the tile has to be split)
+
+        Returns:
+            list: paths to the JSON files of all tiles
+        """
+        os.makedirs(os.path.join(self.cache_dir, name), exist_ok=True)
+        tile_files = []
+        cached_count = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            running = {}
+            pending = [(tile, 0) for tile in self.initial_tiles()]
+            while pending or running:
+                ready, pending = pending, []
+                for tile, depth in ready:
+                    path = self.tile_path(name, signature, tile)
+                    if os.path.exists(path):
+                        tile_files.append(path)
+                        cached_count += 1
+                    elif os.path.exists(path + ".split") and depth < self.max_depth:
+                        # the tile was split by a previous run, so its quadrants are fetched directly
+                        pending.extend((quadrant, depth + 1) for quadrant in self.split(tile))
+                    else:
+                        running[executor.submit(self.fetch_tile, fetch, tile, path)] = (tile, depth, path)
+                if pending:
+                    continue
+                if not running:
+                    break
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    tile, depth, path = running.pop(future)
+                    try:
+                        future.result()
+                        tile_files.append(path)
+                    except TileSplitError as e:
+                        if depth >= self.max_depth:
+                            raise RuntimeError(f"Tile {tile} of {name} can't be fetched after {self.max_depth} splits: {e}")
+                        rprint(f"[yellow] Tile {tile} of {name} is split into quadrants: {e} [/yellow]")
+                        open(path + ".split", 'w').close()
+                        pending.extend((quadrant, depth + 1) for quadrant in self.split(tile))
+
+        print(f"Fetched {len(tile_files) - cached_count} tiles of {name} ({cached_count} tiles reused from previous runs)")
+        return sorted(tile_files)
+
+    @staticmethod
+    def merge_tiles(tile_files:list[str], output_path:str, key:str, feature_id:Callable) -> int:
+        """
+        Merges the responses of tiles into one JSON file, dropping duplicates of features found in several tiles.
+        The other keys of the first tile (e.g. metadata) are kept, and the features are written one at a time.
+
+        Args:
+            tile_files (list): paths to the JSON files of the tiles
+            output_path (str): path to the merged JSON file
+            key (str): key of the array of features ("features" for ohsome, "elements" for Overpass)
+            feature_id (Callable): function returning the identifier of a feature (e.g. the OSM type and id)
+
+        Returns:
+            int: number of unique features
+        """
+        header = {}
+        if tile_files:
+            # the metadata of responses is small, so it's read from the beginning of the first tile
+            with open(tile_files[0], 'r', encoding='utf-8') as f:
+                start = f.read(2**16)
+            position = start.find(json.dumps(key))
+            if position > 0:
+                try:
+                    header = json.loads(start[:position].rstrip().rstrip(',') + '}')
+                except ValueError:
+                    header = {}
+
+        seen = set()
+        temp_path = output_path + ".part"
+        try:
+            with open(temp_path, 'w', encoding='utf-8') as f:
+                f.write(json.dumps(header)[:-1] + (', ' if header else '') + f'{json.dumps(key)}: [\n')
+                for tile_file in tile_files:
+                    for feature in iter_features(tile_file, key=key):
+                        identifier = feature_id(feature)
+                        if identifier in seen:
+                            continue
+                        if seen:
+                            f.write(',\n')
+                        seen.add(identifier)
+                        f.write(json.dumps(feature, separators=(',', ':')))
+                f.write('\n]}\n')
+            os.replace(temp_path, output_path)
+        finally:
+            # incomplete merges are not kept
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+        return len(seen)
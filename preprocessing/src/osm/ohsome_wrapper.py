@@ -5,9 +5,14 @@ from requests.adapters import HTTPAdapter
 from urllib3.poolmanager import PoolManager
 import json
 import time
+from typing import Iterable
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from rich import print as rprint
 # local imports
 from utils import get_lulc_template
+from geojson_stream import iter_features
+from gpkg_stream import GPKGStreamWriter
+from osm.bbox_tiling import BBoxTiler
 from reprojection import RasterTransform
 
 
@@ -25,12 +30,16 @@ class TLSAdapter(HTTPAdapter):
 
 
 class OhsomeWrapper:
+    # size of the chunks of responses streamed to disk and of JSON files read back
+    CHUNK_SIZE = 2**20
 
-    def __init__(self, config:dict, output_dir:str, years:list[int], verbose:bool):
+    def __init__(self, config:dict, output_dir:str, years:list[int], verbose:bool, max_workers:int=1, tile_size:float=None, max_tile_depth:int=4):
         self.config = config
         self.output_dir = output_dir
         self.verbose = verbose
         self.years = years
+        # number of filters (or tiles, if the bounding box is tiled) fetched concurrently
+        self.max_workers = max_workers
         # create a dictionary of LULC files and corresponding years
         lulc_series = {get_lulc_template(self.config, year):year for year in self.years}
 
@@ -43,10 +52,16 @@ class OhsomeWrapper:
             print(f"Bounding box for the OSM data is to be retrieved from the raster: {lulc}")
 
         self.bbox = RasterTransform(raster_path=lulc).bbox_to_WGS84(print_details=self.verbose)
+        # split large bounding boxes into tiles (responses of tiles are cached in the output directory)
+        self.tiler = BBoxTiler(self.bbox, os.path.join(output_dir, "tiles"), tile_size, max_tile_depth, max_workers) if tile_size else None
         # convert the bounding box to a string
         self.bbox = f"{self.bbox[1]},{self.bbox[0]},{self.bbox[3]},{self.bbox[2]}"
         
+        # pooled session (one connection per filter or tile fetched concurrently)
         self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
         # self.session.mount('https://', TLSAdapter())
 
 
@@ -97,7 +112,8 @@ class OhsomeWrapper:
 
     def convert_to_geojson(self, json_files:list[str], year:int):
         """
-        Converts the JSON files to GeoJSON files (Only used if skip_fetch is False).
+        Converts the JSON files to filtered GeoPackage files (Only used if skip_fetch is False).
+        Features are read and written one at a time, so the JSON files are never loaded in memory.
 
         Args:
             json_files (list): The list of JSON files to convert.
@@ -107,45 +123,100 @@ class OhsomeWrapper:
         for json_file in json_files:
             # if json_file.endswith(".
             filter_name = json_file.split('/')[-1].split('_')[0]
-            output_filename = os.path.join(self.output_dir , f"{filter_name}_ohsome_pre_{year}.geojson")
-            # load the JSON file
-            with open(json_file, 'r') as f:
-                data = dict(json.load(f))
-            # get the features
-            features = data.get("features", [])
-            # if verbose save intermediate geojson files separately
+            output_filename = os.path.join(self.output_dir , f"{filter_name}_ohsome_pre_{year}.gpkg")
+            # if verbose save intermediate files separately
             if self.verbose:
-                output_filename = output_filename.replace(".geojson", "_filtered.geojson")
+                output_filename = output_filename.replace(".gpkg", "_filtered.gpkg")
             # save the filtered data
-            self.save_filtered_data(features, filter_name, output_filename)
+            self.save_filtered_data(iter_features(json_file, self.CHUNK_SIZE), filter_name, output_filename)
   
-    def save_filtered_data(self , features:list[dict], filter_name:str, output_filename:str):
+    def save_filtered_data(self , features:Iterable[dict], filter_name:str, output_filename:str) -> int:
         """
-        Saves the filtered data to a GeoJSON file.
+        Saves the filtered data to a GeoPackage file, writing features one at a time.
 
         Args:
-            features (list): the list of dictionary features to filter and save.
-            filter_name (str): The name of the filter.
+            features (Iterable): the dictionary features to filter and save (can be a generator reading features from a file).
+            filter_name (str): The name of the filter (used as the name of the layer).
             output_filename (str): The name of the output file.
+
+        Returns:
+            int: The number of saved features.
         """
 
-        for feature in features:
-            # drop @ metadata keys except @snapshotTimestamp
-            feature["properties"] = {key: value for key, value in feature.get("properties", {}).items() if key == "@snapshotTimestamp" or not key.startswith("@")}
-        
-        # save to geojson file
-        with open(output_filename, 'w') as json_file:
-            geojson = {
-                "type": "FeatureCollection",
-                "name": filter_name, # name of the layer
-                "features": features
-            }
-            json.dump(geojson, json_file, indent=4)
-        print(f"GeoJSON has been saved to {output_filename}")
+        with GPKGStreamWriter(output_filename, filter_name) as writer:
+            for feature in features:
+                # drop @ metadata keys except @snapshotTimestamp
+                feature["properties"] = {key: value for key, value in feature.get("properties", {}).items() if key == "@snapshotTimestamp" or not key.startswith("@")}
+                writer.write_feature(feature)
+        print(f"GeoPackage has been saved to {output_filename}")
+        return writer.feature_count
+
+    def post_to_file(self, url:str, query_params:dict, timeout:int, output_path:str) -> None:
+        """
+        Sends a query to the ohsome API and streams the response to a file in chunks.
+
+        Args:
+            url (str): The URL for the request.
+            query_params (dict): The query parameters.
+            timeout (int): The timeout for the request.
+            output_path (str): The path to the output JSON file.
+        """
+        with self.session.post(url, data=query_params, timeout=timeout, stream=True) as response:  # use 'data' instead of 'params'
+            if response.status_code != 200:
+                raise requests.HTTPError(f"Request failed with status code: {response.status_code}", response=response)
+            with open(output_path, 'wb') as json_file:
+                for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
+                    json_file.write(chunk)
+
+    def fetch_query(self, filter_name:str, query_params:dict, year:int, timeout:int, url:str) -> int:
+        """
+        Fetches the OSM data of one filter. The response is streamed to the JSON file in chunks and its features are then filtered
+        one at a time into the GeoPackage file, so that memory doesn't grow with the size of the response.
+        If the bounding box is tiled, tiles are fetched concurrently and merged into the JSON file without duplicates.
+
+        Args:
+            filter_name (str): The name of the filter.
+            query_params (dict): The query parameters of the filter.
+            year (int): The year to use in the output filename.
+            timeout (int): The timeout for the request.
+            url (str): The URL for the request.
+
+        Returns:
+            int: The number of features retrieved.
+        """
+        output_filename = os.path.join(self.output_dir, f"{filter_name}_ohsome_pre_{year}.gpkg")
+        json_filename = output_filename.replace(".gpkg", ".json")
+
+        if self.tiler is None:
+            # save to JSON file (under a temporary name until the whole response is received)
+            temp_filename = json_filename + ".part"
+            try:
+                self.post_to_file(url, query_params, timeout, temp_filename)
+                os.replace(temp_filename, json_filename)
+            finally:
+                # incomplete responses are not kept
+                if os.path.exists(temp_filename):
+                    os.remove(temp_filename)
+        else:
+            # geometries are not clipped to tiles, so features crossing tiles are identical and kept once (by OSM id and snapshot)
+            signature = json.dumps({key: value for key, value in query_params.items() if key != 'bboxes'}, sort_keys=True)
+            fetch_tile = lambda tile, path: self.post_to_file(url, dict(query_params, bboxes=BBoxTiler.tile_string(tile, "west,south,east,north"), clipGeometry="false"), timeout, path)
+            tile_files = self.tiler.fetch(f"{filter_name}_ohsome_{year}", signature, fetch_tile)
+            feature_id = lambda feature: (feature["properties"].get("@osmId"), feature["properties"].get("@snapshotTimestamp"))
+            BBoxTiler.merge_tiles(tile_files, json_filename, "features", feature_id)
+        print(f"JSON has been saved to {json_filename}")
+
+        # if verbose save intermediate files separately
+        if self.verbose:
+            output_filename = output_filename.replace(".gpkg", "_filtered.gpkg")
+        # save the filtered data
+        return self.save_filtered_data(iter_features(json_filename, self.CHUNK_SIZE), filter_name, output_filename)
 
     def fetch_osm_data(self, years:list[int], queries:dict, timeout:int=600 , url:str = "https://api.ohsome.org/v1/elements/geometry"):
         """
-        Fetches the OSM data using the ohsome API. Using verbose mode will save the raw JSON files and filtered GeoJSON files.
+        Fetches the OSM data using the ohsome API. Using verbose mode will save the raw JSON files and filtered GeoPackage files.
+        Filters are fetched concurrently (up to max_workers at a time), so the fetch takes about as long as the slowest filter.
+        If the bounding box is tiled, tiles of each filter are fetched concurrently instead.
 
         Args:
             years (list): The years to fetch the data for.
@@ -155,42 +226,27 @@ class OhsomeWrapper:
         """
 
         query_start = time.time()
-        for filter_name, query_params in queries.items():
-            year = years[-1] # get the last year in the list to be used as the filename
+        year = years[-1] # get the last year in the list to be used as the filename
+        for query_params in queries.values():
             if len(years) == 1:  # if only one year is used, replace the year in the query with the actual year
                 query_params['time'] = str(query_params['time']).format(year=year)
-            # NOTE Only data with the matching snapshot timestamps are returned. This can include data from previous years as long as the timestamp matches
-            output_filename = os.path.join(self.output_dir, f"{filter_name}_ohsome_pre_{year}.geojson")
-            # try make the request
-            try:
-                response = self.session.post(url, data=query_params, timeout=timeout)  # use 'data' instead of 'params'
-                if response.status_code == 200:
-                    response_data = response.json()
-                    # count features
-                    feature_count = len(response_data.get("features",[])) # how many values corresponds to "features" key
-                    # get the features list
-                    features = response_data.get("features", [])
-
-                    # save to JSON file
-                    with open(output_filename.replace(".geojson", ".json"), 'w') as json_file:
-                        json.dump(response_data, json_file, indent=4)
-                    print(f"JSON has been saved to {output_filename.replace(".geojson", ".json")}")
-
-                    # if verbose save intermediate geojson files separately
-                    if self.verbose:
-                        output_filename = output_filename.replace(".geojson", "_filtered.geojson")
-                    # save the filtered data
-                    self.save_filtered_data(features, filter_name, output_filename)
-                else:
-                    raise requests.RequestException(f"Request failed with status code: {response.status_code}")
-            except requests.RequestException as e:
-                print(f"Request failed for params: {query_params}. Error: {e}")
-            
-            query_finish = time.time()
-            query_time = query_finish - query_start
-            rprint(f"[bold blue] Query time: {query_time} seconds [/bold blue]") 
-            rprint(f"[green] Number of features retrieved: {feature_count} [/green]")
+        # NOTE Only data with the matching snapshot timestamps are returned. This can include data from previous years as long as the timestamp matches
+
+        # tiles of a filter are fetched concurrently, so filters are fetched one after another if the bounding box is tiled
+        with ThreadPoolExecutor(max_workers=self.max_workers if self.tiler is None else 1) as executor:
+            futures = {executor.submit(self.fetch_query, filter_name, query_params, year, timeout, url): (filter_name, query_params) for filter_name, query_params in queries.items()}
+            for future in as_completed(futures):
+                filter_name, query_params = futures[future]
+                # try make the request
+                try:
+                    feature_count = future.result()
+                except requests.RequestException as e:
+                    print(f"Request failed for params: {query_params}. Error: {e}")
+                    continue
 
+                query_time = time.time() - query_start
+                rprint(f"[bold blue] Query time of {filter_name}: {query_time} seconds [/bold blue]") 
+                rprint(f"[green] Number of features retrieved: {feature_count} [/green]")
 
 if __name__ == "__main__":
     from utils import read_years_from_config, load_yaml
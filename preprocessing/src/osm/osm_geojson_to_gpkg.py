@@ -1,7 +1,12 @@
 import shutil
-from osgeo import ogr
+from osgeo import ogr, osr
 import os
 import subprocess
+from contextlib import ExitStack
+
+# local imports
+from gpkg_stream import GPKGStreamWriter
+from geometry_validation import GeometryValidator
 
 class OSMGeojsonToGpkg():
     """
@@ -31,15 +36,22 @@ class OSMGeojsonToGpkg():
 
     def convert_geojson_to_gpkg(self, file_ending:str) -> list:
         """
-        Convert all GeoJSON files in the input directory to GeoPackage files with the target EPSG code.
+        Convert all filtered files (GeoPackage files written by the OSM wrappers) in the input directory to GeoPackage files with the target EPSG code.
 
         Args:
-            file_ending (str): the file ending of the GeoJSON files (if using verbose and overpass then it is 'filtered.geojson')
+            file_ending (str): the file ending of the filtered files (if using verbose then it is '_filtered.gpkg')
             
         Returns:
             list: a list of geopackage files
         """
 
+        # since ohsome has files with all years, they are split into GeoPackage files of each year in one pass (see partition_ohsome_by_year)
+        if self.api_type == 'ohsome':
+            gpkg_files = sorted(filename for filename in os.listdir(self.gpkg_dir) if filename.endswith(f'_ohsome_pre_{self.year}.gpkg'))
+            if len(gpkg_files) == 0:
+                gpkg_files = self.partition_ohsome_by_year(file_ending, [self.year])[self.year]
+            return gpkg_files
+
         # loop through all geojson files in directory
         gpkg_files = []
         for filename in os.listdir(self.osm_data_dir):
@@ -47,21 +59,9 @@ class OSMGeojsonToGpkg():
                 geojson_file = os.path.join(self.osm_data_dir, filename)
                 # create the output GeoPackage file path
                 geopackage_file = os.path.join(self.gpkg_dir, filename.replace(file_ending, '.gpkg'))
-
-                # since ohsome has geojson files with all years, we need to create a new geopackage file for each year from the config
-                if self.api_type == 'ohsome':
-                    year_of_file = geopackage_file.split('_')[-1].split('.')[0]
-                    geopackage_file = geopackage_file.replace(f'{year_of_file}.gpkg', f'{self.year}.gpkg') 
             
                 try:
                     command = ['ogr2ogr', '-f', 'GPKG', '-t_srs', f'EPSG:{self.target_epsg}', geopackage_file, geojson_file]
-                    # if ohsome is specified, extract data from the specified year and prior
-                    if self.api_type == 'ohsome':
-                        # since ohsome has merged geojson files, we need to filter by year
-                        geopackage_file.replace('.gpkg', f'_{self.year}.gpkg') 
-                        # we need to rename the geometry field when using ohsome data
-                        sql_query = f"SELECT \"_ogr_geometry_\" as geom, * FROM {filename.split('_')[0]} WHERE \"@snapshotTimestamp\" = '{self.year}-12-31'"
-                        command.extend(['-sql', sql_query])
                     
                     #run the ogr2ogr command to convert the GeoJSON file to a GeoPackage file using subprocess
                     result = subprocess.run(command, capture_output=True, text=True)
@@ -82,51 +82,164 @@ class OSMGeojsonToGpkg():
 
         # return the list of geopackage files
         return gpkg_files
+
+    def partition_ohsome_by_year(self, file_ending:str, years:list[int]) -> dict:
+        """
+        Split the filtered ohsome files (with the snapshots of all years) into GeoPackage files of each year with the target EPSG code.
+        Each file is read once and its features are routed to the file of their snapshot year, whose layer is written in one transaction.
+
+        Args:
+            file_ending (str): the file ending of the filtered files (if using verbose then it is '_filtered.gpkg')
+            years (list): the years to extract (snapshots of other years are skipped)
+
+        Returns:
+            dict: a list of geopackage files for each year
+        """
+        timestamps = {f"{year}-12-31": year for year in years}
+        gpkg_files = {year: [] for year in years}
+        target_srs = osr.SpatialReference()
+        target_srs.ImportFromEPSG(int(self.target_epsg))
+        target_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+        for filename in sorted(os.listdir(self.osm_data_dir)):
+            if not (filename.endswith(file_ending) and 'ohsome' in filename):
+                continue
+            input_file = os.path.join(self.osm_data_dir, filename)
+            layer_name = filename.split('_')[0]
+            data_source = ogr.Open(input_file)
+            if data_source is None:
+                print(f"Error processing {filename}: file can't be opened")
+                continue
+            layer = data_source.GetLayer(0)
+
+            # reproject only if the file isn't in the target CRS
+            transform = None
+            source_srs = layer.GetSpatialRef()
+            if source_srs is not None and source_srs.GetAuthorityCode(None) != str(self.target_epsg):
+                source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+                transform = osr.CoordinateTransformation(source_srs, target_srs)
+
+            skipped_count = 0
+            # all files of the years are written while the input file is read (incomplete files are removed on errors)
+            with ExitStack() as stack:
+                writers = {year: stack.enter_context(GPKGStreamWriter(os.path.join(self.gpkg_dir, f"{layer_name}_ohsome_pre_{year}.gpkg"), layer_name, self.target_epsg, batch_size=None))
+                           for year in years}
+                for feature in layer:
+                    year = timestamps.get(str(feature.GetField("@snapshotTimestamp") or "")[:10])
+                    if year is None:
+                        skipped_count += 1
+                        continue
+                    geometry = feature.GetGeometryRef()
+                    if geometry is not None and transform is not None:
+                        geometry.Transform(transform)
+                    writers[year].write_geometry(geometry, feature.items())
+            layer = None
+            data_source = None
+
+            for year, writer in writers.items():
+                gpkg_files[year].append(os.path.basename(writer.output_path))
+                print(f"Converted {writer.feature_count} features of {filename} in the {year} year to GeoPackage: {writer.output_path}")
+            if skipped_count > 0:
+                print(f"Skipped {skipped_count} features of {filename} with snapshots of other years")
+
+        return gpkg_files
     
     def merge_gpkg_files(self, output_file:str):
         """
-        Merge all GeoPackage files into a single GeoPackage file 
+        Merge all GeoPackage files into a single GeoPackage file (files with the same layer name are appended to one layer).
+        Layers are copied in-process within a single transaction, reprojected only if their CRS differs from the target EPSG code,
+        and spatial indexes are built once at the end.
 
         Args:
             output_file (str): the output GeoPackage file
         """
         
         # debug print the list of GeoPackage files
-        # print(self.gpkg_files)
-
-        # initialize the GeoPackage using the first GeoPackage file
         print(self.gpkg_files)
-        first_gpkg_file = str(self.gpkg_files[0])
-        layer_name = first_gpkg_file.split(f"_{self.api_type}")[0]
-        first_gpkg_file = os.path.join(self.gpkg_dir, first_gpkg_file)
-
-        subprocess.run(['ogr2ogr', '-f', 'GPKG', output_file, first_gpkg_file, # output and input files
-                '-s_srs', f'EPSG:{self.target_epsg}',  # set source CRS
-                '-t_srs', f'EPSG:{self.target_epsg}', # set target CRS
-                '-nln', layer_name # specify name of the layer
-                ], check=True, capture_output=True, text=True) # to show log
-        print(f"Initialized merged GeoPackage with CRS EPSG:{self.target_epsg} from {layer_name}.")
-        for gpkg_file in self.gpkg_files[1:]:  # skip the first file because it's already added
+        if os.path.exists(output_file):
+            os.remove(output_file)
+
+        target_srs = osr.SpatialReference()
+        target_srs.ImportFromEPSG(int(self.target_epsg))
+        target_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+
+        out_ds = ogr.GetDriverByName("GPKG").CreateDataSource(output_file)
+        out_ds.StartTransaction()
+        layer_names = []
+        for gpkg_file in self.gpkg_files:
             layer_name = gpkg_file.split(f"_{self.api_type}")[0]
             gpkg_file = os.path.join(self.gpkg_dir, gpkg_file)
-            # run appending separate geopackages to empty merged geopackage (update if layers were previously written)
-            try:
-                result = subprocess.run(['ogr2ogr', '-f', 'GPKG', output_file, '-s_srs', f'EPSG:{self.target_epsg}', # for input file
-                                                '-t_srs', f'EPSG:{self.target_epsg}', # for output file
-                                                '-nln', layer_name, '-update', '-append', gpkg_file],
-                                                check=True, 
-                                                capture_output=True, 
-                                                text=True)
+            src_ds = ogr.Open(gpkg_file)
+            if src_ds is None:
+                print(f"Error adding {layer_name}: {gpkg_file} can't be opened")
+                continue
+            src_layer = src_ds.GetLayer(0)
+
+            # layers without a CRS are assumed to be in the target CRS
+            transform = None
+            source_srs = src_layer.GetSpatialRef()
+            if source_srs is not None and source_srs.GetAuthorityCode(None) != str(self.target_epsg):
+                source_srs.SetAxisMappingStrategy(osr.OAMS_TRADITIONAL_GIS_ORDER)
+                transform = osr.CoordinateTransformation(source_srs, target_srs)
+
+            out_layer = out_ds.GetLayerByName(layer_name)
+            if out_layer is None and transform is None:
+                # spatial index is built once all features are written
+                out_ds.CopyLayer(src_layer, layer_name, ["SPATIAL_INDEX=NO"])
+                layer_names.append(layer_name)
                 print(f"Added layer {layer_name} from {gpkg_file} to {output_file}")
-                if len(result.stderr) > 0:
-                    print(f"Warnings or errors:\n{result.stderr}")
+                src_ds = None
+                continue
+
+            if out_layer is None:
+                out_layer = out_ds.CreateLayer(layer_name, target_srs, src_layer.GetGeomType(), ["SPATIAL_INDEX=NO"])
+                layer_names.append(layer_name)
+            self.append_features(src_layer, out_layer, transform)
+            print(f"Added layer {layer_name} from {gpkg_file} to {output_file}")
+            src_ds = None
+        out_ds.CommitTransaction()
+
+        # build spatial indexes
+        for layer_name in layer_names:
+            geom_column = out_ds.GetLayerByName(layer_name).GetGeometryColumn()
+            if geom_column:
+                result = out_ds.ExecuteSQL(f"SELECT CreateSpatialIndex('{layer_name}', '{geom_column}')")
+                out_ds.ReleaseResultSet(result)
+        out_ds = None
+        print(f"Merged {len(self.gpkg_files)} GeoPackage files into {output_file} with CRS EPSG:{self.target_epsg}")
+
+    @staticmethod
+    def append_features(src_layer:ogr.Layer, out_layer:ogr.Layer, transform:osr.CoordinateTransformation=None) -> int:
+        """
+        Append the features of a layer to another layer, adding the missing fields and reprojecting geometries if a transformation is given.
+
+        Args:
+            src_layer (ogr.Layer): the layer to read
+            out_layer (ogr.Layer): the layer to write
+            transform (osr.CoordinateTransformation): the transformation to the CRS of the output layer (default is None)
+
+        Returns:
+            int: the number of appended features
+        """
+        out_defn = out_layer.GetLayerDefn()
+        src_defn = src_layer.GetLayerDefn()
+        for i in range(src_defn.GetFieldCount()):
+            if out_defn.GetFieldIndex(src_defn.GetFieldDefn(i).GetName()) < 0:
+                out_layer.CreateField(src_defn.GetFieldDefn(i))
+        out_defn = out_layer.GetLayerDefn()
 
-            except subprocess.CalledProcessError as e:
-                print(f"Error adding {layer_name}: {e.stderr}")
-            except Exception as e:
-                print(f"Unexpected error with {layer_name}: {e}")
+        feature_count = 0
+        for feature in src_layer:
+            out_feature = ogr.Feature(out_defn)
+            out_feature.SetFrom(feature)
+            geometry = out_feature.GetGeometryRef()
+            if geometry is not None and transform is not None:
+                geometry.Transform(transform)
+            out_layer.CreateFeature(out_feature)
+            feature_count += 1
+        return feature_count
 
-    def fix_geometries_in_gpkg(self, input_gpkg:str, fixed_gpkg_path:str=None) -> str:
+    def fix_geometries_in_gpkg(self, input_gpkg:str, fixed_gpkg_path:str=None, jobs:int=1) -> str:
         """
         Fix invalid geometries in a GeoPackage file and save the fixed geometries to a new GeoPackage file.
         If fixed_gpkg is not specified, the input GeoPackage file will be overwritten.
@@ -134,6 +247,7 @@ class OSMGeojsonToGpkg():
         Args:
             input_gpkg (str): the input GeoPackage file
             fixed_gpkg_path (str): the output path for the fixed GeoPackage file (default is None)
+            jobs (int): the number of processes repairing chunks of invalid geometries (default is 1)
         Returns:
             str: the path to the fixed GeoPackage file
         """
@@ -146,44 +260,8 @@ class OSMGeojsonToGpkg():
             shutil.copyfile(input_gpkg, fixed_gpkg_path) # to copy file to a new one
             copy_gpkg = True
 
-        # open the output GeoPackage for editing
-        data_source = ogr.Open(fixed_gpkg_path, update=1)
-
-        for i in range(data_source.GetLayerCount()):            
-            layer = data_source.GetLayerByIndex(i)
-            layer_name = layer.GetName()
-            feature_to_fix_count = 0
-            fixed_feature_count = 0
-            invalid_feature_count = 0
-
-            # iterate over all features in the layer
-            for feature in layer:
-                geometry = feature.GetGeometryRef()
-                if not geometry.IsValid():
-                    feature_to_fix_count += 1 # increment the number of features to be fixed
-                    # attempt to fix the geometry
-                    fixed_geometry = geometry.MakeValid()
-
-                    if fixed_geometry.IsValid():
-                        # replace the geometry with the fixed one
-                        feature.SetGeometry(fixed_geometry)
-                        layer.SetFeature(feature)  # save the updated feature back to the layer
-                        print(f"Fixed invalid geometry in layer '{layer_name}', feature ID: {feature.GetFID()}")
-                        fixed_feature_count += 1 # increment the number of fixed features
-                    else:
-                        print(f"Could not fix geometry in layer '{layer_name}', feature ID: {feature.GetFID()}")
-                        invalid_feature_count += 1 # increment the number of features that cannot be fixed
-
-        if feature_to_fix_count == 0:
-            print (f"All geometries of features in the layer '{layer_name}' of the output vector are valid.")
-            print("-" * 40)
-        else:
-            print(f"Layer '{layer_name}: {fixed_feature_count} geometries fixed.") 
-            print(f"Layer '{layer_name}': {invalid_feature_count} geometries could not be fixed.")
-            print("-" * 40)
-
-        # close the data source
-        del data_source
+        # invalid geometries of all layers are found and repaired in bulk
+        GeometryValidator(jobs=jobs).fix_gpkg(fixed_gpkg_path)
 
         # return the path to the fixed GeoPackage file
         if copy_gpkg == True:
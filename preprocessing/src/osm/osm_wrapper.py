@@ -3,6 +3,7 @@ from osm.overpass_wrapper import OverpassWrapper
 from osm.osm_geojson_to_gpkg import OSMGeojsonToGpkg
 from osm.ohsome_wrapper import OhsomeWrapper
 from utils import load_yaml, read_years_from_config
+from scheduler import run_per_year
 import shutil
 
 class OSMWrapper():
@@ -38,15 +39,18 @@ class OSMWrapper():
         os.makedirs(self.gpkg_dir, exist_ok=True)
         
 
-    def osm_overpass_to_geojson(self, years:list, skip_fetch:bool):
+    def osm_overpass_to_geojson(self, years:list, skip_fetch:bool, fetch_workers:int=1, tile_size:float=None, max_tile_depth:int=4):
         """
         Handles fetching OSM data for all the years in the configuration file and convert them to geojson files.
 
         Args:
             years (list): a list of years to process (From the OSMPreprocessor class)
             skip_fetch (bool): whether to skip fetching OSM data or not. If FALSE, it will OVERWRITE any existing JSON files.
+            fetch_workers (int): the number of tiles fetched concurrently (if the bounding box is tiled)
+            tile_size (float): the maximum size of tiles of the bounding box in degrees (the bounding box is not tiled if None)
+            max_tile_depth (int): the maximum number of times a tile is split again after a timeout or a too large response
         """
-        ow = OverpassWrapper(self.config, self.osm_output_data_dir, self.verbose, years)
+        ow = OverpassWrapper(self.config, self.osm_output_data_dir, self.verbose, years, fetch_workers, tile_size, max_tile_depth)
         for year in years:
             # build the queries for the year
             queries = ow.overpass_query_builder(year, bbox=ow.bbox)
@@ -60,27 +64,28 @@ class OSMWrapper():
                 if self.verbose:
                     [print(f"Created JSON file: {intermediate_json}, ") for intermediate_json in intermediate_jsons]
  
-            # convert the intermediate JSON files to GeoJSON files
-            ow.convert_to_geojson(queries=queries, year=year)
-            # fix invalid geometries in the GeoJSON files
+            # convert the intermediate JSON files to GeoPackage files, filtering geometries
             if self.verbose:
-                print(f"Verbose outputs enabled, so filtered geometries will be created as new *_filtered.geojson files")
-            ow.filter_geometries(queries=queries,year=year, overwrite_original= not(self.verbose))
+                print(f"Verbose outputs enabled, so filtered geometries will be created as new *_filtered.gpkg files")
+            ow.convert_to_gpkg(queries=queries,year=year, overwrite_original= not(self.verbose))
 
-    def osm_ohsome_to_geojson(self, years:list, skip_fetch:bool):
+    def osm_ohsome_to_geojson(self, years:list, skip_fetch:bool, fetch_workers:int=1, tile_size:float=None, max_tile_depth:int=4):
         """
         Handles fetching OSM data for all the years in the configuration file and convert them to geojson files.
 
         Args:
             years (list): a list of years to process (From the OSMPreprocessor class)
             skip_fetch (bool): whether to skip fetching OSM data or not. If FALSE, it will OVERWRITE any existing JSON files.
+            fetch_workers (int): the number of filters (roads, railways, etc.), or of tiles if the bounding box is tiled, fetched concurrently
+            tile_size (float): the maximum size of tiles of the bounding box in degrees (the bounding box is not tiled if None)
+            max_tile_depth (int): the maximum number of times a tile is split again after a timeout or a too large response
         """
-        ow = OhsomeWrapper(self.config, self.osm_output_data_dir, years, self.verbose)
+        ow = OhsomeWrapper(self.config, self.osm_output_data_dir, years, self.verbose, fetch_workers, tile_size, max_tile_depth)
         all_years = True if len(years) > 1 else False # if more than one year is provided, then fetch all years combined into one JSON file
         year = years[-1]
         intermediate_jsons = [os.path.join(self.osm_output_data_dir, file) for file in os.listdir(self.osm_output_data_dir) if f'ohsome_pre_{year}.json' in file]
         if self.verbose:
-            print(f"Verbose outputs enabled, so filtered features will be created as new *_filtered.geojson files")
+            print(f"Verbose outputs enabled, so filtered features will be created as new *_filtered.gpkg files")
         if skip_fetch == True and len(intermediate_jsons) <= 0:
             raise ValueError(f"No JSON files found for year {year}. Please re-run the command with skip_fetch=False.")
         elif skip_fetch == True:
@@ -88,41 +93,76 @@ class OSMWrapper():
         else:
             ow.fetch_osm_data(years, ow.ohsome_query_builder(all_years), timeout=600)
 
-    def osm_to_geojson(self, years:list, skip_fetch:bool):
+    def osm_to_geojson(self, years:list, skip_fetch:bool, fetch_workers:int=1, tile_size:float=None, max_tile_depth:int=4):
         if self.api_type == 'overpass':
-            self.osm_overpass_to_geojson(years, skip_fetch)
+            self.osm_overpass_to_geojson(years, skip_fetch, fetch_workers, tile_size, max_tile_depth)
         elif self.api_type == 'ohsome':
-            self.osm_ohsome_to_geojson(years, skip_fetch)
+            self.osm_ohsome_to_geojson(years, skip_fetch, fetch_workers, tile_size, max_tile_depth)
         else:
             raise ValueError("Invalid API type. Please use either 'overpass' or 'ohsome'.")
      
-    def osm_to_merged_gpkg(self, years:list, api_type:str):
+    def osm_to_merged_gpkg(self, years:list, api_type:str, jobs:int=1):
         """
         Converts the OSM GeoJSON files to GeoPackage files and merges them into a single GeoPackage file.
 
         Args:
             years (list): a list of years to process (From the OSMPreprocessor class)
             api_type (str): the API to use for fetching OSM data (either 'overpass' or 'ohsome')
+            jobs (int): the number of years processed concurrently (only with ohsome, as Overpass GeoPackage files are shared by all years).
+                Jobs which are not used by concurrent years repair invalid geometries of each year on a pool of processes.
 
         Returns:
             None: Writes the GeoPackage files to the output directory
         
         """
-        for year in years:
-            ogtg = OSMGeojsonToGpkg(self.osm_output_data_dir,self.gpkg_dir,target_epsg=4326, year=year, api_type=api_type)
-            # if verbose mode is used then use the filtered.geojson files
-            file_ending = '_filtered.geojson' if self.verbose else 'geojson'
-
-            # replace .geojson with .gpkg for each file
-            ogtg.gpkg_files = [file for file in ogtg.convert_geojson_to_gpkg(file_ending)]
-            output_file = os.path.join(self.gpkg_dir, f'osm_merged_{year}.gpkg') # year added from OSM_PreProcessor class 
-            fixed_gpkg_path = os.path.join(self.gpkg_dir, f'osm_merged_{year}_fixed.gpkg')
-            ogtg.merge_gpkg_files(output_file)
-            gpkg_path = ogtg.fix_geometries_in_gpkg(output_file, fixed_gpkg_path)
-            #Move file to vector_dir for next component
-            shutil.move(gpkg_path, os.path.join(self.vector_dir, f'osm_merged_{year}.gpkg'))
-
-    
+        if api_type != 'ohsome':
+            year_jobs = 1
+        else:
+            self.ohsome_to_yearly_gpkg(years)
+            year_jobs = max(min(jobs, len(years)), 1)
+        run_per_year(osm_year_to_merged_gpkg, years, (self, api_type, max(jobs // year_jobs, 1)), year_jobs)
+
+    def ohsome_to_yearly_gpkg(self, years:list) -> dict:
+        """
+        Splits the filtered ohsome GeoPackage files (with the snapshots of all years) into GeoPackage files of each year, reading each file once.
+
+        Args:
+            years (list): a list of years to process
+
+        Returns:
+            dict: a list of GeoPackage files for each year
+        """
+        ogtg = OSMGeojsonToGpkg(self.osm_output_data_dir, self.gpkg_dir, target_epsg=4326, year=years[-1], api_type='ohsome')
+        file_ending = '_filtered.gpkg' if self.verbose else '.gpkg'
+        return ogtg.partition_ohsome_by_year(file_ending, years)
+
+    def year_to_merged_gpkg(self, year:int, api_type:str, jobs:int=1) -> str:
+        """
+        Converts the filtered OSM GeoPackage files of one year to GeoPackage files in the target CRS and merges them into a single GeoPackage file.
+
+        Args:
+            year (int): the year to process
+            api_type (str): the API to use for fetching OSM data (either 'overpass' or 'ohsome')
+            jobs (int): the number of processes repairing invalid geometries of the merged file (default is 1)
+
+        Returns:
+            str: the path to the merged GeoPackage file of the year
+        """
+        ogtg = OSMGeojsonToGpkg(self.osm_output_data_dir,self.gpkg_dir,target_epsg=4326, year=year, api_type=api_type)
+        # if verbose mode is used then use the filtered.gpkg files
+        file_ending = '_filtered.gpkg' if self.verbose else '.gpkg'
+
+        # convert the filtered files of the year
+        ogtg.gpkg_files = [file for file in ogtg.convert_geojson_to_gpkg(file_ending)]
+        output_file = os.path.join(self.gpkg_dir, f'osm_merged_{year}.gpkg') # year added from OSM_PreProcessor class 
+        fixed_gpkg_path = os.path.join(self.gpkg_dir, f'osm_merged_{year}_fixed.gpkg')
+        ogtg.merge_gpkg_files(output_file)
+        gpkg_path = ogtg.fix_geometries_in_gpkg(output_file, fixed_gpkg_path, jobs)
+        #Move file to vector_dir for next component
+        merged_gpkg = os.path.join(self.vector_dir, f'osm_merged_{year}.gpkg')
+        shutil.move(gpkg_path, merged_gpkg)
+        return merged_gpkg
+
     def delete_temp_files(self, delete_geojsons:bool, delete_gpkg_files:bool):
         """
         Delete all intermediate GeoJSON files to save disk space.
@@ -144,7 +184,18 @@ class OSMWrapper():
             for file in os.listdir(self.gpkg_dir):
                 if file.endswith('.gpkg') and 'osm_merged' not in file:
                     os.remove(os.path.join(self.gpkg_dir, file))
-            print(f"Deleted all GeoPackage files from {self.gpkg_dir}")
+            # filtered GeoPackage files written next to the fetched data
+            for file in os.listdir(self.osm_output_data_dir):
+                if file.endswith('.gpkg'):
+                    os.remove(os.path.join(self.osm_output_data_dir, file))
+            print(f"Deleted all GeoPackage files from {self.gpkg_dir} and {self.osm_output_data_dir}")
+
+
+def osm_year_to_merged_gpkg(year:int, osm:OSMWrapper, api_type:str, jobs:int=1) -> str:
+    """
+    Converts and merges the OSM data of one year (to be dispatched to a worker process by the year scheduler, see OSMWrapper.year_to_merged_gpkg).
+    """
+    return osm.year_to_merged_gpkg(year, api_type, jobs)
 
 
 if __name__ == "__main__":
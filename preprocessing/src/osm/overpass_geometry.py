@@ -0,0 +1,172 @@
+import numpy as np
+import shapely
+from typing import Iterator
+
+# local imports
+from geojson_stream import iter_features
+
+class OverpassGeometryBuilder():
+    """
+    Builds geometries from Overpass JSON responses in Python (instead of the osmtogeojson Node.js tool).
+    Responses are read one element at a time and geometries are created in batches with vectorized Shapely functions.
+    Ways are read from their inline coordinates ('out geom;'), or from the coordinates of their nodes for responses fetched with 'out;'.
+    Closed ways with area tags become polygons, other ways become lines, multipolygon relations become (multi)polygons and
+    other relations become multilines. Tagged nodes become points. Properties are the OSM tags and '@id' ('way/123'), as written by osmtogeojson.
+    """
+    # number of ways whose geometries are created at once
+    BATCH_SIZE = 20000
+    # tags of closed ways which are polygons (None means all values, except the ones listed in AREA_EXCLUDED_VALUES), simplified from osmtogeojson
+    AREA_KEYS = {
+        "building": None, "landuse": None, "amenity": None, "leisure": None, "place": None, "shop": None, "tourism": None,
+        "water": None, "wetland": None, "natural": None, "aeroway": None, "military": None, "boundary": None, "area:highway": None,
+        "waterway": {"riverbank", "dock", "boatyard", "dam"},
+        "highway": {"services", "rest_area", "escape", "elevator"},
+        "railway": {"station", "turntable", "roundhouse", "platform"},
+        "man_made": None, "power": {"plant", "substation", "generator", "transformer"},
+    }
+    AREA_EXCLUDED_VALUES = {
+        "natural": {"coastline", "cliff", "ridge", "arete", "tree_row"},
+        "man_made": {"cutline", "embankment", "pipeline"},
+        "aeroway": {"taxiway"},
+    }
+    # relations which are polygons
+    AREA_RELATIONS = {"multipolygon", "boundary"}
+
+    def __init__(self, path:str) -> None:
+        """
+        Initializes the builder.
+
+        Args:
+            path (str): path to the Overpass JSON response
+        """
+        self.path = path
+        self.element_count = 0
+
+    @classmethod
+    def is_area(cls, tags:dict) -> bool:
+        """
+        Checks whether a closed way is a polygon according to its tags.
+        """
+        if tags.get("area") == "no":
+            return False
+        if tags.get("area") == "yes":
+            return True
+        for key, value in tags.items():
+            if key not in cls.AREA_KEYS:
+                continue
+            values = cls.AREA_KEYS[key]
+            if (values is None and value not in cls.AREA_EXCLUDED_VALUES.get(key, ())) or (values is not None and value in values):
+                return True
+        return False
+
+    @staticmethod
+    def properties(element:dict) -> dict:
+        """
+        Returns the properties of a feature: the tags of the element and its identifier.
+        """
+        return {"@id": f"{element['type']}/{element['id']}", **element.get("tags", {})}
+
+    @staticmethod
+    def relation_geometry(element:dict) -> shapely.Geometry:
+        """
+        Builds the geometry of a relation from the inline geometries of its member ways.
+        Rings of multipolygons are assembled from the member ways (rings can be split into several ways), and inner rings are cut from outer rings.
+
+        Returns:
+            shapely.Geometry: the geometry of the relation, or None if it can't be built
+        """
+        lines = {"outer": [], "inner": []}
+        for member in element.get("members", []):
+            coords = [(point["lon"], point["lat"]) for point in member.get("geometry") or [] if point]
+            if member.get("type") == "way" and len(coords) >= 2:
+                lines["inner" if member.get("role") == "inner" else "outer"].append(coords)
+        if not lines["outer"]:
+            return None
+
+        if element.get("tags", {}).get("type") not in OverpassGeometryBuilder.AREA_RELATIONS:
+            return shapely.multilinestrings(OverpassGeometryBuilder.member_lines(lines["outer"] + lines["inner"]))
+        outer = shapely.union_all(shapely.get_parts(shapely.polygonize(OverpassGeometryBuilder.member_lines(lines["outer"]))))
+        if lines["inner"]:
+            inner = shapely.union_all(shapely.get_parts(shapely.polygonize(OverpassGeometryBuilder.member_lines(lines["inner"]))))
+            outer = shapely.difference(outer, inner)
+        return None if outer.is_empty else outer
+
+    @staticmethod
+    def member_lines(coords:list) -> np.ndarray:
+        """
+        Creates the lines of member ways at once (member ways have different numbers of vertices, so their coordinates are concatenated).
+
+        Args:
+            coords (list): coordinates of each member way
+
+        Returns:
+            np.ndarray: array of lines
+        """
+        indices = np.repeat(np.arange(len(coords)), [len(way_coords) for way_coords in coords])
+        return shapely.linestrings(np.concatenate([np.asarray(way_coords, dtype=float) for way_coords in coords]), indices=indices)
+
+    def build_ways(self, ways:list) -> tuple[np.ndarray, list]:
+        """
+        Creates the geometries of a batch of ways at once.
+
+        Args:
+            ways (list): tuples of coordinates (array of shape (n, 2)), polygon flag and properties of ways
+
+        Returns:
+            tuple: array of geometries and list of properties
+        """
+        geometries = np.empty(len(ways), dtype=object)
+        for is_polygon in (False, True):
+            selection = [i for i, way in enumerate(ways) if way[1] == is_polygon]
+            if not selection:
+                continue
+            coords = np.concatenate([ways[i][0] for i in selection])
+            indices = np.repeat(np.arange(len(selection)), [len(ways[i][0]) for i in selection])
+            if is_polygon:
+                geometries[selection] = shapely.polygons(shapely.linearrings(coords, indices=indices))
+            else:
+                geometries[selection] = shapely.linestrings(coords, indices=indices)
+        return geometries, [way[2] for way in ways]
+
+    def iter_batches(self) -> Iterator[tuple[np.ndarray, list]]:
+        """
+        Reads the response and yields the geometries and properties of its features in batches.
+
+        Yields:
+            tuple: array of Shapely geometries and list of properties of the features
+        """
+        # coordinates of nodes, only needed by responses fetched with 'out;' (nodes are listed before ways)
+        nodes = {}
+        ways = []
+        others = []
+        for element in iter_features(self.path, key="elements"):
+            self.element_count += 1
+            element_type = element.get("type")
+            if element_type == "node":
+                nodes[element["id"]] = (element["lon"], element["lat"])
+                if element.get("tags"):
+                    others.append((shapely.points(element["lon"], element["lat"]), self.properties(element)))
+            elif element_type == "way":
+                if "geometry" in element:
+                    coords = [(point["lon"], point["lat"]) for point in element["geometry"] if point]
+                else:
+                    coords = [nodes[node] for node in element.get("nodes", []) if node in nodes]
+                if len(coords) < 2:
+                    continue
+                tags = element.get("tags", {})
+                is_polygon = len(coords) >= 4 and coords[0] == coords[-1] and self.is_area(tags)
+                ways.append((np.asarray(coords, dtype=float), is_polygon, self.properties(element)))
+                if len(ways) >= self.BATCH_SIZE:
+                    yield self.build_ways(ways)
+                    ways = []
+            elif element_type == "relation":
+                geometry = self.relation_geometry(element)
+                if geometry is not None:
+                    others.append((geometry, self.properties(element)))
+
+        if ways:
+            yield self.build_ways(ways)
+        if others:
+            geometries = np.empty(len(others), dtype=object)
+            geometries[:] = [geometry for geometry, _ in others]
+            yield geometries, [properties for _, properties in others]
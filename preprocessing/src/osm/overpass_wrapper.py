@@ -1,12 +1,15 @@
 
 import os
 import requests
-import json
-import subprocess
+import shapely
+from osgeo import ogr
 
 # local imports
 from utils import get_lulc_template
 from reprojection import RasterTransform
+from osm.bbox_tiling import BBoxTiler, TileSplitError
+from osm.overpass_geometry import OverpassGeometryBuilder
+from gpkg_stream import GPKGStreamWriter
 import timing
 
 class OverpassWrapper():
@@ -14,7 +17,15 @@ class OverpassWrapper():
     This OSM (OpenStreetMap) Pre-Processor class fetches OSM data for a given set of years and a bounding box.
     Currently only fetches for one year of OSM data.
     """
-    def __init__(self, config:dict, output_dir:str, verbose:bool, years:list[int]) -> None:
+    # names of Shapely geometry type ids
+    GEOMETRY_TYPES = {0: 'Point', 1: 'LineString', 3: 'Polygon', 4: 'MultiPoint', 5: 'MultiLineString', 6: 'MultiPolygon', 7: 'GeometryCollection'}
+    # timeout of queries on the server, and timeouts of requests in seconds (connect, read)
+    SERVER_TIMEOUT = 9000
+    CONNECT_TIMEOUT = 30
+    # tiles without any response within the read timeout are split (see BBoxTiler.fetch_tile)
+    TILE_READ_TIMEOUT = 900
+
+    def __init__(self, config:dict, output_dir:str, verbose:bool, years:list[int], max_workers:int=1, tile_size:float=None, max_tile_depth:int=4) -> None:
         """
         Initialize the OverpassWrapper (OSM Pre-Processor) class with the configuration file and output directory.
 
@@ -23,6 +34,9 @@ class OverpassWrapper():
             config (dict): The configuration.yaml loaded as a dictionary
             output_dir (str): the output directory to save the intermediate files
             verbose (bool): verbose output
+            max_workers (int): the number of tiles fetched concurrently (if the bounding box is tiled)
+            tile_size (float): the maximum size of tiles of the bounding box in degrees (the bounding box is not tiled if None)
+            max_tile_depth (int): the maximum number of times a tile is split again after a timeout or a too large response
         """
         self.config = config
         self.output_dir = output_dir
@@ -41,6 +55,8 @@ class OverpassWrapper():
             print(f"Bounding box for the OSM data is to be retrieved from the raster: {lulc}")
 
         self.bbox = RasterTransform(raster_path=lulc).bbox_to_WGS84(print_details=self.verbose)
+        # split large bounding boxes into tiles (responses of tiles are cached in the output directory)
+        self.tiler = BBoxTiler(self.bbox, os.path.join(output_dir, "tiles"), tile_size, max_tile_depth, max_workers) if tile_size else None
         # convert the bounding box to a string
         self.bbox = ",".join([str(coord) for coord in self.bbox])
 
@@ -61,50 +77,84 @@ class OverpassWrapper():
 
         # iterate over the queries and execute them
         for query_name, query in queries.items():
+            if self.tiler is not None:
+                intermediate_jsons.append(self.fetch_tiled_query(query_name, query, year, overpass_url))
+                continue
+
             if self.verbose:
                 print(f"Fetching OSM data for {query_name} in the {year} year.")
                 timing.start()
   
-            response = requests.get(overpass_url, params={'data': query})
+            # the response is streamed to the file as it is (it is parsed one element at a time when converted)
+            output_file = os.path.join(self.output_dir, f"{query_name}_pre_{year}.json")
+            # the server answers once the query is done, so the read timeout is the timeout of the query on the server
+            with requests.get(overpass_url, params={'data': query}, stream=True, timeout=(self.CONNECT_TIMEOUT, self.SERVER_TIMEOUT)) as response:
+                # if response is successful
+                if response.status_code == 200:
+                    # saved under a temporary name until the whole response is received (incomplete responses are not kept)
+                    temp_file = output_file + ".part"
+                    try:
+                        with open(temp_file, 'wb') as f:
+                            for chunk in response.iter_content(chunk_size=2**20):
+                                f.write(chunk)
+                        os.replace(temp_file, output_file)
+                    finally:
+                        if os.path.exists(temp_file):
+                            os.remove(temp_file)
+                else:
+                    print(f"Error: {response.status_code} for {query_name} in the {year} year")
+                    print(response.text)
+                    print ("-" * 30)
+                    continue
 
             if self.verbose:
                 timing.stop()
 
-            #TODO what needs to be verbose here?
-
-            # if response is successful
-            if response.status_code == 200:
-                print(f"Query to fetch OSM data for {query_name} in the {year} year has been successful.")
-                data = response.json()
-                
-                # Extract elements from data
-                elements = data.get('elements', [])
-                
-                # Print the number of elements
-                print(f"Number of elements in {query_name} in the {year} year: {len(elements)}")
-                
-                # Print the first 3 elements to verify response
-                for i, element in enumerate(elements[:3]):
-                    print(f"Element {i+1}:")
-                    print(json.dumps(element, indent=2))
-                
-                # Save the JSON data to a file
-                output_file = os.path.join(self.output_dir, f"{query_name}_pre_{year}.json")
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    json.dump(data, f, ensure_ascii=False, indent=4)
-                print(f"Data has been saved to {output_file}")
-                print ("-" * 30)
+            print(f"Query to fetch OSM data for {query_name} in the {year} year has been successful.")
+            print(f"Data has been saved to {output_file}")
+            print ("-" * 30)
 
-                # Add the output file name to the list
-                intermediate_jsons.append(output_file)
-                
-            else:
-                print(f"Error: {response.status_code} for {query_name} in the {year} year")
-                print(response.text)
-                print ("-" * 30)
+            # Add the output file name to the list
+            intermediate_jsons.append(output_file)
 
         return intermediate_jsons
-    
+
+    def fetch_tiled_query(self, query_name:str, query:str, year:int, overpass_url:str = "https://overpass-api.de/api/interpreter") -> str:
+        """
+        A function to fetch OSM data for a query tile by tile and merge the tiles without duplicates (ways and relations crossing tiles are returned by each tile).
+
+        Args:
+            query_name (str): the name of the query
+            query (str): the query for the whole bounding box
+            year (int): the year of the data
+            overpass_url (str): the URL of the Overpass API
+
+        Returns:
+            str: the path to the intermediate JSON file
+        """
+        def fetch_tile(tile:tuple, output_path:str) -> None:
+            # the bounding box of the query is replaced with the extent of the tile
+            tile_query = query.replace(f"({self.bbox})", f"({BBoxTiler.tile_string(tile)})")
+            with requests.get(overpass_url, params={'data': tile_query}, stream=True, timeout=(self.CONNECT_TIMEOUT, self.TILE_READ_TIMEOUT)) as response:
+                if response.status_code != 200:
+                    raise requests.HTTPError(f"Error: {response.status_code} for {query_name} in the {year} year", response=response)
+                with open(output_path, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=2**20):
+                        f.write(chunk)
+            # queries running out of time or memory on the server return a remark at the end of the response
+            with open(output_path, 'rb') as f:
+                f.seek(max(os.path.getsize(output_path) - 4096, 0))
+                tail = f.read().decode('utf-8', errors='ignore')
+            if '"remark"' in tail and 'runtime error' in tail:
+                raise TileSplitError(f"query failed on the server ({tail[tail.index('runtime error'):].splitlines()[0]})")
+
+        tile_files = self.tiler.fetch(f"{query_name}_{year}", query, fetch_tile)
+        output_file = os.path.join(self.output_dir, f"{query_name}_pre_{year}.json")
+        element_count = BBoxTiler.merge_tiles(tile_files, output_file, "elements", lambda element: (element.get('type'), element.get('id')))
+        print(f"Number of elements in {query_name} in the {year} year: {element_count}")
+        print(f"Data has been saved to {output_file}")
+        print ("-" * 30)
+        return output_file
 
     def overpass_query_builder(self, year:int, bbox:str) -> dict[str, str]:
         """
@@ -129,14 +179,13 @@ class OverpassWrapper():
             query = f"""
             [out:json]
             [maxsize:1073741824]
-            [timeout:9000]
+            [timeout:{self.SERVER_TIMEOUT}]
             [date:"{year}-12-31T23:59:59Z"];
             (
             {filters}
             ({bbox});
-            node(w);
             );
-            out;
+            out geom;
             """
 
             query_dict[query_key] = query
@@ -164,121 +213,84 @@ class OverpassWrapper():
         return query_dict
     
 
-    def convert_to_geojson(self, queries:dict[str,str], year:int):
+    @staticmethod
+    def keep_feature(query_name:str, geometry_type:str, properties:dict) -> bool:
         """
-        A function to convert the intermediate JSON files to GeoJSON files. The GeoJSON files written to the output directory.
+        A function to check whether a feature is kept by the filter of its query.
 
         Args:
-            queries (dict): a dictionary of queries
-            year (int): the year of the data
-        """
-        for query_name, query in queries.items():
-            input_file = os.path.join(self.output_dir, f"{query_name}_pre_{year}.json")
-            output_file = os.path.join(self.output_dir, f"{query_name}_pre_{year}.geojson")
-            result = subprocess.run(['osmtogeojson', input_file], capture_output=True, text=True)
-            if result.returncode == 0:
-                print(f"Conversion to GeoJSON for {query_name} in the {year} year was successful.")
-                with open(output_file, 'w', encoding='utf-8') as f:
-                    f.write(result.stdout)
-            else:
-                print(f"Conversion to GeoJSON for {query_name} in the {year} year failed.")
-                print(result.stderr)
-
-            if self.verbose:
-                #print number of features in the GeoJSON file
-                with open(output_file, 'r', encoding='utf-8') as f:
-                    geojson_data = json.load(f)
-                    features = geojson_data.get('features', [])
-                    print(f"Total features in {query_name} in the {year} year: {len(features)}")
-                    print ("-" * 30)
-                    
-            
+            query_name (str): the name of the query
+            geometry_type (str): the geometry type of the feature (e.g. 'LineString')
+            properties (dict): the properties of the feature
 
-    def filter_geometries(self, queries:dict[str,str], year:int , overwrite_original:bool):
+        Returns:
+            bool: True if the feature is kept
+        """
+        # for roads, railways and waterways extract only lines and multilines
+        if query_name in ("roads", "railways", "waterways"):
+            # filter based on geometry types and level - it should be 0 (or null)
+            return geometry_type in ('LineString', 'MultiLineString') and properties.get('level') in (None, 0) # filtering by ground level of infrastructure
+        # for waterbodies extract only polygons and multipolygons
+        if query_name == "waterbodies":
+            return geometry_type in ('Polygon', 'MultiPolygon')
+        # for everything else extract everything that can be found
+        return True
+
+    def convert_to_gpkg(self, queries:dict[str,str], year:int , overwrite_original:bool) -> list:
         """
-        A function to fix invalid geometries in the GeoJSON files
+        A function to convert the intermediate JSON files to GeoPackage files, keeping the features matching the geometry type and level of their query.
+        Geometries are built from the Overpass elements in Python and written to the GeoPackage files in batches, without intermediate GeoJSON files.
 
         Args:
             queries (dict): a dictionary of queries
             year (int): the year of the data
-            overwrite_original (bool): overwrite the original GeoJSON files (True) or create new ones (False) *_filtered.geojson
+            overwrite_original (bool): write the filtered features to *_pre_{year}.gpkg (True) or to new *_filtered.gpkg files (False)
 
         Returns:
-            list: a list of filtered GeoJSON files
+            list: a list of filtered GeoPackage files
         """
-        geojson_files=[]
+        gpkg_files=[]
 
         # iterate over the queries and define outputs
         for query_name in queries.keys():
-            geojson_file = os.path.join(self.output_dir, f"{query_name}_pre_{year}.geojson")
-
-            # check if the non-zero GeoJSON files exist
-            if os.path.exists(geojson_file) and os.path.getsize(geojson_file) > 0:
-                print(f"Conversion to GeoJSON for {query_name} in the {year} year was successful.")
-                
-                # read the GeoJSONs
-                with open(geojson_file, 'r', encoding='utf-8') as f:
-                    geojson_data = json.load(f)
-                    features = geojson_data.get('features', [])
-                    print(f"Total features: {len(features)}")
-                    
-                # determine the geometries to filter based on query_name
-                # for roads, railways and waterways extract only lines and multilines
-                if query_name in ("roads", "railways", "waterways"):
-                    geometry_types = ['LineString', 'MultiLineString']
-                    # filter based on geometry types and level - it should be 0 (or null)
-                    filtered_features = [
-                        feature for feature in geojson_data.get('features', [])
-                        if feature['geometry']['type'] in geometry_types
-                        and (feature['properties'].get('level') in (None, 0)) # filtering by ground level of infrastructure
-                    ]
-                # for waterbodies extract only polygons and multipolygons
-                elif query_name == "waterbodies":
-                    geometry_types = ['Polygon', 'MultiPolygon']
-                    # filter based on geometry types only
-                    filtered_features = [
-                        feature for feature in geojson_data.get('features', [])
-                        if feature['geometry']['type'] in geometry_types
-                    ]
-                # for everything else extract everything that can be found
-                else:
-                    filtered_features = [
-                        feature for feature in geojson_data.get('features', [])
-                    ]
-
-                # cast all property keys to lowercase (to avoid issues with case sensitivity for future notebooks)
-                filtered_features = [
-                    {
-                        k: {property_key.lower(): property_value for property_key, property_value in v.items()} if k == "properties" else v
-                        for k, v in feature.items()
-                    }
-                    for feature in filtered_features
-                ]
-                # create a new GeoJSON structure with filtered features
-                filtered_geojson_data = {
-                    "type": "FeatureCollection",
-                    "features": filtered_features
-                }
-
-                print(f"Total features after filtering {query_name} in the {year} year: {len(filtered_features)}")
-                print ("-" *30)
-                
-                # create new file 
-                if overwrite_original == False:
-                    geojson_file = os.path.join(self.output_dir, f"{query_name}_pre_{year}_filtered.geojson")
-                
-                # overwrite the original GeoJSON file with the filtered one
-                with open(geojson_file, 'w', encoding='utf-8') as f:
-                    json.dump(filtered_geojson_data, f, ensure_ascii=False, indent=4)
-
-                # write filenames to the list with intermediate geojsons
-                geojson_files.append(geojson_file)
-            
-            else:
-                print(f"Conversion to GeoJSON for {query_name} in the {year} year failed.")
+            input_file = os.path.join(self.output_dir, f"{query_name}_pre_{year}.json")
+
+            # check if the non-zero JSON files exist
+            if not (os.path.exists(input_file) and os.path.getsize(input_file) > 0):
+                print(f"Conversion to GeoPackage for {query_name} in the {year} year failed: {input_file} is missing or empty.")
                 print ("-" *30)
+                continue
+
+            # create new file 
+            gpkg_file = os.path.join(self.output_dir, f"{query_name}_pre_{year}.gpkg")
+            if overwrite_original == False:
+                gpkg_file = os.path.join(self.output_dir, f"{query_name}_pre_{year}_filtered.gpkg")
+
+            builder = OverpassGeometryBuilder(input_file)
+            feature_count = 0
+            with GPKGStreamWriter(gpkg_file, query_name) as writer:
+                for geometries, properties in builder.iter_batches():
+                    feature_count += len(geometries)
+                    geometry_types = shapely.get_type_id(geometries)
+                    wkbs = shapely.to_wkb(geometries)
+                    for geometry_type, wkb, feature_properties in zip(geometry_types, wkbs, properties):
+                        if not self.keep_feature(query_name, self.GEOMETRY_TYPES.get(geometry_type), feature_properties):
+                            continue
+                        # cast all property keys to lowercase (to avoid issues with case sensitivity for future notebooks)
+                        feature_properties = {property_key.lower(): property_value for property_key, property_value in feature_properties.items()}
+                        writer.write_geometry(ogr.CreateGeometryFromWkb(wkb), feature_properties)
+
+            print(f"Conversion to GeoPackage for {query_name} in the {year} year was successful.")
+            if self.verbose:
+                print(f"Total elements in {query_name} in the {year} year: {builder.element_count}")
+            print(f"Total features: {feature_count}")
+            print(f"Total features after filtering {query_name} in the {year} year: {writer.feature_count}")
+            print ("-" *30)
+
+            # write filenames to the list with intermediate files
+            gpkg_files.append(gpkg_file)
 
-        return geojson_files
+        return gpkg_files
     
 # for debugging
 if __name__ == "__main__":
@@ -288,6 +300,5 @@ if __name__ == "__main__":
     ow = OverpassWrapper(config, "data/osm", True, [year])
     queries = ow.overpass_query_builder(year, ow.bbox)
     intermediate_jsons = ow.fetch_osm_data(queries, year)
-    ow.convert_to_geojson(queries, year)
-    ow.filter_geometries(queries, year, False)
+    ow.convert_to_gpkg(queries, year, False)
     print("Done")
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from typing import Callable
+from rich import print
+
+class Node():
+    """
+    A step of the workflow with declared inputs and outputs.
+    Dependencies are the nodes producing the inputs of the node (matched by path) and the nodes named in deps.
+    """
+
+    def __init__(self, name:str, func:Callable, inputs:list=None, outputs:list=None, deps:list=None) -> None:
+        """
+        Initializes the node.
+
+        Args:
+            name (str): unique name of the node (e.g. 'enrich-lulc-2017')
+            func (Callable): function running the step, called with the results of all nodes (dict) and returning a JSON-serializable result
+            inputs (list): paths to the files or directories read by the step
+            outputs (list): paths to the files or directories written by the step (checked to resume a completed node)
+            deps (list): names of other nodes the step depends on without a declared file (optional)
+        """
+        self.name = name
+        self.func = func
+        self.inputs = [os.path.abspath(path) for path in inputs or []]
+        self.outputs = [os.path.abspath(path) for path in outputs or []]
+        self.deps = set(deps or [])
+
+class DAGRunner():
+    """
+    Runs the nodes of a workflow on a pool of workers as soon as all their dependencies are completed,
+    so that independent branches (e.g. fetching protected areas and OSM data) run concurrently and wall time is the critical path of the workflow.
+    Completed nodes are checkpointed, so a failed or interrupted workflow resumes from the nodes which are not completed.
+    Nodes run in threads: heavy steps spend their time in GDAL, subprocesses or their own process pools.
+    """
+
+    def __init__(self, checkpoint_path:str, max_workers:int=4, restart:bool=False) -> None:
+        """
+        Initializes the runner and loads the checkpoint of a previous run.
+
+        Args:
+            checkpoint_path (str): path to the JSON file with completed nodes
+            max_workers (int): maximum number of nodes running concurrently (default is 4)
+            restart (bool): ignore completed nodes of previous runs (default is False)
+        """
+        self.checkpoint_path = checkpoint_path
+        self.max_workers = max_workers
+        self.nodes = {}
+        self.results = {}
+        self.checkpoint = {}
+        if not restart and os.path.exists(checkpoint_path):
+            with open(checkpoint_path, 'r', encoding='utf-8') as f:
+                self.checkpoint = json.load(f)
+
+    def add(self, node:Node) -> Node:
+        """
+        Adds a node to the workflow.
+
+        Args:
+            node (Node): node to add
+
+        Returns:
+            Node: the added node
+        """
+        if node.name in self.nodes:
+            raise ValueError(f"Node {node.name} is already defined in the workflow.")
+        self.nodes[node.name] = node
+        return node
+
+    def dependencies(self) -> dict:
+        """
+        Resolves the dependencies of each node from explicit dependencies and from declared inputs and outputs.
+        An input depends on the node writing the same path or a parent directory of it.
+
+        Returns:
+            dict: names of the nodes each node depends on
+        """
+        producers = {path: node.name for node in self.nodes.values() for path in node.outputs}
+        dependencies = {}
+        for node in self.nodes.values():
+            deps = set(node.deps)
+            for path in node.inputs:
+                for output, producer in producers.items():
+                    if path == output or path.startswith(output + os.sep):
+                        deps.add(producer)
+            deps.discard(node.name)
+            unknown = deps - set(self.nodes)
+            if unknown:
+                raise ValueError(f"Node {node.name} depends on unknown nodes: {sorted(unknown)}")
+            dependencies[node.name] = deps
+        self.check_cycles(dependencies)
+        return dependencies
+
+    def check_cycles(self, dependencies:dict) -> None:
+        """
+        Raises an error if the dependencies contain a cycle.
+        """
+        remaining = {name: set(deps) for name, deps in dependencies.items()}
+        while remaining:
+            ready = [name for name, deps in remaining.items() if not deps]
+            if not ready:
+                raise ValueError(f"The workflow contains a cycle between nodes: {sorted(remaining)}")
+            for name in ready:
+                del remaining[name]
+            for deps in remaining.values():
+                deps.difference_update(ready)
+
+    def is_completed(self, name:str, dependencies:dict, rerun:set) -> bool:
+        """
+        Checks whether a node was completed by a previous run, its outputs still exist and none of its dependencies runs again.
+        """
+        if name not in self.checkpoint or dependencies[name] & rerun:
+            return False
+        return all(os.path.exists(path) for path in self.nodes[name].outputs)
+
+    def save_checkpoint(self) -> None:
+        """
+        Writes the completed nodes and their results to the checkpoint file.
+        """
+        os.makedirs(os.path.dirname(self.checkpoint_path) or '.', exist_ok=True)
+        temp_path = self.checkpoint_path + ".part"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.checkpoint, f, indent=2, default=str)
+        os.replace(temp_path, self.checkpoint_path)
+
+    def run(self) -> dict:
+        """
+        Runs the workflow.
+
+        Returns:
+            dict: results of all nodes
+        """
+        dependencies = self.dependencies()
+        pending = set(self.nodes)
+        completed, failed, rerun = set(), set(), set()
+        running = {}
+        start_time = time.time()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                # skip or submit the nodes whose dependencies are completed
+                for name in sorted(pending):
+                    deps = dependencies[name]
+                    if deps & failed:
+                        print(f"[yellow] Node {name} is not run, because its dependencies failed: {sorted(deps & failed)} [/yellow]")
+                        failed.add(name)
+                        pending.discard(name)
+                    elif deps <= completed:
+                        pending.discard(name)
+                        if self.is_completed(name, dependencies, rerun):
+                            print(f"[green] Node {name} was completed by a previous run, skipping... [/green]")
+                            self.results[name] = self.checkpoint[name]['result']
+                            completed.add(name)
+                            continue
+                        rerun.add(name)
+                        print(f"Running node {name}...")
+                        running[executor.submit(self.nodes[name].func, self.results)] = (name, time.time())
+                # skipped nodes can make other nodes ready
+                if not running:
+                    if pending and not any(dependencies[name] <= completed or dependencies[name] & failed for name in pending):
+                        raise RuntimeError(f"Nodes can't be scheduled: {sorted(pending)}")
+                    continue
+
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, node_start = running.pop(future)
+                    try:
+                        self.results[name] = future.result()
+                    except Exception as e:
+                        print(f"[bold red] Node {name} failed: {e} [/bold red]")
+                        failed.add(name)
+                        self.checkpoint.pop(name, None)
+                        self.save_checkpoint()
+                        continue
+                    completed.add(name)
+                    self.checkpoint[name] = {'result': self.results[name], 'outputs': self.nodes[name].outputs}
+                    self.save_checkpoint()
+                    print(f"[green] Node {name} completed in {time.time() - node_start:.1f} seconds [/green]")
+
+        print(f"Workflow finished in {time.time() - start_time:.1f} seconds")
+        if failed:
+            raise RuntimeError(f"Nodes of the workflow failed or were not run: {sorted(failed)}")
+        return self.results
@@ -0,0 +1,240 @@
+import os
+import numpy as np
+from osgeo import gdal
+from rich import print
+# local imports
+from utils import block_windows, create_tiled_raster
+from scheduler import run_per_year
+from stage_cache import StageCache
+from reclass import ReclassTable
+from protected_areas.pa_rasterizer import PARasterizer
+from protected_areas.update_land_impedance import UpdateLandImpedance
+
+class FusedPAPipeline():
+    """
+    This class combines the LULC and PA rasters, updates the impedance dataset and computes the affinity in a single block-wise pass for each year.
+    Every block is read once, goes through the sum of LULC and PA rasters, the reclassification (or the multiplier of protected areas) and the reciprocal of impedance,
+    and only the requested outputs are written (tiled and compressed on first write), without intermediate rasters and subprocesses.
+    """
+    # no data value of impedance and affinity datasets (Graphab requires a positive value)
+    IMPEDANCE_NODATA = 9999
+
+    def __init__(self, config:dict, working_dir:str, lulc_dir:str, pa_dir:str, use_yearly_pa_rasters:bool, affinity_dir:str,
+                 save_lulc_pa:bool=False, save_impedance:bool=True, save_affinity:bool=True, cache:StageCache=None) -> None:
+        """
+        Initialize the FusedPAPipeline class.
+
+        Args:
+            config (dict): The configuration dictionary.
+            working_dir (str): The working directory.
+            lulc_dir (str): The path to the LULC raster data directory.
+            pa_dir (str): The path to the PA raster data directory.
+            use_yearly_pa_rasters (bool): Use yearly PA rasters (or the raster with the years of protection if yearly rasters were not derived).
+            affinity_dir (str): The path to the directory of the affinity datasets.
+            save_lulc_pa (bool): Write the sum of LULC and PA rasters (default is False).
+            save_impedance (bool): Write the updated impedance datasets (default is True).
+            save_affinity (bool): Write the affinity datasets (default is True).
+            cache (StageCache): The cache of stages, to skip years whose inputs and parameters are unchanged (optional).
+        """
+        self.lulc_dir = lulc_dir
+        self.pa_dir = pa_dir
+        self.use_yearly_pa_rasters = use_yearly_pa_rasters
+        self.affinity_dir = affinity_dir
+        self.save_lulc_pa = save_lulc_pa
+        self.save_impedance = save_impedance
+        self.save_affinity = save_affinity
+        self.cache = cache
+
+        # reuse the configuration of impedance (directories, reclassification table and effect of protected areas)
+        self.uli = UpdateLandImpedance(config, working_dir)
+        self.lulc_pa_dir = self.uli.lulc_pa_dir
+        if save_lulc_pa:
+            os.makedirs(self.lulc_pa_dir, exist_ok=True)
+        if save_affinity:
+            os.makedirs(affinity_dir, exist_ok=True)
+
+        reclass_dict, has_decimal, self.data_type = self.uli.generate_impedance_reclass_dict(self.uli.impedance_reclass_table)
+        self.lut = self.uli.generate_impedance_lut(reclass_dict, has_decimal, self.IMPEDANCE_NODATA) if self.uli.lulc_reclass_table is True else None
+
+    def get_pa_source(self, year:int) -> tuple[str, bool]:
+        """
+        Finds the PA raster for the year.
+
+        Args:
+            year (int): The year stamp of LULC data.
+
+        Returns:
+            tuple: The path to the PA raster and whether it is the raster with the years of protection (to be thresholded by the year).
+        """
+        if not self.use_yearly_pa_rasters:
+            pa_file = os.path.join(self.pa_dir, "pa_multi_year.tif")
+        else:
+            pa_file = os.path.join(self.pa_dir, f"pa_{year}.tif")
+            year_raster = os.path.join(self.pa_dir, "pa_years.tif")
+            if not os.path.exists(pa_file) and os.path.exists(year_raster):
+                return year_raster, True
+        if not os.path.exists(pa_file):
+            raise FileNotFoundError(f"PA file for year {year} does not exist")
+        return pa_file, False
+
+    def get_impedance_file(self, year:int) -> str:
+        """
+        Finds the impedance dataset of the year to apply the multiplier of protected areas to.
+
+        Args:
+            year (int): The year stamp of LULC data.
+
+        Returns:
+            str: The name of the impedance dataset.
+        """
+        for impedance_file in self.uli.impedance_files:
+            base_name = os.path.splitext(impedance_file)[0]
+            if not base_name.endswith('_pa') and base_name.split('_')[-1] == str(year):
+                return impedance_file
+        raise FileNotFoundError(f"Impedance file for year {year} does not exist in {self.uli.impedance_dir}")
+
+    def compute_affinity(self, impedance:np.ndarray) -> np.ndarray:
+        """
+        Computes the affinity as the reciprocal of impedance, leaving no data and zero values unchanged.
+
+        Args:
+            impedance (np.ndarray): The impedance values.
+
+        Returns:
+            np.ndarray: The affinity values.
+        """
+        impedance = impedance.astype(np.float64)
+        keep = (impedance == self.IMPEDANCE_NODATA) | (impedance == 0)
+        return np.divide(1, impedance, out=impedance.copy(), where=~keep).astype(np.float32)
+
+    def process_year(self, lulc_file:str) -> dict:
+        """
+        Streams one LULC raster block by block through the sum with the PA raster, the update of impedance and the affinity.
+        If the cache is used, the year is skipped when its inputs, parameters and outputs are unchanged since the last run.
+
+        Args:
+            lulc_file (str): The name of the LULC raster in the LULC directory.
+
+        Returns:
+            dict: The paths to the written outputs.
+        """
+        year = os.path.splitext(lulc_file)[0].split('_')[-1]
+        lulc_path = os.path.join(self.lulc_dir, lulc_file)
+        pa_file, is_year_raster = self.get_pa_source(year)
+
+        # the initial impedance dataset is only needed for the multiplier of protected areas
+        impedance_path = None
+        impedance_name = f"impedance_lulc_{year}_pa.tif"
+        if self.lut is None:
+            impedance_file = self.get_impedance_file(year)
+            impedance_path = os.path.join(self.uli.impedance_dir, impedance_file)
+            base_name, extension = os.path.splitext(impedance_file)
+            impedance_name = f"{base_name}_pa{extension}"
+
+        # only the requested outputs are written
+        outputs = {}
+        if self.save_lulc_pa:
+            outputs['lulc_pa'] = (os.path.join(self.lulc_pa_dir, f"lulc_{year}_pa.tif"), gdal.GDT_Int32, PARasterizer.PA_NODATA)
+        if self.save_impedance:
+            outputs['impedance'] = (os.path.join(self.uli.impedance_dir, impedance_name), gdal.GetDataTypeByName(self.data_type), self.IMPEDANCE_NODATA)
+        if self.save_affinity:
+            outputs['affinity'] = (os.path.join(self.affinity_dir, impedance_name.replace('impedance', 'affinity')), gdal.GDT_Float32, self.IMPEDANCE_NODATA)
+
+        stream = lambda: self.stream_year(lulc_path, pa_file, is_year_raster, impedance_path, int(year), outputs)
+        if self.cache is None:
+            stream()
+        else:
+            inputs = [lulc_path, pa_file, self.uli.impedance_reclass_table] + ([impedance_path] if impedance_path else [])
+            params = {
+                'year': year,
+                'is_year_raster': is_year_raster,
+                'lulc_reclass_table': self.uli.lulc_reclass_table,
+                'pa_effect': self.uli.pa_effect,
+                'outputs': sorted(outputs)
+            }
+            self.cache.run(f"fused_pa:{lulc_path}", stream, inputs, [path for path, _, _ in outputs.values()], params, [FusedPAPipeline, ReclassTable])
+
+        return {key: path for key, (path, _, _) in outputs.items()}
+
+    def stream_year(self, lulc_path:str, pa_file:str, is_year_raster:bool, impedance_path:str, year:int, outputs:dict) -> None:
+        """
+        Reads the LULC, PA (and impedance) rasters block by block and writes the requested outputs.
+
+        Args:
+            lulc_path (str): The path to the LULC raster.
+            pa_file (str): The path to the PA raster.
+            is_year_raster (bool): Whether the PA raster contains the years of protection (thresholded by the year).
+            impedance_path (str): The path to the initial impedance dataset (None if the reclassification table is used).
+            year (int): The year stamp of LULC data.
+            outputs (dict): The outputs to write, mapping the name of the output to its path, GDAL data type and no data value.
+        """
+        lulc_ds = gdal.Open(lulc_path)
+        lulc_band = lulc_ds.GetRasterBand(1)
+        pa_ds = gdal.Open(pa_file)
+        pa_band = pa_ds.GetRasterBand(1)
+        impedance_ds, impedance_band = None, None
+        if impedance_path is not None:
+            impedance_ds = gdal.Open(impedance_path)
+            impedance_band = impedance_ds.GetRasterBand(1)
+
+        out_datasets = {key: create_tiled_raster(path, lulc_ds, data_type, nodata_value) for key, (path, data_type, nodata_value) in outputs.items()}
+
+        for xoff, yoff, xsize, ysize in block_windows(lulc_band):
+            # sum of LULC and PA rasters (LULC no data values are not masked, as with gdal_translate -a_nodata none)
+            pa = pa_band.ReadAsArray(xoff, yoff, xsize, ysize).astype(np.int32)
+            if is_year_raster:
+                pa = np.where((pa > 0) & (pa <= year), PARasterizer.PA_BURN_VALUE, 0).astype(np.int32)
+            lulc_pa = lulc_band.ReadAsArray(xoff, yoff, xsize, ysize).astype(np.int32) + pa
+            if 'lulc_pa' in out_datasets:
+                out_datasets['lulc_pa'].GetRasterBand(1).WriteArray(lulc_pa, xoff, yoff)
+
+            if not ('impedance' in out_datasets or 'affinity' in out_datasets):
+                continue
+            if self.lut is not None:
+                impedance = self.lut.apply(lulc_pa)
+            else:
+                # apply the multiplier to impedance where intersection with protected areas (LULC > 100) occurs
+                impedance = impedance_band.ReadAsArray(xoff, yoff, xsize, ysize)
+                impedance = np.where(lulc_pa > 100, impedance * self.uli.pa_effect, impedance)
+            if 'impedance' in out_datasets:
+                out_datasets['impedance'].GetRasterBand(1).WriteArray(impedance, xoff, yoff)
+            if 'affinity' in out_datasets:
+                out_datasets['affinity'].GetRasterBand(1).WriteArray(self.compute_affinity(impedance), xoff, yoff)
+
+        for key, out_ds in out_datasets.items():
+            out_ds.FlushCache()
+            print(f"[green] {key} raster has been written to: {outputs[key][0]} [green]")
+        out_datasets = None
+        lulc_ds = None
+        pa_ds = None
+        impedance_ds = None
+
+    def run(self, jobs:int=1) -> list[dict]:
+        """
+        Processes every LULC raster of the LULC directory.
+
+        Args:
+            jobs (int): The number of years processed concurrently (default is 1).
+
+        Returns:
+            list: The paths to the written outputs of each year.
+        """
+        lulc_files = sorted(f for f in os.listdir(self.lulc_dir) if f.endswith('.tif'))
+        # blocks are streamed, so the memory of a year doesn't depend on the size of the rasters
+        results = run_per_year(process_fused_year, lulc_files, (self,), jobs)
+        return list(results.values())
+
+def process_fused_year(lulc_file:str, pipeline:FusedPAPipeline) -> dict:
+    """
+    Processes one LULC raster with the fused pipeline (to be dispatched to a worker process by the year scheduler).
+
+    Args:
+        lulc_file (str): The name of the LULC raster in the LULC directory.
+        pipeline (FusedPAPipeline): The fused pipeline.
+
+    Returns:
+        dict: The paths to the written outputs.
+    """
+    result = pipeline.process_year(lulc_file)
+    print(f"[green] Fused processing of protected areas complete for file: {lulc_file} [green]")
+    return result
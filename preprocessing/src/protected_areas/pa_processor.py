@@ -1,24 +1,36 @@
 import os
 import json
 from datetime import datetime
+# local imports
+from geojson_stream import GeoJSONStreamWriter
 
 class PAProcessor:
     """
     This protected area (PA) processor class is used to convert the json responses from the Protected Planet API to a single GeoJSON file per country.
     """
-    def __init__(self, country:str) -> None:
+    def __init__(self, country:str, output_dir:str=None) -> None:
         """
         Initialize the PA_Processor class
 
         Args:
             country (str): The country name.
+            output_dir (str): The directory to stream the GeoJSON file to (optional). 
+                If specified, features are appended to the file as they are added instead of being kept in memory.
         """
         self.country = country
+        self.output_dir = output_dir
+        self.writer = None # opened on the first features to stream
         self.feature_collection = {
             "type": "FeatureCollection",
             "features": []
         }
 
+    def geojson_filepath(self, file_path:str) -> str:
+        """
+        Returns the path to the GeoJSON file of the country in a directory.
+        """
+        return os.path.join(file_path, f"{self.country}_protected_areas.geojson")
+
     def add_PA_to_feature_collection(self, protected_areas:list[dict], exclude_redundant_ids:bool=True) -> dict:
         """
         Adds protected areas from the API response to the feature collection of the class.
@@ -28,8 +40,9 @@ class PAProcessor:
             exclude_redundant_ids (bool): Exclude redundant IDs from the properties (default is True).
 
         Returns:
-            feature_collection: The feature collection with protected areas.
+            feature_collection: The feature collection with protected areas (only the features added by this call if streaming to a file).
         """
+        features = []
 
         # Counter for geometry print statements
         print_count = 0
@@ -97,9 +110,17 @@ class PAProcessor:
                     "year": date_str,
                 }
             }
-            # append the feature to the feature collection
-            self.feature_collection["features"].append(feature) 
+            features.append(feature)
+
+        if self.output_dir is not None:
+            # append the features to the GeoJSON file
+            if self.writer is None:
+                self.writer = GeoJSONStreamWriter(self.geojson_filepath(self.output_dir))
+            self.writer.write_features(features)
+            return {"type": "FeatureCollection", "features": features}
 
+        # append the features to the feature collection
+        self.feature_collection["features"].extend(features)
         return self.feature_collection
 
     def save_to_file(self, file_path:str) -> str:
@@ -107,17 +128,29 @@ class PAProcessor:
         Saves a country feature collection to a single GeoJSON file.
 
         Args:
-            file_path (str): The path to the file.
+            file_path (str): The path to the file (ignored if features are streamed to output_dir).
 
         Returns:
             geojson_filepath (str): The path to the saved GeoJSON file.
         """
         # define filename for GeoJSON file
-        geojson_filepath = os.path.join(file_path, f"{self.country}_protected_areas.geojson")
-        # convert GeoJSON data to a string
-        geojson_string = json.dumps(self.feature_collection, indent=4) 
-        # write GeoJSON string to a file
+        geojson_filepath = self.geojson_filepath(file_path)
+        if self.output_dir is not None:
+            # features have already been streamed to the file in output_dir, so we only need to close the collection
+            if self.writer is None:
+                self.writer = GeoJSONStreamWriter(self.geojson_filepath(self.output_dir)) # no protected areas were added
+            return self.writer.close()
+
+        # write GeoJSON data to a file (compact, to be read back quickly)
         with open(geojson_filepath, 'w') as f:
-            f.write(geojson_string)
+            json.dump(self.feature_collection, f, separators=(',', ':'))
         
-        return geojson_filepath
\ No newline at end of file
+        return geojson_filepath
+
+    def discard(self) -> None:
+        """
+        Removes the incomplete GeoJSON file of the country if features are streamed and fetching them failed.
+        """
+        if self.writer is not None:
+            self.writer.discard()
+            self.writer = None
\ No newline at end of file
@@ -1,6 +1,13 @@
 import os
+import json
+import time
+import shutil
 import requests
-import subprocess
+from email.utils import parsedate_to_datetime
+from datetime import datetime, timezone
+from requests.adapters import HTTPAdapter
+from concurrent.futures import ThreadPoolExecutor
+from osgeo import ogr
 from rich import print as rprint
 # local imports 
 from .pa_processor import PAProcessor
@@ -8,9 +15,10 @@ from .pa_processor import PAProcessor
 class PAProcessorWrapper:
     """
     This class retrieves and processes protected areas for multiple countries and utilizes the PA processor class to merge them into individual GeoJSON files for each country.
+    Pages of the API are fetched concurrently through a pooled session and checkpointed on disk, so that an interrupted country resumes from the pages already fetched.
     """
 
-    def __init__(self, countries:list[str], api_url:str, token:str, marine:str, output_dir:str) -> None:
+    def __init__(self, countries:list[str], api_url:str, token:str, marine:str, output_dir:str, max_workers:int=4, timeout:int=120) -> None:
         """
         Initialize the PA_Processor_Wrapper class.
 
@@ -20,68 +28,151 @@ class PAProcessorWrapper:
             token (str): The API token.
             marine (str): The marine area boolean value.
             output_dir (str): The path to the directory where the GeoJSON files will be saved.
+            max_workers (int): The number of pages fetched concurrently (default is 4).
+            timeout (int): The timeout of each request in seconds (default is 120).
         """
         self.api_url = api_url
         self.token = token
         self.marine = marine
         self.countries = countries
         self.output_dir = output_dir
-        self.processors = {country: PAProcessor(country) for country in countries}
+        self.max_workers = max_workers
+        self.timeout = timeout
+        self.checkpoint_dir = os.path.join(output_dir, "page_checkpoints")
+        # features of each country are streamed to its GeoJSON file as pages arrive
+        self.processors = {country: PAProcessor(country, output_dir) for country in countries}
+
+        # pooled session (connections to the API are reused between pages and countries)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def fetch_page(self, country:str, page:int, retry_limit:int=3, backoff:float=2.0) -> dict:
+        """
+        Fetches a page of protected areas for a country, or loads it from the page checkpoint if it was already fetched.
+        Server errors, connection errors and rate limiting (HTTP 429) are retried with exponential backoff, or after the delay requested by the Retry-After header.
+
+        Args:
+            country (str): The country code.
+            page (int): The page number.
+            retry_limit (int): The number of times to retry fetching the page if a server error occurs.
+            backoff (float): The initial delay between retries in seconds (doubled after each retry).
+
+        Returns:
+            dict: The response of the API.
+
+        Raises:
+            Exception: If the request is rejected (client error) or the page could not be fetched after retry_limit attempts.
+        """
+        checkpoint = os.path.join(self.checkpoint_dir, country, f"page_{page}.json")
+        if os.path.exists(checkpoint):
+            with open(checkpoint, 'r') as f:
+                return json.load(f)
+
+        url = self.api_url.format(country=country, token=self.token, marine=self.marine)
+        url += f"&page={page}"
+        for attempt in range(retry_limit + 1):
+            try:
+                response = self.session.get(url, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                response = None
+                rprint(f"[bold yellow] Request for {country} at page {page} failed: {e} [/bold yellow]")
+
+            #if the error is client side (except rate limiting), we should stop the loop
+            if response is not None and 400 <= response.status_code < 500 and response.status_code != 429:
+                raise Exception(f"Error ({response.status_code}):, {response.text}")
+            #if the response is successful, we should checkpoint the data
+            elif response is not None and response.status_code == 200:
+                data = response.json()
+                os.makedirs(os.path.dirname(checkpoint), exist_ok=True)
+                with open(checkpoint + ".tmp", 'w') as f:
+                    json.dump(data, f)
+                os.replace(checkpoint + ".tmp", checkpoint)
+                return data
+            #if it's a server side error, rate limiting (or no response), we should try this page again up to retry_limit times
+            if attempt < retry_limit:
+                time.sleep(self.retry_delay(response, backoff * 2 ** attempt))
+
+        # the country is failed rather than saved without the page
+        raise Exception(f"Failed to fetch data for {country} at page {page} after {retry_limit} attempts")
+
+    @staticmethod
+    def retry_delay(response:requests.Response, default:float) -> float:
+        """
+        Returns the delay before retrying a request, as requested by the Retry-After header of rate limited responses (in seconds or as a date).
+
+        Args:
+            response (requests.Response): The response of the failed request (None if there was no response).
+            default (float): The delay if the response doesn't request one (backoff delay).
+
+        Returns:
+            float: The delay in seconds.
+        """
+        retry_after = response.headers.get("Retry-After") if response is not None and response.status_code == 429 else None
+        if retry_after is None:
+            return default
+        if retry_after.strip().isdigit():
+            return float(retry_after)
+        try:
+            return max((parsedate_to_datetime(retry_after) - datetime.now(timezone.utc)).total_seconds(), 0)
+        except (TypeError, ValueError):
+            return default
 
     def process_all_countries(self, skip_fetch:bool, retry_limit:int=3) -> None:
         """
         Fetches all PAs for each country and processes them into a single GeoJSON file.
+        Pages are fetched speculatively in windows of max_workers pages and processed in order until an empty page is returned.
+        If a page can't be fetched, the country fails instead of being saved without the page (fetched pages are kept in page checkpoints to resume).
 
         Args:
             skip_fetch (bool): A boolean value to skip fetching the PAs if they have already been fetched
             retry_limit (int): The number of times to retry fetching the data if a server error occurs.
         """
        
-        for country in self.countries:
-            protected_area_data = []
-            if skip_fetch:
-                # check if the GeoJSON file already exists
-                geojson_file = os.path.join(self.output_dir, f"{country}_protected_areas.geojson")
-                if os.path.exists(os.path.join(self.output_dir, geojson_file)):
-                    print(f"GeoJSON file already exists for {country}, therefore skipping fetch")
-                    #remove the processor for the country
-                    del self.processors[country]
-                    continue
-
-            # else we fetch the PA data for the country until we get an empty response
-            page = 0
-            page_logs = {}
-            while True:
-                url = self.api_url.format(country=country, token=self.token, marine=self.marine)
-                url += f"&page={page}"
-                response = requests.get(url)
-                #if the error is client side, we should stop the loop
-                if response.status_code >= 400 and response.status_code < 500:
-                    raise Exception(f"Error ({response.status_code}):, {response.text}")
-                #if it's a server side error, we should try this page again up to retry_limit times
-                elif response.status_code >= 500:
-                    if page_logs[page] > retry_limit:
-                        rprint(f"[bold red] Failed to fetch data for {country} at page {page} after 3 attempts [/bold red]")
-                        rprint(f"[bold yellow] Skipping to next page [/bold yellow]")
-                        page += 1
-                        continue
-                
-                #if the response is successful, we should process the data
-                elif response.status_code == 200:
-                    data = response.json()
-                    protected_areas = data["protected_areas"]
-                    if len(protected_areas) == 0:
-                        print(f"No protected areas found for {country}")
-                        break # exit the loop if no protected areas are found
-                    else:
-                        protected_area_data.append(data)
-                        page += 1
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for country in self.countries:
+                if skip_fetch:
+                    # check if the GeoJSON file already exists
+                    geojson_file = os.path.join(self.output_dir, f"{country}_protected_areas.geojson")
+                    if os.path.exists(os.path.join(self.output_dir, geojson_file)):
+                        print(f"GeoJSON file already exists for {country}, therefore skipping fetch")
+                        #remove the processor for the country
+                        del self.processors[country]
                         continue
-                #TODO What should be done if we get any other codes?
 
-            # combine all the protected areas into a single feature collection / GeoJSON
-            for data in protected_area_data:
-                self.processors[country].add_PA_to_feature_collection(data["protected_areas"]) 
+                # else we fetch the PA data for the country until we get an empty response
+                try:
+                    page = 0
+                    last_page_reached = False
+                    while not last_page_reached:
+                        window = range(page, page + self.max_workers)
+                        futures = [executor.submit(self.fetch_page, country, p, retry_limit) for p in window]
+                        for p, future in zip(window, futures):
+                            if last_page_reached:
+                                continue # discard pages fetched speculatively beyond the last page (even if they failed)
+                            data = future.result()
+                            protected_areas = data["protected_areas"]
+                            if len(protected_areas) == 0:
+                                print(f"No protected areas found for {country}")
+                                last_page_reached = True # exit the loop if no protected areas are found
+                            else:
+                                # combine all the protected areas into a single feature collection / GeoJSON
+                                self.processors[country].add_PA_to_feature_collection(protected_areas)
+                        page += self.max_workers
+                except Exception:
+                    # the incomplete GeoJSON file of the country is removed before the error is raised
+                    self.processors[country].discard()
+                    raise
+
+    def remove_page_checkpoints(self, country:str) -> None:
+        """
+        Removes the page checkpoints of a country once its GeoJSON file has been saved.
+
+        Args:
+            country (str): The country code.
+        """
+        shutil.rmtree(os.path.join(self.checkpoint_dir, country), ignore_errors=True)
 
     def save_all_country_geoJSON(self) -> list[str]:
         """
@@ -96,12 +187,14 @@ class PAProcessorWrapper:
             pa_processor = self.processors.get(country, None)
             if pa_processor is not None:
                 geojson_filepaths.append(pa_processor.save_to_file(self.output_dir))
+                self.remove_page_checkpoints(country)
         return geojson_filepaths
     
 
     def merge_geojsons_to_geopackage(self, geojson_filepaths:list[str], output_file:str) -> str:
         """
         Merges all GeoJSON files into a single GeoPackage file with different layers for each country.
+        All layers are copied in-process within a single transaction and spatial indexes are built once at the end.
 
         Args:
             geojson_filepaths (list): A list of GeoJSON file paths.
@@ -116,13 +209,29 @@ class PAProcessorWrapper:
         if os.path.exists(gpkg):
             os.remove(gpkg)
 
-       # loop through the GeoJSON files and convert them to a geopackage
+        out_ds = ogr.GetDriverByName("GPKG").CreateDataSource(gpkg)
+        out_ds.StartTransaction()
+        layer_names = []
+        # loop through the GeoJSON files and copy them to the geopackage
         for geojson_file in geojson_filepaths:
             # writes layer name as the first name from geojson files
             layer_name = os.path.splitext(os.path.basename(geojson_file))[0]
-            # use ogr2ogr to convert GeoJSON to GeoPackage
-            subprocess.run([
-                "ogr2ogr", "-f", "GPKG", "-append", "-nln", layer_name, gpkg, geojson_file
-            ]) 
+            src_ds = ogr.Open(geojson_file)
+            if src_ds is None:
+                rprint(f"[bold red] Failed to open {geojson_file}, skipping... [/bold red]")
+                continue
+            # spatial index is built once all features are written
+            out_ds.CopyLayer(src_ds.GetLayer(0), layer_name, ["SPATIAL_INDEX=NO"])
+            layer_names.append(layer_name)
+            src_ds = None
+        out_ds.CommitTransaction()
+
+        # build spatial indexes
+        for layer_name in layer_names:
+            geom_column = out_ds.GetLayerByName(layer_name).GetGeometryColumn()
+            if geom_column:
+                result = out_ds.ExecuteSQL(f"SELECT CreateSpatialIndex('{layer_name}', '{geom_column}')")
+                out_ds.ReleaseResultSet(result)
+        out_ds = None
 
-        return gpkg
\ No newline at end of file
+        return gpkg
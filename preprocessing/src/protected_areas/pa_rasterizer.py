@@ -7,12 +7,17 @@ from osgeo import gdal
 from rich import print as rprint
 # local imports 
 from raster_metadata import RasterMetadata
+from utils import block_windows, create_tiled_raster
 
 
 class PARasterizer:
     """
     This class is responsible for filtering protected areas based on the year of establishment and rasterizing them.
     """
+    # no data value of the rasterized protected areas (0 must stay a valid value for the raster calculator)
+    PA_NODATA = -2147483647
+    # value burnt into the pixels of protected areas (added to LULC codes)
+    PA_BURN_VALUE = 100
 
     def __init__(self, gpkg_filepath:str, input_dir:str, case_study:str, output_dir:str) -> None:
         """
@@ -228,4 +233,143 @@ class PARasterizer:
             # remove intermediate GeoPackage files if keep_intermediate_gpkg is False
             if not keep_intermediate_gpkg:
                 os.remove(reprojected_pa)
-                rprint(f"[yellow] Intermediate GeoPackage {reprojected_pa} has been removed. [/yellow]")
\ No newline at end of file
+                rprint(f"[yellow] Intermediate GeoPackage {reprojected_pa} has been removed. [/yellow]")
+
+    @staticmethod
+    def effective_protection_year(dates:pd.Series) -> pd.Series:
+        """
+        Converts the dates of establishment into the first year stamp of LULC data in which the protected areas are included.
+        It is consistent with the year filter (date <= 1st of January of the year stamp): protected areas established on the 1st of January
+        are included from the same year, the other ones from the following year.
+
+        Args:
+            dates (pd.Series): The dates of establishment of protected areas.
+
+        Returns:
+            pd.Series: The effective years of protection (0 where the date is missing).
+        """
+        dates = pd.to_datetime(dates, errors='coerce')
+        first_day = (dates.dt.month == 1) & (dates.dt.day == 1) & (dates.dt.normalize() == dates)
+        years = dates.dt.year + (~first_day).astype(int)
+        return years.fillna(0).astype(np.int32)
+
+    def rasterize_pa_years(self, lulc_metadata:RasterMetadata, target_crs:str, output_filepath:str, keep_intermediate_gpkg:bool=False) -> str:
+        """
+        Reprojects the protected areas once and burns their effective year of protection into a single raster.
+        Where protected areas overlap, the earliest year is kept, so every yearly raster can be derived with a threshold (see derive_yearly_pa_rasters).
+
+        Args:
+            lulc_metadata (RasterMetadata): The metadata of the LULC raster dataset.
+            target_crs (str): The target CRS to reproject the protected areas.
+            output_filepath (str): The path to the output raster file with the years of protection.
+            keep_intermediate_gpkg (bool): Keep the intermediate GeoPackage file (default is False).
+
+        Returns:
+            str: The path to the raster with the years of protection.
+        """
+        subsets = []
+        for layer, gdf in self.gdfs.items():
+            print(f"Processing {layer}...")
+
+            # check if gdf is empty or the 'year' column is missing (neigbouring countries without protected areas in bounding box)
+            if gdf.empty:
+                print(f"Skipping {layer} because it is empty.")
+                continue
+            if 'year' not in gdf.columns:
+                print(f"Skipping {layer} because the 'year' column is missing.")
+                continue
+
+            subset = gdf[['geometry']].copy()
+            subset['pa_year'] = self.effective_protection_year(gdf['year'])
+            # protected areas without date of establishment are never included by the year filter
+            subsets.append(subset[subset['pa_year'] > 0].to_crs(target_crs))
+
+        if not subsets:
+            raise ValueError("No protected areas with the year of establishment to rasterize.")
+
+        # gdal.Rasterize needs a vector dataset, so the reprojected protected areas are written once for all years
+        vector_filepath = os.path.join(self.output_dir, "pa_years.gpkg")
+        merged_gdf = gpd.GeoDataFrame(pd.concat(subsets, ignore_index=True), crs=subsets[0].crs)
+        merged_gdf.to_file(vector_filepath, layer="pa_years", driver='GPKG')
+        print(f"Reprojected protected areas are written to:", vector_filepath)
+
+        # burn the latest years first, so that the earliest year overwrites them where protected areas overlap
+        options = gdal.RasterizeOptions(
+            format='GTiff',
+            outputType=gdal.GDT_Int32,
+            creationOptions=['TILED=YES', 'COMPRESS=LZW'],
+            outputBounds=[float(lulc_metadata.x_min), float(lulc_metadata.y_min), float(lulc_metadata.x_max), float(lulc_metadata.y_max)],
+            xRes=abs(float(lulc_metadata.xres)),
+            yRes=abs(float(lulc_metadata.yres)),
+            outputSRS="EPSG:" + str(lulc_metadata.crs_info['epsg']),
+            initValues=[0],
+            noData=self.PA_NODATA,
+            attribute='pa_year',
+            SQLStatement='SELECT * FROM pa_years ORDER BY pa_year DESC'
+        )
+        out_ds = gdal.Rasterize(output_filepath, vector_filepath, options=options)
+        if out_ds is None:
+            raise RuntimeError(f"Rasterizing of protected areas failed for {vector_filepath}")
+        out_ds = None
+        print("Years of protection have been rasterized to:", output_filepath)
+
+        if not keep_intermediate_gpkg:
+            os.remove(vector_filepath)
+            rprint(f"[yellow] Intermediate GeoPackage {vector_filepath} has been removed. [/yellow]")
+
+        return output_filepath
+
+    def derive_yearly_pa_rasters(self, year_raster:str, year_stamps:list=None) -> list[str]:
+        """
+        Derives the raster of protected areas for each year stamp of LULC data from the raster with the years of protection,
+        reading it block by block (the same output as rasterizing the protected areas filtered by the year of establishment).
+
+        Args:
+            year_raster (str): The path to the raster with the years of protection.
+            year_stamps (list): The year stamps to derive the rasters for (default is the year stamps of LULC data).
+
+        Returns:
+            list: The paths to the yearly rasters of protected areas.
+        """
+        year_stamps = year_stamps if year_stamps is not None else self.year_stamps
+        year_ds = gdal.Open(year_raster)
+        year_band = year_ds.GetRasterBand(1)
+
+        outputs = {}
+        for year_stamp in year_stamps:
+            output_path = os.path.join(self.output_dir, f"pa_{year_stamp}.tif")
+            outputs[int(year_stamp)] = (output_path, create_tiled_raster(output_path, year_ds, gdal.GDT_Int32, self.PA_NODATA))
+
+        for xoff, yoff, xsize, ysize in block_windows(year_band):
+            years = year_band.ReadAsArray(xoff, yoff, xsize, ysize)
+            protected = years > 0
+            for year, (_, out_ds) in outputs.items():
+                block = np.where(protected & (years <= year), self.PA_BURN_VALUE, 0).astype(np.int32)
+                out_ds.GetRasterBand(1).WriteArray(block, xoff, yoff)
+
+        for year, (output_path, out_ds) in outputs.items():
+            out_ds.FlushCache()
+            print(f"Protected areas for year {year} have been derived to: {output_path}")
+        outputs_paths = [output_path for output_path, _ in outputs.values()]
+        outputs = None
+        year_ds = None
+
+        return outputs_paths
+
+    def rasterize_pa_incremental(self, lulc_metadata:RasterMetadata, write_yearly_rasters:bool=True, keep_intermediate_gpkg:bool=False) -> str:
+        """
+        Rasterizes the protected areas once with their years of protection instead of reprojecting and rasterizing a subset for each year stamp.
+
+        Args:
+            lulc_metadata (RasterMetadata): The metadata of the LULC raster dataset.
+            write_yearly_rasters (bool): Derive the raster of protected areas for each year stamp (default is True).
+            keep_intermediate_gpkg (bool): Keep the intermediate GeoPackage file (default is False).
+
+        Returns:
+            str: The path to the raster with the years of protection.
+        """
+        year_raster = os.path.join(self.output_dir, "pa_years.tif")
+        self.rasterize_pa_years(lulc_metadata, lulc_metadata.crs_info["epsg"], year_raster, keep_intermediate_gpkg)
+        if write_yearly_rasters:
+            self.derive_yearly_pa_rasters(year_raster)
+        return year_raster
@@ -5,6 +5,8 @@ import numpy as np
 import os
 import subprocess
 import pandas as pd
+# local imports
+from reclass import ReclassTable
 
 class UpdateLandImpedance():
     """
@@ -68,28 +70,9 @@ class UpdateLandImpedance():
                 output_filename = "impedance_" + tiff_file
                 output_raster_path = os.path.join(self.impedance_dir, output_filename)
 
-                # call function and capture data_type for compression - Float32 or Int32
-                data_type = self.reclassify_raster(input_raster_path, output_raster_path, self.impedance_reclass_table)
+                # rasters are reclassified block by block and the compressed output is written directly, so there is nothing to translate afterwards
+                data_type = self.reclassify_raster_blockwise(input_raster_path, output_raster_path, self.impedance_reclass_table)
                 print ("Data type used to reclassify LULC as impedance is",data_type)
-
-                # compression using 9999 as nodata
-                compressed_raster_path = os.path.splitext(output_raster_path)[0] + '_compr.tif'
-                print("Path to compressed raster is:", compressed_raster_path)
-                subprocess.run(['gdal_translate', output_raster_path, compressed_raster_path,'-a_nodata', '9999', '-ot', data_type, '-co', 'COMPRESS=LZW'])
-
-                # we should rename compressed file in the same way as the original GeoTIFF
-                '''
-                # split the path into the base name and extension
-                base_name, extension = os.path.splitext(output_raster_path)
-                # add the '_pa' suffix to the base name
-                pa_output_raster_path = f"{base_name}_pa{extension}"
-                '''
-            
-                # as soon as gdal_translate doesn't support rewriting, we should delete non-compressed GeoTIFFs...
-                os.remove(output_raster_path)
-            
-                os.rename(compressed_raster_path, output_raster_path)
-
                 print("Reclassification complete for:", input_raster_path + "\n------------------------------------")
 
         else:
@@ -231,76 +214,45 @@ class UpdateLandImpedance():
         return reclass_dict , has_decimal , data_type
 
 
-    def reclassify_raster(self, input_raster:str, output_raster:str, reclass_table:str) -> str:
+    def generate_impedance_lut(self, reclass_dict:dict, has_decimal:bool, nodata_value:float=9999) -> ReclassTable:
         """
-        Reclassifies a raster based on a reclassification table.
+        Compiles the reclassification dictionary into a lookup table indexed by LULC code, so that reclassification is a single NumPy gather.
+        LULC codes which are not in the reclassification table (as well as no data codes) are mapped to the no data value.
+
+        Args:
+            reclass_dict (dict): The reclassification dictionary (LULC code -> impedance).
+            has_decimal (bool): Whether the impedance values are decimal.
+            nodata_value (float): The value assigned to unmapped LULC codes (default is 9999).
+
+        Returns:
+            ReclassTable: The compiled reclassification table.
+        """
+        # no data codes are covered by the fill value, so they don't need to stretch the lookup array
+        return ReclassTable.from_dict(reclass_dict, nodata_value, np.float64 if has_decimal else np.int64, skip_codes={-2147483647, -32768})
+
+    def reclassify_raster_blockwise(self, input_raster:str, output_raster:str, reclass_table:str, nodata_value:float=9999) -> str:
+        """
+        Reclassifies a raster based on a reclassification table, streaming the raster in its native block windows. 
+        Peak memory is bounded by one block and the output is written tiled and compressed.
 
         Args:
             input_raster (str): The path to the input raster.
             output_raster (str): The path to the output raster.
             reclass_table (str): The path to the reclassification table.
+            nodata_value (float): The no data value of the output raster (default is 9999).
 
         Returns:
             str: The data type of the output raster.
         """
-        # read the reclassification table
-        reclass_dict = {}
-        # map lulc with impedance values from the reclassification table
-        reclass_dict,has_decimal,data_type = self.generate_impedance_reclass_dict(reclass_table)
-        print ("Mapping dictionary used to classify impedance is:", reclass_dict)
-        
-        # open input raster
-        dataset = gdal.Open(input_raster)
-        if dataset is None:
-            print("Could not open input raster.")
-            return
-
-        # get raster info
-        cols = dataset.RasterXSize
-        rows = dataset.RasterYSize
+        reclass_dict, has_decimal, data_type = self.generate_impedance_reclass_dict(reclass_table)
+        lut = self.generate_impedance_lut(reclass_dict, has_decimal, nodata_value)
+        print(f"Lookup table used to classify impedance covers LULC codes from {lut.codes[0]} to {lut.codes[-1]}")
 
         print(f"Output raster path: {output_raster}")
-        
-        # initialize output raster in edit mode
-        driver = gdal.GetDriverByName("GTiff")
-       
         try:
-            if has_decimal:
-                output_dataset = driver.Create(output_raster, cols, rows, 1, gdal.GDT_Float32)
-            else:
-                output_dataset = driver.Create(output_raster, cols, rows, 1, gdal.GDT_Int32)
+            lut.apply_raster(input_raster, output_raster, gdal.GetDataTypeByName(data_type))
         except RuntimeError as e:
-            print(f"Error during raster creation: {e}")
+            print(f"Could not open input raster: {e}")
             return
-        #TODO - to add condition on Int32 if integer values
-        output_dataset.SetProjection(dataset.GetProjection())
-        output_dataset.SetGeoTransform(dataset.GetGeoTransform())
-
-        # reclassify each pixel value
-        input_band = dataset.GetRasterBand(1)
-        output_band = output_dataset.GetRasterBand(1)
-        # read the raster as a NumPy array
-        input_data = input_band.ReadAsArray()
-
-        if input_data is None:
-            print("Could not read input raster.")
-            return
-        elif reclass_dict is None:
-            print("Reclassification dictionary is empty.")
-            return
-        # apply reclassification using dictionary mapping
-        output_data = np.vectorize(reclass_dict.get)(input_data)
-        output_band.WriteArray(output_data)
-        # flush the cache to save the output raster
-        output_band.FlushCache()
-        output_dataset.FlushCache()
 
-        '''FOR CHECKS
-        print (f"input_data_shape is': {input_data.shape}")
-        print (f"output_data_shape is': {output_data.shape}")
-        '''
-        # close datasets
-        dataset = None
-        output_dataset = None
-
-        return data_type
\ No newline at end of file
+        return data_type
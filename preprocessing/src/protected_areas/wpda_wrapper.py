@@ -8,7 +8,9 @@ from protected_areas.pa_rasterizer import PARasterizer
 from protected_areas.update_land_impedance import UpdateLandImpedance
 from protected_areas.landscape_affinity_estimator import LandscapeAffinityEstimator
 from protected_areas.lulc_pa_raster_sum import LulcPaRasterSum
+from protected_areas.fused_pa_pipeline import FusedPAPipeline
 from utils import load_yaml
+from stage_cache import StageCache
 
 
 class WDPAWrapper():
@@ -54,7 +56,7 @@ class WDPAWrapper():
         lulc_country_codes = set().union(*dict(lulc_ccp.fetch_lulc_country_codes(self.pa_output_dir)).values())
         return lulc_country_codes
     
-    def protected_area_to_merged_geopackage(self, lulc_country_codes:dict, output_file:str, skip_fetch:bool=False) -> str:
+    def protected_area_to_merged_geopackage(self, lulc_country_codes:dict, output_file:str, skip_fetch:bool=False, fetch_workers:int=4) -> str:
         """
         For each unique country code, fetch and process the protected areas and merge them into a single GeoPackage file.
         API used fetches most up to date protected areas.
@@ -63,6 +65,7 @@ class WDPAWrapper():
             lulc_country_codes (dict): A dictionary of unique country codes.
             output_file (str): The name of the output GeoPackage file.
             skip_fetch (bool): A boolean value to skip fetching the PAs for countries that have an existing GeoJSON file.
+            fetch_workers (int): The number of pages of the API fetched concurrently.
         
         Returns:
             str: The path to the merged GeoPackage file.
@@ -79,7 +82,8 @@ class WDPAWrapper():
             self.config['api_url'],
             self.config['token'],
             self.config['marine'],
-            self.pa_geojson_dir
+            self.pa_geojson_dir,
+            max_workers=fetch_workers
         )
         # if skip_fetch:
         #     geojson_filepaths = [os.path.join(self.pa_geojson_dir, file) for file in os.listdir(self.pa_geojson_dir)]
@@ -87,14 +91,14 @@ class WDPAWrapper():
         Pa_processor.process_all_countries(skip_fetch)
         geojson_filepaths = Pa_processor.save_all_country_geoJSON()
         if not geojson_filepaths:
-            geojson_filepaths = [os.path.join(self.pa_geojson_dir, file) for file in os.listdir(self.pa_geojson_dir)]
+            geojson_filepaths = [os.path.join(self.pa_geojson_dir, file) for file in os.listdir(self.pa_geojson_dir) if file.endswith('.geojson')]
 
         # merge all the GeoJSON files into a single GeoPackage file
         gpkg = Pa_processor.merge_geojsons_to_geopackage(geojson_filepaths, output_file)
         # print(f"GeoPackage file created: {gpkg}")
         return gpkg
     
-    def rasterize_protected_areas(self, merged_gpkg:str, lulc_dir:str, pa_to_yearly_rasters:bool) -> None:
+    def rasterize_protected_areas(self, merged_gpkg:str, lulc_dir:str, pa_to_yearly_rasters:bool, year_raster:bool=False, write_yearly_rasters:bool=True) -> None:
         """
         Rasterize the protected areas by year of establishment.
 
@@ -102,6 +106,8 @@ class WDPAWrapper():
             merged_gpkg (str): The file name to the merged GeoPackage file.
             lulc_dir (str): The path to the directory containing the LULC raster data.
             pa_to_yearly_rasters (bool): Rasterize the protected areas by year of establishment
+            year_raster (bool): Rasterize the years of protection once and derive the yearly rasters from it (only used with pa_to_yearly_rasters)
+            write_yearly_rasters (bool): Derive the yearly rasters from the raster with the years of protection (only used with year_raster)
         Returns:
             None
         """
@@ -112,6 +118,9 @@ class WDPAWrapper():
         case_study = self.config['case_study_dir'].split('/')[-1]
 
         rp = PARasterizer(merged_gpkg, lulc_dir, case_study, raster_output_dir)
+        if pa_to_yearly_rasters and year_raster:
+            rp.rasterize_pa_incremental(rp.lulc_metadata, write_yearly_rasters, keep_intermediate_gpkg=False)
+            return
         rp.reproject_pa_data(rp.lulc_metadata.crs_info["epsg"],filter_by_year=pa_to_yearly_rasters)
         rp.rasterize_pa_geopackage(rp.lulc_metadata, pa_to_yearly_rasters, keep_intermediate_gpkg=False)
 
@@ -151,6 +160,23 @@ class WDPAWrapper():
         lae = LandscapeAffinityEstimator(impedance_dir, affinity_dir)
         lae.compute_affinity(os.listdir(impedance_dir))
 
+    def process_pa_rasters_fused(self, lulc_dir:str, use_yearly_pa_rasters:bool, affinity_dir:str, save_lulc_pa:bool=False, jobs:int=1, use_cache:bool=False) -> list[dict]:
+        """
+        Sum the LULC and PA raster data, reclassify the raster data with impedance values and compute the affinity in a single block-wise pass for each year.
+
+        Args:
+            lulc_dir (str): The path to the directory containing the LULC raster data.
+            use_yearly_pa_rasters (bool): Use yearly PA rasters
+            affinity_dir (str): The path to the directory where the affinity data will be saved.
+            save_lulc_pa (bool): Save the sum of LULC and PA rasters
+            jobs (int): The number of years processed concurrently
+            use_cache (bool): Skip years whose inputs and parameters are unchanged since the last run
+        Returns:
+            list: The paths to the written outputs of each year.
+        """
+        cache = StageCache(os.path.join(os.path.dirname(self.pa_output_dir), "stage_cache")) if use_cache else None
+        fpp = FusedPAPipeline(self.config, self.working_dir, lulc_dir, os.path.join(self.pa_output_dir, "pa_rasters"), use_yearly_pa_rasters, affinity_dir, save_lulc_pa=save_lulc_pa, cache=cache)
+        return fpp.run(jobs)
 
     def reclassify_raster_with_impedance(self) -> None:
         """
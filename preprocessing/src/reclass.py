@@ -0,0 +1,125 @@
+from osgeo import gdal
+import numpy as np
+import math
+# local imports
+from utils import block_windows, create_tiled_raster
+
+# errors of GDAL (e.g. a raster which can't be opened) are raised as RuntimeError
+gdal.UseExceptions()
+
+class ReclassTable():
+    """
+    Maps codes of a raster (e.g. LULC codes) to values (e.g. impedance) with NumPy instead of Python dictionaries.
+    Compact code ranges are compiled into a dense lookup array (a single gather per array),
+    sparse codes are kept as sorted keys and looked up with np.searchsorted.
+    Codes which are not in the table are mapped to the no data value.
+    """
+    # largest range of codes compiled into a dense lookup array
+    MAX_DENSE_SIZE = 2**22
+
+    def __init__(self, codes:np.ndarray, values:np.ndarray, nodata_value:float, dtype:np.dtype=None) -> None:
+        """
+        Compiles the table from codes and corresponding values.
+
+        Args:
+            codes (np.ndarray): integer codes
+            values (np.ndarray): values corresponding to the codes (NaN values are mapped to the no data value)
+            nodata_value (float): value assigned to codes which are not in the table
+            dtype (np.dtype): data type of the output values (default is the data type of values)
+        """
+        codes = np.asarray(codes, dtype=np.int64)
+        values = np.asarray(values, dtype=dtype)
+        if codes.size == 0:
+            raise ValueError("Reclassification table is empty.")
+        if np.issubdtype(values.dtype, np.floating):
+            values = np.where(np.isnan(values), nodata_value, values)
+        self.nodata_value = nodata_value
+        self.dtype = values.dtype
+
+        # sort the codes (the last value wins for duplicated codes, like in a dictionary)
+        order = np.argsort(codes, kind='stable')
+        codes, values = codes[order], values[order]
+        last = np.append(codes[1:] != codes[:-1], True)
+        self.codes, self.values = codes[last], values[last]
+
+        self.offset = int(self.codes[0])
+        span = int(self.codes[-1]) - self.offset + 1
+        if span <= self.MAX_DENSE_SIZE:
+            self.lut = np.full(span, nodata_value, dtype=self.dtype)
+            self.lut[self.codes - self.offset] = self.values
+        else:
+            self.lut = None # sparse codes, use sorted keys
+
+    @classmethod
+    def from_dict(cls, mapping:dict, nodata_value:float, dtype:np.dtype=None, skip_codes:set=None) -> 'ReclassTable':
+        """
+        Compiles the table from a dictionary (code -> value).
+
+        Args:
+            mapping (dict): dictionary mapping codes to values (NaN codes are ignored)
+            nodata_value (float): value assigned to codes which are not in the table
+            dtype (np.dtype): data type of the output values
+            skip_codes (set): codes to leave out of the table, e.g. no data codes which would stretch the lookup array (optional)
+
+        Returns:
+            ReclassTable: compiled table
+        """
+        skip_codes = skip_codes or set()
+        items = [(int(code), value) for code, value in mapping.items()
+                 if not (isinstance(code, float) and math.isnan(code)) and int(code) not in skip_codes]
+        codes = [code for code, _ in items]
+        values = [nodata_value if value is None else value for _, value in items]
+        return cls(codes, values, nodata_value, dtype)
+
+    def apply(self, array:np.ndarray) -> np.ndarray:
+        """
+        Reclassifies an array of codes.
+
+        Args:
+            array (np.ndarray): array of codes
+
+        Returns:
+            np.ndarray: array of values (no data value where codes are not in the table)
+        """
+        array = np.asarray(array).astype(np.int64, copy=False)
+        output = np.full(array.shape, self.nodata_value, dtype=self.dtype)
+        if self.lut is not None:
+            index = array - self.offset
+            in_table = (index >= 0) & (index < len(self.lut))
+            output[in_table] = self.lut[index[in_table]]
+        else:
+            index = np.searchsorted(self.codes, array)
+            index[index == len(self.codes)] = 0
+            in_table = self.codes[index] == array
+            output[in_table] = self.values[index[in_table]]
+        return output
+
+    def apply_raster(self, input_raster:str, output_raster:str, data_type:int, band:int=1) -> str:
+        """
+        Reclassifies a raster block by block and writes a tiled, compressed output (peak memory is bounded by one block).
+
+        Args:
+            input_raster (str): path to the input raster
+            output_raster (str): path to the output raster
+            data_type (int): GDAL data type of the output raster (e.g. gdal.GDT_Int32)
+            band (int): band of the input raster to reclassify (default is 1)
+
+        Returns:
+            str: path to the output raster
+        """
+        # gdal.Open raises RuntimeError if the raster can't be opened
+        dataset = gdal.Open(input_raster)
+        input_band = dataset.GetRasterBand(band)
+
+        output_dataset = create_tiled_raster(output_raster, dataset, data_type, self.nodata_value)
+        output_band = output_dataset.GetRasterBand(1)
+        for xoff, yoff, xsize, ysize in block_windows(input_band):
+            output_band.WriteArray(self.apply(input_band.ReadAsArray(xoff, yoff, xsize, ysize)), xoff, yoff)
+
+        # flush the cache to save the output raster
+        output_band.FlushCache()
+        output_dataset.FlushCache()
+        dataset = None
+        output_dataset = None
+
+        return output_raster
@@ -0,0 +1,85 @@
+import os
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from typing import Callable
+import psutil
+from osgeo import gdal
+from rich import print
+
+# share of the available memory that concurrent years are allowed to use
+MEMORY_FRACTION = 0.8
+
+def estimate_raster_memory(raster_path:str, bytes_per_pixel:float) -> int:
+    """
+    Estimates the peak memory used to process a raster from its size.
+
+    Args:
+        raster_path (str): path to the raster dataset (e.g. LULC or impedance dataset of the year)
+        bytes_per_pixel (float): bytes held in memory per pixel of the raster by the processing step (sum of the full arrays it allocates)
+
+    Returns:
+        int: estimated peak memory in bytes (0 if the raster can't be opened)
+    """
+    ds = gdal.Open(raster_path)
+    if ds is None:
+        return 0
+    memory = int(ds.RasterXSize * ds.RasterYSize * bytes_per_pixel)
+    ds = None
+    return memory
+
+def memory_aware_jobs(jobs:int, memory_per_job:int=None, memory_fraction:float=MEMORY_FRACTION) -> int:
+    """
+    Caps the number of concurrent jobs by the number of CPUs and by the available memory.
+
+    Args:
+        jobs (int): requested number of concurrent jobs
+        memory_per_job (int): estimated peak memory of one job in bytes (optional, memory is not checked if None)
+        memory_fraction (float): share of the available memory that the jobs are allowed to use (default is 0.8)
+
+    Returns:
+        int: number of concurrent jobs (at least 1)
+    """
+    jobs = min(jobs, os.cpu_count() or 1)
+    if memory_per_job:
+        available = psutil.virtual_memory().available * memory_fraction
+        memory_jobs = int(available // memory_per_job)
+        if memory_jobs < jobs:
+            print(f"[yellow] Concurrent jobs are limited to {max(memory_jobs, 1)} by the available memory ({available / 2**30:.1f} GiB for {memory_per_job / 2**30:.1f} GiB per job) [/yellow]")
+        jobs = min(jobs, memory_jobs)
+    return max(jobs, 1)
+
+def run_per_year(task:Callable, years:list, args:tuple=(), jobs:int=1, memory_per_job:int=None) -> dict:
+    """
+    Runs the pipeline of each year in a pool of processes, as years are independent once shared inputs exist.
+    The task must be a module-level function (to be sent to worker processes) taking the year as the first argument.
+
+    Args:
+        task (Callable): function processing one year, called as task(year, *args)
+        years (list): years to process
+        args (tuple): other arguments passed to the task
+        jobs (int): maximum number of years processed concurrently (1 processes years sequentially in the current process)
+        memory_per_job (int): estimated peak memory of one year in bytes, used to cap the number of concurrent years (optional)
+
+    Returns:
+        dict: results of the task for each year
+    """
+    jobs = memory_aware_jobs(min(jobs, len(years)), memory_per_job) if years else 1
+    if jobs == 1:
+        return {year: task(year, *args) for year in years}
+
+    print(f"Processing {len(years)} years with {jobs} concurrent jobs...")
+    results = {}
+    errors = {}
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(task, year, *args): year for year in years}
+        for future in as_completed(futures):
+            year = futures[future]
+            try:
+                results[year] = future.result()
+                print(f"[green] Processing complete for year: {year} [/green]")
+            except Exception as e:
+                errors[year] = e
+                print(f"[bold red] Processing failed for year {year}: {e} [/bold red]")
+
+    if errors:
+        raise RuntimeError(f"Processing failed for years: {sorted(errors)}") from next(iter(errors.values()))
+    return {year: results[year] for year in years}
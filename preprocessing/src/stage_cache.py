@@ -0,0 +1,171 @@
+import os
+import json
+import hashlib
+import inspect
+from typing import Callable
+from rich import print
+
+class StageCache():
+    """
+    Skips pipeline stages whose inputs, parameters and code are unchanged since they last produced their outputs.
+    The key of a stage is a SHA-256 hash of the contents of its input files, its parameters (e.g. decay parameters of a stressor)
+    and the source code of the modules implementing it. Keys and outputs of completed stages are recorded in a manifest,
+    with one JSON file per stage, so that stages running in different processes don't overwrite each other's records.
+    """
+    # size of the chunks read to hash files
+    CHUNK_SIZE = 2**20
+
+    def __init__(self, cache_dir:str, enabled:bool=True) -> None:
+        """
+        Initializes the cache and loads the hashes of files computed by previous runs.
+
+        Args:
+            cache_dir (str): path to the directory of the manifest
+            enabled (bool): whether stages can be skipped (if False, stages are always run, but still recorded)
+        """
+        self.cache_dir = cache_dir
+        self.enabled = enabled
+        self.manifest_dir = os.path.join(cache_dir, "manifest")
+        os.makedirs(self.manifest_dir, exist_ok=True)
+        # hashes of files are reused while their size and modification time are unchanged
+        self.file_hashes_path = os.path.join(cache_dir, "file_hashes.json")
+        self.file_hashes = self.read_json(self.file_hashes_path) or {}
+
+    @staticmethod
+    def read_json(path:str) -> dict:
+        """
+        Reads a JSON file, returning None if it doesn't exist or is corrupted.
+        """
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    @staticmethod
+    def write_json(data:dict, path:str) -> None:
+        """
+        Writes a JSON file under a temporary name and moves it to its final name, so that readers never see incomplete files.
+        """
+        temp_path = f"{path}.{os.getpid()}.part"
+        with open(temp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+        os.replace(temp_path, path)
+
+    def hash_file(self, path:str) -> str:
+        """
+        Computes the SHA-256 hash of the contents of a file (reused from previous runs if the file is unchanged).
+
+        Args:
+            path (str): path to the file
+
+        Returns:
+            str: hexadecimal hash, or None if the file doesn't exist
+        """
+        path = os.path.abspath(path)
+        if not os.path.isfile(path):
+            return None
+        stat = os.stat(path)
+        cached = self.file_hashes.get(path)
+        if cached is not None and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['sha256']
+
+        sha256 = hashlib.sha256()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(self.CHUNK_SIZE), b''):
+                sha256.update(chunk)
+        self.file_hashes[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha256': sha256.hexdigest()}
+        return sha256.hexdigest()
+
+    def hash_code(self, code:list) -> dict:
+        """
+        Computes the hashes of the source files of modules, classes or functions, so that stages are re-run when their code changes.
+
+        Args:
+            code (list): modules, classes or functions implementing the stage
+
+        Returns:
+            dict: hashes of the source files
+        """
+        source_files = sorted({inspect.getsourcefile(item) for item in code})
+        return {os.path.basename(source_file): self.hash_file(source_file) for source_file in source_files}
+
+    def stage_key(self, inputs:list, params:dict=None, code:list=()) -> str:
+        """
+        Computes the key of a stage from its inputs, parameters and code.
+
+        Args:
+            inputs (list): paths to the input files
+            params (dict): parameters of the stage (must be serializable to JSON, other values are converted to strings)
+            code (list): modules, classes or functions implementing the stage
+
+        Returns:
+            str: hexadecimal key of the stage
+        """
+        description = {
+            'inputs': {os.path.abspath(path): self.hash_file(path) for path in inputs},
+            'params': params or {},
+            'code': self.hash_code(code)
+        }
+        return hashlib.sha256(json.dumps(description, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+
+    def entry_path(self, stage:str) -> str:
+        """
+        Returns the path to the manifest entry of a stage.
+        """
+        return os.path.join(self.manifest_dir, hashlib.sha256(stage.encode('utf-8')).hexdigest()[:32] + ".json")
+
+    def is_fresh(self, stage:str, key:str) -> bool:
+        """
+        Checks whether a stage was completed with the same key and its outputs are unchanged since.
+
+        Args:
+            stage (str): unique name of the stage
+            key (str): current key of the stage
+
+        Returns:
+            bool: True if the stage can be skipped
+        """
+        entry = self.read_json(self.entry_path(stage))
+        if not self.enabled or entry is None or entry.get('key') != key:
+            return False
+        return all(self.hash_file(path) == output_hash for path, output_hash in entry['outputs'].items())
+
+    def record(self, stage:str, key:str, outputs:list) -> None:
+        """
+        Records the key and the outputs of a completed stage in the manifest.
+
+        Args:
+            stage (str): unique name of the stage
+            key (str): key of the stage
+            outputs (list): paths to the output files
+        """
+        entry = {'stage': stage, 'key': key, 'outputs': {os.path.abspath(path): self.hash_file(path) for path in outputs}}
+        self.write_json(entry, self.entry_path(stage))
+        # merge with the hashes recorded by other processes in the meantime
+        file_hashes = self.read_json(self.file_hashes_path) or {}
+        file_hashes.update(self.file_hashes)
+        self.write_json(file_hashes, self.file_hashes_path)
+
+    def run(self, stage:str, func:Callable, inputs:list, outputs:list, params:dict=None, code:list=()) -> any:
+        """
+        Runs a stage unless its inputs, parameters and code are unchanged since it produced its outputs.
+
+        Args:
+            stage (str): unique name of the stage (e.g. the stressor and the year)
+            func (Callable): function running the stage (called without arguments)
+            inputs (list): paths to the input files
+            outputs (list): paths to the output files
+            params (dict): parameters of the stage
+            code (list): modules, classes or functions implementing the stage
+
+        Returns:
+            any: the result of the function, or None if the stage was skipped
+        """
+        if self.is_fresh(stage, self.stage_key(inputs, params, code)):
+            print(f"[green] Stage {stage} is up to date, skipping... [/green]")
+            return None
+        result = func()
+        # inputs can be modified by the stage itself (e.g. reprojected in place), so the key is computed again
+        self.record(stage, self.stage_key(inputs, params, code), outputs)
+        return result
@@ -1,7 +1,11 @@
-from osgeo import ogr
+from osgeo import ogr, gdal
+from typing import Iterator
 import yaml
 import os
 
+# creation options for GeoTIFFs written block by block (tiled and compressed on first write)
+TILED_GTIFF_OPTIONS = ['TILED=YES', 'COMPRESS=LZW', 'BIGTIFF=IF_SAFER']
+
 def load_yaml(path:str) -> dict:
         """
         Load a yaml file from the given path to a dictionary
@@ -149,4 +153,55 @@ def read_years_from_config(config:dict) -> list[int]:
         return [years]
     else:
         # cast to list
-        return [int(year) for year in years]
\ No newline at end of file
+        return [int(year) for year in years]
+
+
+def block_windows(band:gdal.Band, min_rows:int=256) -> Iterator[tuple[int, int, int, int]]:
+    """
+    Yields the windows (x offset, y offset, columns, rows) of a raster band following its native block layout.
+    Strip-organised rasters (blocks spanning the whole width) are grouped into windows of at least min_rows rows, 
+    so that tiled outputs are written in complete tiles.
+
+    Args:
+        band (gdal.Band): raster band to iterate over
+        min_rows (int): minimum number of rows per window for strip-organised rasters (default is 256)
+
+    Returns:
+        Iterator[tuple]: windows as (xoff, yoff, xsize, ysize)
+    """
+    x_size, y_size = band.XSize, band.YSize
+    block_x, block_y = band.GetBlockSize()
+    # group strips (e.g. 1-row blocks of untiled GeoTIFFs) into bigger windows
+    if block_x >= x_size and block_y < min_rows:
+        block_y = -(-min_rows // block_y) * block_y
+    for yoff in range(0, y_size, block_y):
+        rows = min(block_y, y_size - yoff)
+        for xoff in range(0, x_size, block_x):
+            cols = min(block_x, x_size - xoff)
+            yield xoff, yoff, cols, rows
+
+
+def create_tiled_raster(output_path:str, template_ds:gdal.Dataset, data_type:int, nodata_value:float=None, band_count:int=1, sparse:bool=False) -> gdal.Dataset:
+    """
+    Creates a tiled, compressed GeoTIFF with the same grid (size, geotransform and projection) as the template dataset.
+
+    Args:
+        output_path (str): path to the output GeoTIFF
+        template_ds (gdal.Dataset): dataset to copy the grid from
+        data_type (int): GDAL data type of the output raster (e.g. gdal.GDT_Int32)
+        nodata_value (float): no data value of the output raster (optional)
+        band_count (int): number of bands (default is 1)
+        sparse (bool): flag to leave blocks which are entirely no data out of the file (default is False)
+
+    Returns:
+        gdal.Dataset: output dataset opened in write mode
+    """
+    driver = gdal.GetDriverByName('GTiff')
+    options = TILED_GTIFF_OPTIONS + ['SPARSE_OK=TRUE'] if sparse else TILED_GTIFF_OPTIONS
+    out_ds = driver.Create(output_path, template_ds.RasterXSize, template_ds.RasterYSize, band_count, data_type, options)
+    out_ds.SetGeoTransform(template_ds.GetGeoTransform())
+    out_ds.SetProjection(template_ds.GetProjection())
+    if nodata_value is not None:
+        for i in range(1, band_count + 1):
+            out_ds.GetRasterBand(i).SetNoDataValue(nodata_value)
+    return out_ds
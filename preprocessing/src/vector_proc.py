@@ -3,6 +3,8 @@ from osgeo import ogr
 import warnings
 from subprocess import Popen, PIPE
 import shutil
+# local imports
+from geometry_validation import GeometryValidator
 
 class VectorTransform:
     def __init__(self, directory):
@@ -82,49 +84,25 @@ class VectorTransform:
 
             # get the number of layers in Geopackage
             num_layers = data_source.GetLayerCount()
-            # initialize counters for invalid geometries
-            invalid_features = 0
-            # initialize list to write down IDs of invalid geometries
-            invalid_features_list = []
-            # initialize flag for geometry validity
-            any_invalid_geometry = False
-
             invalid_layers = {}  # to store invalid layers
             
-            # iterate through each layer
+            # iterate through each layer (geometries of a layer are checked in bulk)
             for i in range(num_layers):
                 layer = data_source.GetLayerByIndex(i)
                 layer_name = layer.GetName()
-                # calculate the total number of features in the layer
-                total_features = layer.GetFeatureCount()
-                
-                # iterate through each feature in the layer
-                for feature in layer:
-                    total_features += 1 # increment the number of total fearu
-                    geometry = feature.GetGeometryRef()
-                    
-                    if geometry is None: # skip issue with 'Error: 'NoneType' object has no attribute 'IsValid'
-                        print(f"Warning: Feature ID {feature.GetFID()} in layer '{layer_name}' has no geometry.")
-                        continue
-                    
-                    if not geometry.IsValid():
-                        invalid_features += 1
-                        
-                        any_invalid_geometry = True
-                        invalid_features_list.append(feature.GetFID())
-                        """print(f"Invalid geometry found in file '{filename}', layer '{layer_name}':")"""
-                        # print(f"Feature ID: {feature.GetFID()}")
-                        """print(f"Geometry: {geometry.ExportToWkt()}")""" # to print geometry - dropped, as provides massive text
+                counts = GeometryValidator().check_layer(layer)
+                if counts["missing"] > 0:
+                    print(f"Warning: {counts['missing']} features in layer '{layer_name}' have no geometry.")
 
                 # output validity status
-                if any_invalid_geometry:
+                if counts["invalid"] > 0:
                     # calculate share of invalid geometries
-                    share_invalid = (invalid_features / total_features) * 100 # if invalid_features > 0:
+                    share_invalid = (counts["invalid"] / counts["features"]) * 100
                     # raise warning
                     warning_message = (
                         f"At least one geometry in GeoPackage '{filename}' (layer '{layer_name}') is invalid. It might bring extra omissions in the further processing.\n"
-                        f"Share of invalid geometries in GeoPackage '{filename}', layer '{layer_name}': {share_invalid:.4f}%.\n"
-                        f"IDs of invalid features are: {invalid_features_list}."
+                        f"Share of invalid geometries in GeoPackage '{filename}', layer '{layer_name}': {share_invalid:.4f}% ({counts['invalid']} of {counts['features']} features).\n"
+                        f"IDs of invalid features are: {counts['invalid_fids']}."
                     )
                     warnings.warn(warning_message)
                     print("-"*40)  # separator for readability
@@ -142,48 +120,22 @@ class VectorTransform:
         return invalid_files
         
 
-    def fix_geometry_layer(self, layer:any,layer_name:any):
-        # iterate over all features in the layer
-        feature_to_fix_count = 0
-        fixed_feature_count = 0
-        invalid_feature_count = 0
-
-        for feature in layer:
-            geometry = feature.GetGeometryRef()
-            
-            if geometry is None: # skip issue with 'Error: 'NoneType' object has no attribute 'IsValid'
-                print(f"Warning: Feature ID {feature.GetFID()} in layer '{layer_name}' has no geometry.")
-                continue
-            
-            if not geometry.IsValid():
-                feature_to_fix_count += 1 # increment the number of features to be fixed
-                # attempt to fix the geometry
-                fixed_geometry = geometry.MakeValid()
-                
-                if geometry is None: # skip issue with 'Error: 'NoneType' object has no attribute 'IsValid'
-                    print(f"Warning: Feature ID {feature.GetFID()} in layer '{layer_name}' has no geometry.")
-                    continue
-                
-
-                if fixed_geometry.IsValid():
-                    # replace the geometry with the fixed one
-                    feature.SetGeometry(fixed_geometry)
-                    layer.SetFeature(feature)  # save the updated feature back to the layer
-                    print(f"Fixed invalid geometry in layer '{layer_name}', feature ID: {feature.GetFID()}")
-                    fixed_feature_count += 1 # increment the number of fixed features
-                else:
-                    print(f"Could not fix geometry in layer '{layer_name}', feature ID: {feature.GetFID()}")
-                    invalid_feature_count += 1 # increment the number of features that cannot be fixed
+    def fix_geometry_layer(self, data_source:ogr.DataSource, layer_name:str) -> bool:
+        """
+        Repairs the invalid geometries of a layer in bulk (see GeometryValidator.fix_layer).
 
-        # estin 
-        if feature_to_fix_count == 0:
+        Returns:
+        - bool: True if all geometries of the layer are valid after the repair.
+        """
+        counts = GeometryValidator().fix_layer(data_source, layer_name)
+        if counts["invalid"] == 0:
             print (f"All geometries of features in the layer '{layer_name}' of the output vector are valid.")
             print("-" * 40)
             return True
         else:
-            print(f"Layer '{layer_name}: {fixed_feature_count} geometries fixed.")
-            if invalid_feature_count > 0:
-                print(f"Layer '{layer_name}': {invalid_feature_count} geometries could not be fixed.")
+            print(f"Layer '{layer_name}: {counts['fixed']} of {counts['invalid']} invalid geometries fixed.")
+            if counts["unfixable"] > 0:
+                print(f"Layer '{layer_name}': {counts['unfixable']} geometries could not be fixed.")
                 print("-" * 40)
                 return False
             return True
@@ -214,9 +166,8 @@ class VectorTransform:
                 # if invalid layers are not specified, fix all layers
                 if layers is None:
                     for i in range(data_source.GetLayerCount()):
-                        layer = data_source.GetLayerByIndex(i)
-                        layer_name = layer.GetName()
-                        is_valid = self.fix_geometry_layer(layer, layer_name)
+                        layer_name = data_source.GetLayerByIndex(i).GetName()
+                        is_valid = self.fix_geometry_layer(data_source, layer_name)
                         if is_valid == False:
                             raise Exception(f"{layer_name} still contains invalid geometries")
                 else:
@@ -224,8 +175,7 @@ class VectorTransform:
                         if not invalid:
                             continue
                         else:
-                            layer = data_source.GetLayerByName(layer_name)
-                            is_valid = self.fix_geometry_layer(layer, layer_name)
+                            is_valid = self.fix_geometry_layer(data_source, layer_name)
                         if is_valid == False:
                             raise Exception(f"{layer_name} still contains invalid geometries")
 